@@ -6,27 +6,18 @@ API密钥管理器 - 云端版本
 
 import json
 import os
-import sqlite3
-from datetime import datetime
+import sys
 from http.server import BaseHTTPRequestHandler
 import urllib.parse as urlparse
 
-# 数据库初始化
-def init_database():
-    """初始化数据库"""
-    conn = sqlite3.connect('/tmp/keys.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS api_keys (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            service TEXT UNIQUE NOT NULL,
-            key TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# 共享存储后端，默认使用 /tmp 下的sqlite数据库（/tmp/keys.db）
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from storage import create_key_store
+
+store = create_key_store(
+    os.getenv("KEY_STORE_BACKEND", "sqlite"), os.getenv("KEY_STORE_PATH"), directory="/tmp"
+)
 
 class handler(BaseHTTPRequestHandler):
     """Vercel服务器less函数处理器"""
@@ -75,13 +66,7 @@ class handler(BaseHTTPRequestHandler):
     def serve_get_keys(self):
         """获取所有密钥"""
         try:
-            conn = sqlite3.connect('/tmp/keys.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT service, key FROM api_keys')
-            results = cursor.fetchall()
-            conn.close()
-            
-            keys = {service: key for service, key in results}
+            keys = store.items()
             self.send_json_response(keys)
         except Exception as e:
             self.send_json_response({"error": str(e)}, 500)
@@ -89,14 +74,9 @@ class handler(BaseHTTPRequestHandler):
     def serve_get_key(self, service):
         """获取特定密钥"""
         try:
-            conn = sqlite3.connect('/tmp/keys.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT key FROM api_keys WHERE service = ?', (service,))
-            result = cursor.fetchone()
-            conn.close()
+            key = store.get(service)
             
-            if result:
-                key = result[0]
+            if key:
                 response = {
                     "service": service,
                     "key": key[:8] + "..." if len(key) > 8 else "***",
@@ -119,14 +99,7 @@ class handler(BaseHTTPRequestHandler):
             key = data.get('key')
             
             if service and key:
-                conn = sqlite3.connect('/tmp/keys.db')
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO api_keys (service, key, updated_at)
-                    VALUES (?, ?, ?)
-                ''', (service, key, datetime.now()))
-                conn.commit()
-                conn.close()
+                store.set(service, key)
                 
                 response = {
                     "service": service,
@@ -142,11 +115,7 @@ class handler(BaseHTTPRequestHandler):
     def serve_delete_key(self, service):
         """删除密钥"""
         try:
-            conn = sqlite3.connect('/tmp/keys.db')
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM api_keys WHERE service = ?', (service,))
-            conn.commit()
-            conn.close()
+            store.delete(service)
             
             response = {
                 "service": service,
@@ -481,6 +450,3 @@ print(response.json())</code></pre>
         self.send_header('Content-Length', str(len(response)))
         self.end_headers()
         self.wfile.write(response)
-
-# 初始化数据库
-init_database()
\ No newline at end of file
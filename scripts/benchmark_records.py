@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+密钥记录内存基准
+测量真实 APIKeyManager 加载配置后常驻内存的大小：
+  - APIKeyManager:            只有配置快照（记录表在首次访问前不构建）
+  - APIKeyManager+records():  配置快照加上KeyRecord记录表
+
+两者之差即记录表在配置之上额外占用的内存。
+
+用法: python scripts/benchmark_records.py [--sizes 100000,1000000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from api_key_manager import APIKeyManager
+
+ENDPOINTS = [
+    "https://api.openai.com/v1",
+    "https://api.anthropic.com",
+    "https://newsapi.org/v2",
+    "https://api.openweathermap.org/data/2.5",
+]
+
+
+def write_config(path: str, count: int):
+    """生成包含count个服务的配置文件"""
+    config = {"api_keys": {}, "endpoints": {}, "rates": {}}
+    for i in range(count):
+        service = f"service_{i:07d}"
+        config["api_keys"][service] = f"sk-{i:040d}"
+        config["endpoints"][service] = ENDPOINTS[i % len(ENDPOINTS)]
+        config["rates"][service] = {"rpm": 60, "tpm": 90000}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+
+
+def measure(load) -> tuple:
+    """返回 (常驻字节数, 耗时秒)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result.close()
+    del result
+    return current, elapsed
+
+
+def load_manager(path: str) -> APIKeyManager:
+    return APIKeyManager(path)
+
+
+def load_manager_with_records(path: str) -> APIKeyManager:
+    manager = APIKeyManager(path)
+    manager.records()
+    return manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KeyRecord内存基准")
+    parser.add_argument("--sizes", default="100000,1000000", help="逗号分隔的服务数量")
+    args = parser.parse_args()
+
+    print(f"{'服务数':>10} {'模型':<26} {'总内存(MB)':>12} {'每个密钥(B)':>12} {'加载(s)':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "api_config.json")
+        for count in (int(size) for size in args.sizes.split(",")):
+            write_config(path, count)
+            for name, load in (("APIKeyManager", load_manager),
+                               ("APIKeyManager+records()", load_manager_with_records)):
+                size, elapsed = measure(lambda: load(path))
+                print(f"{count:>10} {name:<26} {size / 1024 / 1024:>12.1f} "
+                      f"{size / count:>12.0f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,17 @@ from pathlib import Path
 import urllib.parse
 from datetime import datetime
 
+_health_checker = None
+
+def get_health_checker(config):
+    """进程内共享的健康检查引擎（复用keep-alive连接和结果缓存）"""
+    global _health_checker
+    if _health_checker is None:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+        from health_check import HealthChecker
+        _health_checker = HealthChecker.from_config(config)
+    return _health_checker
+
 class APIKeyManagerHandler(http.server.SimpleHTTPRequestHandler):
     """自定义HTTP请求处理器"""
     
@@ -146,14 +157,31 @@ class APIKeyManagerHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(500, str(e))
     
     def handle_test_key(self):
-        """处理密钥测试请求"""
+        """处理密钥测试请求：请求服务配置的endpoint验证密钥"""
         service = self.path.split('/')[-2]
         
-        response = {
-            "status": "success",
-            "message": f"{service} 密钥测试成功",
-            "service": service
-        }
+        config = {}
+        if os.path.exists('config/api_config.json'):
+            with open('config/api_config.json', 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        key = os.getenv(f"{service.upper()}_API_KEY") or config.get('api_keys', {}).get(service)
+        endpoint = config.get('endpoints', {}).get(service)
+        
+        if not key:
+            response = {"status": "failed", "message": f"{service} 密钥未设置", "service": service}
+        elif not endpoint:
+            response = {"status": "success", "message": f"{service} 密钥已设置（未配置endpoint，未验证）",
+                        "service": service}
+        else:
+            result = get_health_checker(config).check_sync(service, key, endpoint)
+            ok = result["status"] == "valid"
+            response = {
+                "status": "success" if ok else "failed",
+                "message": f"{service} 密钥测试{'成功' if ok else '失败'}",
+                "service": service,
+                "http_status": result.get("http_status"),
+                "latency_ms": result.get("latency_ms")
+            }
         
         response_json = json.dumps(response, ensure_ascii=False)
         
@@ -9,80 +9,54 @@ import os
 import sys
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-import sqlite3
 import base64
-from datetime import datetime
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from storage import create_key_store
 
 class APIKeyManager:
     """简化版API密钥管理器"""
     
     def __init__(self):
         self.config_file = "config/api_config.json"
-        self.db_file = "data/keys.db"
-        self.init_database()
-    
-    def init_database(self):
-        """初始化数据库"""
-        os.makedirs("data", exist_ok=True)
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS api_keys (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                service TEXT UNIQUE NOT NULL,
-                key TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        # 未指定KEY_STORE_PATH时各后端使用 data/ 下各自的默认文件
+        self.store = create_key_store(
+            os.getenv("KEY_STORE_BACKEND", "sqlite"), os.getenv("KEY_STORE_PATH"), directory="data"
+        )
     
     def set_api_key(self, service, key):
         """设置API密钥"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO api_keys (service, key, updated_at)
-            VALUES (?, ?, ?)
-        ''', (service, key, datetime.now()))
-        conn.commit()
-        conn.close()
+        self.store.set(service, key)
     
     def get_api_key(self, service):
         """获取API密钥"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('SELECT key FROM api_keys WHERE service = ?', (service,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        return self.store.get(service)
     
     def list_all_keys(self):
         """列出所有密钥"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('SELECT service, key FROM api_keys')
-        results = cursor.fetchall()
-        conn.close()
-        return {service: key for service, key in results}
+        return self.store.items()
     
     def remove_api_key(self, service):
         """删除API密钥"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM api_keys WHERE service = ?', (service,))
-        conn.commit()
-        conn.close()
+        self.store.delete(service)
+
+_manager = None
+
+def get_manager():
+    """进程内共享一个管理器，复用存储后端的连接"""
+    global _manager
+    if _manager is None:
+        _manager = APIKeyManager()
+    return _manager
 
 class WebInterfaceHandler(SimpleHTTPRequestHandler):
     """自定义Web界面处理器"""
     
     def __init__(self, *args, **kwargs):
-        self.manager = APIKeyManager()
+        self.manager = get_manager()
         super().__init__(*args, **kwargs)
     
     def do_GET(self):
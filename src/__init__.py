@@ -6,7 +6,7 @@ __version__ = "1.0.0"
 __author__ = "API Key Manager Team"
 __email__ = "support@apikeymanager.com"
 
-from .api_key_manager import APIKeyManager
+from .api_key_manager import APIKeyManager, AsyncAPIKeyManager
 from .web_interface import create_app
 
-__all__ = ["APIKeyManager", "create_app"]
\ No newline at end of file
+__all__ = ["APIKeyManager", "AsyncAPIKeyManager", "create_app"]
\ No newline at end of file
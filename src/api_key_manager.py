@@ -6,17 +6,293 @@ API密钥管理工具
 
 import os
 import json
-from typing import Dict, Any, Optional
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, AsyncIterator, Iterable, List, Optional, Sequence, Tuple, Union
+
+# 参与构建KeyRecord的配置节
+RECORD_SECTIONS = ("api_keys", "endpoints", "rates", "metadata")
 
 class APIKeyManager:
-    def __init__(self, config_path: str = "config/api_config.json"):
+    def __init__(self, config_path: str = "config/api_config.json",
+                 backend: str = "json", compact_threshold: int = 1000,
+                 group_commit_window: Optional[float] = None,
+                 key_store=None, multiprocess: bool = False,
+                 shared_cache: Optional[str] = None, history: bool = False,
+                 usage_path: Optional[str] = None, rate_limit_url: Optional[str] = None,
+                 breaker_path: Optional[str] = None, rotation: bool = False,
+                 encryption_key: Union[str, Sequence[str], None] = None,
+                 owner_index: bool = False):
+        """
+        backend:
+          - "json": 每次变更整体重写配置文件
+          - "journal": 变更追加到日志文件，后台定期压缩为快照
+        group_commit_window:
+          json后端可选的组提交窗口（秒）。设置后由专用写入线程把窗口内的
+          多次保存合并为一次原子写入，变更方法返回可等待落盘的Future
+        key_store:
+          可选的storage.KeyStore实例。设置后密钥直接从该后端读写（不整体加载到内存），
+          配置文件只保存endpoints/rates等其余配置。
+          多进程模式下各进程的存储实例自行同步（json/mmap/sharded后端持有各自的文件锁，
+          sqlite由数据库保证），只在进程内可见的memory后端不能与multiprocess同时使用
+        multiprocess:
+          多个进程（如多个uvicorn worker）共享同一配置文件。写操作持有
+          <config_path>.lock 上的跨进程文件锁，并在修改前同步其它进程的变更；
+          读操作先stat检查文件是否变化，只在变化时重新加载（日志后端只重放新增部分）
+        shared_cache:
+          共享内存缓存段名称。密钥表序列化一次放入共享内存，同一主机上的worker
+          零拷贝读取；启动时和每次写操作后发布新段并递增版本号。多个worker都会写入时应同时启用multiprocess
+        history:
+          记录密钥版本历史到 <config_path>.history（追加式增量），
+          支持 get_api_key(service, as_of=...) 时间点查询和 rollback(service, version)
+        usage_path:
+          用量统计文件。设置后最近一分钟/一小时/一天的用量定期写入该文件，重启后继续累计；
+          不设置时只在内存中统计
+        rate_limit_url:
+          Redis地址（redis://host:port/db）。设置后限流状态保存在Redis中由多个副本共享，
+          Redis不可用时自动退回进程内限流
+        breaker_path:
+          熔断器状态文件，各worker映射同一文件共享熔断状态。
+          多进程模式下默认为 <config_path>.breakers，否则熔断状态只在进程内
+        rotation:
+          按security.rotation_days跟踪密钥年龄，后台线程在密钥到期时触发
+          on_rotation_due注册的回调；上次轮换时间保存在 <config_path>.rotation。
+          不能与multiprocess同时启用
+        encryption_key:
+          静态加密密钥（Fernet密钥或任意口令，口令经PBKDF2派生，
+          盐在整个存储中共用并保存在security.kdf_salt）。设置后写入的密钥和密钥池以密文保存
+          （配置文件、日志、外部存储后端、共享内存和版本历史中都只有密文），
+          security.encrypt_keys为false时只解密不加密。加载时不解密，读取某个密钥时才解密；
+          加密前写入的明文值仍可读取，下次写入时加密。
+          传入多个密钥时用第一个加密，任意一个都可以解密（更换主密钥期间，见rekey）
+        owner_index:
+          维护 hash_key(密钥) -> 所属服务 的反查索引（<config_path>.owners，只保存摘要），
+          每次变更增量更新，find_owner(key) O(1)查出泄露的密钥属于哪个服务
+        
+        线程安全：self.config 是不可变快照，写操作在 self._lock 下复制出新快照
+        再整体替换引用（写时复制），读操作无需加锁，也不会看到写了一半的状态。
+        """
         self.config_path = config_path
-        self.config = self.load_config()
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._journal = None
+        self._writer = None
+        self._key_store = key_store
+        self._file_lock = None
+        self._file_state = None
+        self._transaction = None
+        self._records = (None, None)
+        self._history = None
+        # 服务名 -> (配置项, KeyPool)，配置项被替换后重建
+        self._pools: Dict[str, Tuple[Dict[str, Any], Any]] = {}
+        self._rate_limiter = None
+        # 限流器当前使用的rates节（配置快照中的对象）
+        self._limiter_rates = None
+        self._rate_limit_url = rate_limit_url
+        self._usage_path = usage_path
+        self._usage = None
+        self._health_checker = None
+        self._breaker = None
+        self._breaker_path = breaker_path or (f"{config_path}.breakers" if multiprocess else None)
+        self._rotation = None
+        if isinstance(encryption_key, (list, tuple)):
+            encryption_key = tuple(encryption_key) if len(encryption_key) > 1 else encryption_key[0]
+        self._encryption_key = encryption_key
+        self._encrypt_writes = False
+        # 主密钥已被其它进程更换（本进程的密钥都解不开security.key_check）时拒绝加密写入
+        self._stale_key = False
+        # 整个存储共用的口令派生盐（security.kdf_salt）
+        self._kdf_salt = None
+        self._secret_cache = None
+        self._owner_index = None
+        self.refresh_env()
+        if multiprocess:
+            if group_commit_window is not None:
+                raise ValueError("多进程模式不支持组提交")
+            if rotation:
+                # 各worker的调度堆和轮换时间文件无法互相同步，会触发已删除密钥的回调并互相覆盖
+                raise ValueError("多进程模式不支持密钥轮换调度，请在单独的单进程实例中启用rotation")
+            if key_store is not None and not getattr(key_store, "shared", True):
+                raise ValueError("多进程模式不支持只在进程内可见的存储后端")
+            from storage.file_lock import FileLock
+            self._file_lock = FileLock(f"{config_path}.lock")
+        if backend == "journal":
+            from storage.journal import JournalStore
+            self._journal = JournalStore(
+                config_path, compact_threshold=compact_threshold, shared=multiprocess
+            )
+        elif backend != "json":
+            raise ValueError(f"不支持的存储后端: {backend}")
+        
+        if self._file_lock is not None:
+            with self._file_lock:
+                self.config = self.load_config()
+        else:
+            self.config = self.load_config()
+        
+        if encryption_key is not None:
+            self._check_encryption_key(self.config)
+            security = self.config.get("security", {})
+            self._encrypt_writes = security.get("encrypt_keys", True) is not False
+            if self._encrypt_writes:
+                # 同一个口令只构造一次加密器、只派生一次密钥，之后的加密都复用它
+                self._kdf_salt = self._ensure_kdf_salt()
+            # 热路径读取命中解密缓存时无需再做HMAC校验和AES解密
+            from secret_cache import SecretCache
+            self._secret_cache = SecretCache(
+                max_size=security.get("decrypted_cache_size", 1024),
+                ttl=security.get("decrypted_cache_ttl", 300.0)
+            )
+        
+        self._shared_cache = None
+        if shared_cache:
+            from storage.shm_cache import SharedKeyCache
+            self._shared_cache = SharedKeyCache(shared_cache)
+            # 共享段不随进程退出删除，其中可能是上次运行时的旧密钥表（期间配置文件被修改过），
+            # 因此启动时总是从权威存储重新发布
+            with self._write_guard():
+                self._publish()
+        
+        if group_commit_window is not None:
+            if self._journal is not None:
+                raise ValueError("组提交模式仅支持json存储后端")
+            from storage.group_commit import GroupCommitWriter
+            self._writer = GroupCommitWriter(
+                config_path, self.snapshot, window=group_commit_window
+            )
+        
+        if history:
+            from storage.history import KeyHistory
+            self._history = KeyHistory(f"{config_path}.history", shared=multiprocess)
+            if not self._history.exists:
+                # 首次启用时把现有密钥记为各服务的版本1
+                with self._write_guard():
+                    if not self._history.exists:
+                        self._history.append(
+                            {service: key for service, key in self._source_keys().items() if key}
+                        )
+        
+        if owner_index:
+            from storage.owner_index import OwnerIndex
+            self._owner_index = OwnerIndex(f"{config_path}.owners", shared=multiprocess)
+            if not self._owner_index.exists:
+                # 首次启用时为现有密钥和密钥池建立索引
+                with self._write_guard():
+                    if not self._owner_index.exists:
+                        self._owner_index.update(self._owner_records())
+        
+        if self._breaker_path is not None:
+            # 共享熔断状态需要在启动时映射，其它worker打开的熔断器才能立即生效
+            self.circuit_breaker
+        
+        if rotation:
+            self._start_rotation()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """返回当前配置快照（只读，不要原地修改）"""
+        if self._file_lock is not None:
+            self._sync()
+        return self.config
+    
+    @contextmanager
+    def _write_guard(self):
+        """串行化写操作；多进程模式下同时持有跨进程文件锁，并先同步其它进程的变更"""
+        with self._lock:
+            if self._file_lock is None:
+                yield
+                return
+            with self._file_lock:
+                self._sync(locked=True)
+                yield
+    
+    def _stat_config(self):
+        """配置文件身份：原子替换后inode变化，原地重写后mtime/大小变化"""
+        try:
+            st = os.stat(self.config_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    
+    def _changed_on_disk(self) -> bool:
+        """其它进程是否修改了配置文件"""
+        if self._journal is not None:
+            return self._journal.changed()
+        return self._stat_config() != self._file_state
+    
+    def _sync(self, locked: bool = False):
+        """多进程模式下检测并加载其它进程的变更"""
+        if not self._changed_on_disk():
+            return
+        with self._lock:
+            if not self._changed_on_disk():
+                return
+            if self._journal is not None:
+                config = self._journal.refresh(self.config, recover=locked)
+            else:
+                config = self.load_config()
+            if config is not None:
+                self._adopt(config)
+    
+    def _adopt(self, config: Dict[str, Any]):
+        """采用其它进程写入的配置，并同步本进程为这些密钥设置过的环境变量"""
+        key_check = config.get("security", {}).get("key_check")
+        if key_check != self.config.get("security", {}).get("key_check"):
+            # 其它进程更换了主密钥：旧密文的解密结果全部作废，重新确定用哪个密钥加密
+            if self._secret_cache is not None:
+                self._secret_cache.clear()
+            self._pools.clear()
+            self._check_encryption_key(config)
+        old_keys = self.config.get("api_keys", {})
+        new_keys = config.get("api_keys", {})
+        if old_keys is not new_keys:
+            for service, old_value in old_keys.items():
+                new_value = new_keys.get(service)
+                if new_value == old_value:
+                    continue
+                self._purge_secrets((service,))
+                if self._stale_key:
+                    # 解不开新密文，环境变量保持不变
+                    continue
+                old_value = self._reveal(old_value)
+                if self._env_index.get(service.lower()) == old_value:
+                    if new_value is None:
+                        self._unset_env(service)
+                    else:
+                        self._set_env(service, self._reveal(new_value))
+        self.config = config
+    
+    def _replace_section(self, section: str, updates: Dict[str, Any] = None,
+                         removals=()) -> Dict[str, Any]:
+        """写时复制：生成包含变更的新快照并原子替换，调用方需持有 self._lock"""
+        config = dict(self.config)
+        values = dict(config.get(section, {}))
+        if updates:
+            values.update(updates)
+        for name in removals:
+            values.pop(name, None)
+        config[section] = values
+        
+        cached_config, cached = self._records
+        if cached_config is self.config and section in RECORD_SECTIONS:
+            # 记录表已构建时只更新变更的服务，不重新遍历全部服务
+            from key_records import update_records
+            self._records = (config, update_records(cached, config, [*(updates or ()), *removals]))
+        self.config = config
+        return config
     
     def load_config(self) -> Dict[str, Any]:
         """加载配置文件"""
+        if self._journal is not None:
+            config = self._journal.load()
+            return config if config is not None else self.create_default_config()
+        
         try:
             with open(self.config_path, 'r', encoding='utf-8') as f:
+                st = os.fstat(f.fileno())
+                self._file_state = (st.st_ino, st.st_mtime_ns, st.st_size)
                 return json.load(f)
         except FileNotFoundError:
             return self.create_default_config()
@@ -31,81 +307,973 @@ class APIKeyManager:
         self.save_config(default_config)
         return default_config
     
-    def save_config(self, config: Dict[str, Any] = None):
-        """保存配置"""
+    def save_config(self, config: Dict[str, Any] = None) -> Optional[Future]:
+        """保存配置，组提交模式下返回落盘后完成的Future"""
+        if self._writer is not None and (config is None or config is self.config):
+            return self._writer.submit()
+        
         config = config or self.config
+        if self._journal is not None:
+            # 日志模式下完整保存即一次同步压缩
+            self._journal.compact(config, background=False)
+            return None
+        
+        if self._writer is not None or self._file_lock is not None:
+            # 其它进程可能随时读取，必须原子替换
+            from storage.fileio import atomic_write_json
+            atomic_write_json(self.config_path, config, fsync=self._writer is not None)
+            self._file_state = self._stat_config()
+            return None
+        
         with open(self.config_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, indent=2, ensure_ascii=False)
     
-    def get_api_key(self, service: str) -> Optional[str]:
-        """获取API密钥"""
+    def _persist(self, op: str, section: str, name: str, value: Any = None) -> Optional[Future]:
+        """持久化单条变更"""
+        return self._persist_many([(op, section, name, value)])
+    
+    def _persist_many(self, changes: List[Tuple[str, str, str, Any]]) -> Optional[Future]:
+        """持久化一批变更 (op, section, name, value)，只写一次"""
+        if self._journal is None:
+            return self.save_config()
+        
+        self._journal.append_many(changes)
+        if self._journal.needs_compaction():
+            # 多进程模式下必须在持有文件锁时完成压缩，不能留给后台线程
+            self._journal.compact(self.config, background=self._file_lock is None)
+        return None
+    
+    def close(self):
+        """释放存储资源"""
+        if self._writer is not None:
+            self._writer.close()
+        if self._journal is not None:
+            self._journal.close()
+        if self._shared_cache is not None:
+            self._shared_cache.close()
+        if self._history is not None:
+            self._history.close()
+        if self._usage is not None:
+            self._usage.close()
+        if self._rate_limiter is not None and hasattr(self._rate_limiter, "close"):
+            self._rate_limiter.close()
+        if self._health_checker is not None:
+            self._health_checker.close()
+        if self._breaker is not None:
+            self._breaker.close()
+        if self._rotation is not None:
+            self._rotation.stop()
+        if self._owner_index is not None:
+            self._owner_index.close()
+    
+    def refresh_env(self):
+        """重新扫描os.environ，重建 服务名 -> 值 的环境变量索引
+
+        索引在启动时构建一次，之后由set_api_key/remove_api_key同步维护；
+        进程在运行中被外部修改了 *_API_KEY 环境变量时需调用本方法或invalidate_env。
+        """
+        index = {}
+        for env_key in list(os.environ):
+            if not env_key.endswith("_API_KEY"):
+                continue
+            value = os.environ.get(env_key)
+            if value is not None:
+                index[env_key[:-len("_API_KEY")].lower()] = value
+        self._env_index = index
+    
+    def invalidate_env(self, service: str):
+        """从os.environ重新读取单个服务的环境变量"""
+        value = os.environ.get(f"{service.upper()}_API_KEY")
+        index = dict(self._env_index)
+        if value is None:
+            index.pop(service.lower(), None)
+        else:
+            index[service.lower()] = value
+        self._env_index = index
+    
+    def _set_env(self, service: str, value: str):
+        """设置环境变量并同步索引（写时复制，读取方无需加锁）"""
+        os.environ[f"{service.upper()}_API_KEY"] = value
+        index = dict(self._env_index)
+        index[service.lower()] = value
+        self._env_index = index
+    
+    def _unset_env(self, service: str):
+        """删除环境变量并同步索引"""
+        os.environ.pop(f"{service.upper()}_API_KEY", None)
+        if service.lower() in self._env_index:
+            index = dict(self._env_index)
+            del index[service.lower()]
+            self._env_index = index
+    
+    def get_api_key(self, service: str, as_of: Union[datetime, float, None] = None) -> Optional[str]:
+        """获取API密钥
+
+        as_of为datetime或时间戳时返回该时刻存储中的值（需启用history，不含环境变量覆盖）。
+        """
+        if as_of is not None:
+            history = self._require_history()
+            if isinstance(as_of, datetime):
+                as_of = as_of.timestamp()
+            return self._reveal(history.value_at(service, as_of))
+        
+        if self._file_lock is not None:
+            self._sync()
+        
+        # 配置了密钥池时按策略选取
+        pool = self.get_key_pool(service)
+        if pool is not None:
+            breaker = self._breaker
+            if breaker is None:
+                return pool.select()
+            # 跳过熔断中的密钥
+            return pool.select(lambda key: breaker.allow(service, key))
+        
         # 优先从环境变量获取
-        env_key = f"{service.upper()}_API_KEY"
-        env_value = os.getenv(env_key)
+        env_index = self._env_index
+        env_value = env_index.get(service)
+        if env_value is None and not service.islower():
+            env_value = env_index.get(service.lower())
         if env_value:
             return env_value
         
-        # 从配置文件获取
-        return self.config.get("api_keys", {}).get(service)
+        # 从存储获取
+        return self._stored_key(service)
     
-    def set_api_key(self, service: str, key: str, save_to_file: bool = True):
-        """设置API密钥"""
-        if "api_keys" not in self.config:
-            self.config["api_keys"] = {}
+    def records(self) -> Dict[str, "KeyRecord"]:
+        """服务名 -> KeyRecord 记录表（只读）
+
+        记录表在首次访问时才构建（不访问时不占内存），之后每次写入只更新变更的服务。
+        快照被整体替换（其它进程的变更、回滚、更换主密钥）后首次访问时增量重建：
+        只为发生变更的服务创建新记录，其余记录沿用上一版。
+        """
+        config = self.snapshot()
+        cached_config, cached = self._records
+        if cached_config is config:
+            return cached
+        from key_records import build_records
+        records = build_records(config, cached, cached_config)
+        self._records = (config, records)
+        return records
+    
+    def get_record(self, service: str) -> Optional["KeyRecord"]:
+        """获取服务的完整记录（密钥、端点、速率限制、时间戳和元数据）
+
+        记录中的密钥是存储中的值，不含环境变量覆盖；
+        使用外部存储后端时密钥从后端读取。
+        """
+        record = self.records().get(service)
+        if self._key_store is None and self._shared_cache is None:
+            if record is not None and self._encryption_key is not None:
+                # 记录表中保存的是密文，取出单条记录时才解密
+                return record.replace(key=self._reveal_cached(service, record.key))
+            return record
+        
+        key = self._stored_key(service)
+        if record is None:
+            if key is None:
+                return None
+            from key_records import KeyRecord
+            return KeyRecord(service, key)
+        return record.replace(key=key)
+    
+    def get_key_pool(self, service: str) -> Optional["KeyPool"]:
+        """获取服务的密钥池，未配置时返回None"""
+        entry = self.config.get("key_pools", {}).get(service)
+        if entry is None:
+            return None
+        cached = self._pools.get(service)
+        if cached is not None and cached[0] is entry:
+            return cached[1]
+        
+        from key_pool import KeyPool
+        if self._encryption_key is not None:
+            pool = KeyPool.from_config(dict(entry, keys=self._reveal_many(entry["keys"])))
+        else:
+            pool = KeyPool.from_config(entry)
+        self._pools[service] = (entry, pool)
+        return pool
+    
+    def set_key_pool(self, service: str, keys: List[str], strategy: str = "round_robin",
+                     quotas: Optional[List[float]] = None) -> Optional[Future]:
+        """为服务配置密钥池（之后get_api_key按策略从池中选取）"""
+        from key_pool import KeyPool
+        # 先构建一次以校验参数
+        KeyPool(keys, strategy, quotas)
+        entry = {"keys": list(keys), "strategy": strategy}
+        if quotas is not None:
+            entry["quotas"] = list(quotas)
+        
+        transaction = self._active_transaction()
+        if transaction is not None:
+            transaction.pools[service] = entry
+            return None
+        return self._apply_changes({}, pools={service: entry})
+    
+    def remove_key_pool(self, service: str) -> Optional[Future]:
+        """删除服务的密钥池"""
+        transaction = self._active_transaction()
+        if transaction is not None:
+            transaction.pools[service] = None
+            return None
+        return self._apply_changes({}, pools={service: None})
+    
+    def report_usage(self, service: str, key: str, amount: float = 1):
+        """报告密钥池中某个密钥的用量（weighted策略据此调整选取权重）"""
+        pool = self.get_key_pool(service)
+        if pool is not None:
+            pool.record_usage(key, amount)
+    
+    @property
+    def rate_limiter(self) -> "RateLimiter":
+        """按rates配置限流的令牌桶限流器，配置变更后自动更新
+
+        配置了rate_limit_url时为多副本共享的RedisRateLimiter。
+        """
+        # 没有rates节时为None，与上次相同即无需更新
+        rates = self.config.get("rates")
+        limiter = self._rate_limiter
+        if limiter is None:
+            with self._lock:
+                if self._rate_limiter is None:
+                    if self._rate_limit_url:
+                        from redis_limiter import RedisRateLimiter
+                        self._rate_limiter = RedisRateLimiter(self._rate_limit_url, rates)
+                    else:
+                        from rate_limiter import RateLimiter
+                        self._rate_limiter = RateLimiter(rates)
+                    self._limiter_rates = rates
+                limiter = self._rate_limiter
+        if rates is not self._limiter_rates:
+            self._limiter_rates = rates
+            limiter.update_rates(rates)
+        return limiter
+    
+    def acquire(self, service: str, tokens: float = 0, blocking: bool = True,
+                timeout: Optional[float] = None, key: Optional[str] = None) -> bool:
+        """按 rates.{service}.rpm / tpm 获取一次请求配额和tokens个token
+
+        blocking为False时配额不足立即返回False；否则等待补充，超过timeout返回False。
+        key指定时按密钥单独限流（密钥池中的每个密钥有独立的桶）。
+        """
+        if blocking:
+            acquired = self.rate_limiter.acquire(service, tokens, key, timeout)
+        else:
+            acquired = self.rate_limiter.try_acquire(service, tokens, key)
+        if acquired:
+            self.usage.record(service, key, tokens=int(tokens))
+        return acquired
+    
+    @property
+    def usage(self) -> "UsageRecorder":
+        """按密钥的用量统计（acquire成功时自动记录）"""
+        usage = self._usage
+        if usage is None:
+            from usage_recorder import UsageRecorder
+            with self._lock:
+                if self._usage is None:
+                    self._usage = UsageRecorder(self._usage_path)
+                usage = self._usage
+        return usage
+    
+    def record_usage(self, service: str, key: Optional[str] = None, tokens: int = 0):
+        """记录一次不经过acquire的API调用"""
+        self.usage.record(service, key, tokens=tokens)
+    
+    def get_usage(self, service: str) -> Dict[str, Any]:
+        """服务最近一分钟/一小时/一天的请求数和token数"""
+        return self.usage.usage(service)
+    
+    def _stored_key(self, service: str) -> Optional[str]:
+        """从存储后端读取单个密钥（已解密）"""
+        if self._shared_cache is not None:
+            value = self._shared_cache.get(service)
+        elif self._key_store is not None:
+            value = self._key_store.get(service)
+        else:
+            value = self.config.get("api_keys", {}).get(service)
+        return self._reveal_cached(service, value)
+    
+    def _stored_keys(self, reveal: bool = True) -> Dict[str, str]:
+        """从存储后端读取全部密钥；reveal为False时返回存储中的原值（只需要服务名时）"""
+        if self._shared_cache is not None:
+            keys = self._shared_cache.items()
+        else:
+            keys = self._source_keys()
+        if not reveal or self._encryption_key is None or not keys:
+            return keys
+        return dict(zip(keys, self._reveal_many(list(keys.values()))))
+    
+    def _source_keys(self) -> Dict[str, str]:
+        """从权威存储（而非缓存）读取全部密钥"""
+        if self._key_store is not None:
+            return self._key_store.items()
+        return self.config.get("api_keys", {})
+    
+    def _check_encryption_key(self, config: Dict[str, Any]):
+        """用rekey写入的security.key_check确定加密密钥
+        
+        能解密它的密钥排到第一位（之后用它加密）；没有一个能解密时说明主密钥已被
+        其它进程更换，本进程写入的旧密钥密文将来无法读取，因此拒绝加密写入。
+        """
+        token = config.get("security", {}).get("key_check")
+        if token is None or self._encryption_key is None:
+            return
+        from cryptography.fernet import InvalidToken
+        from utils.helpers import get_cipher
+        keys = self._encryption_key
+        if not isinstance(keys, tuple):
+            keys = (keys,)
+        for key in keys:
+            try:
+                get_cipher(key).decrypt(token.encode())
+            except InvalidToken:
+                continue
+            if key != keys[0]:
+                self._encryption_key = tuple(dict.fromkeys((key, *keys)))
+            self._stale_key = False
+            return
+        self._stale_key = True
+    
+    def _ensure_kdf_salt(self) -> str:
+        """读取存储共用的口令派生盐，不存在时生成并保存
+        
+        所有进程和重启共用一个盐，口令只需派生一次；每个进程各用一个随机盐时，
+        密文中的盐越积越多，解密时要反复执行PBKDF2。
+        """
+        salt = self.config.get("security", {}).get("kdf_salt")
+        if salt is not None:
+            return salt
+        from utils.helpers import generate_salt
+        with self._write_guard():
+            salt = self.config.get("security", {}).get("kdf_salt")
+            if salt is None:
+                salt = generate_salt()
+                self._replace_section("security", {"kdf_salt": salt})
+                self._persist("set", "security", "kdf_salt", salt)
+        return salt
+    
+    def _ensure_current_key(self):
+        if self._stale_key:
+            raise ValueError("主密钥已被其它进程更换，请用新密钥（可附带旧密钥）重启本进程")
+    
+    def _seal(self, value: str) -> str:
+        """写入存储前加密（未启用加密时原样返回）"""
+        if not self._encrypt_writes:
+            return value
+        self._ensure_current_key()
+        from utils.helpers import encrypt_data
+        return encrypt_data(value, self._encryption_key, self._kdf_salt)
+    
+    def _seal_many(self, values: List[str]) -> List[str]:
+        """批量加密"""
+        if not self._encrypt_writes or not values:
+            return values
+        self._ensure_current_key()
+        from utils.helpers import encrypt_many
+        return encrypt_many(values, self._encryption_key, self._kdf_salt)
+    
+    def _reveal(self, value: Optional[str]) -> Optional[str]:
+        """解密存储中的值；未启用加密或值是明文时原样返回"""
+        if value is None or self._encryption_key is None:
+            return value
+        from utils.helpers import decrypt_many
+        return self._decrypt(decrypt_many, [value])[0]
+    
+    def _reveal_cached(self, service: str, value: Optional[str]) -> Optional[str]:
+        """经解密缓存读取单个服务的密钥"""
+        cache = self._secret_cache
+        if cache is None or value is None:
+            return self._reveal(value)
+        plaintext = cache.get(service, value)
+        if plaintext is None:
+            plaintext = self._reveal(value)
+            cache.put(service, value, plaintext)
+        return plaintext
+    
+    def _purge_secrets(self, services: Iterable[str]):
+        """清除服务的解密缓存条目"""
+        if self._secret_cache is not None:
+            self._secret_cache.invalidate(services)
+    
+    def secret_cache_stats(self) -> Optional[Dict[str, float]]:
+        """解密缓存的命中/未命中等指标，未启用加密时返回None"""
+        if self._secret_cache is None:
+            return None
+        return self._secret_cache.stats()
+    
+    def _reveal_many(self, values: List[str]) -> List[str]:
+        """批量解密"""
+        if self._encryption_key is None or not values:
+            return values
+        from utils.helpers import decrypt_many
+        return self._decrypt(decrypt_many, values)
+    
+    def _decrypt(self, decrypt_many, values: List[str]) -> List[str]:
+        from cryptography.fernet import InvalidToken
+        try:
+            return decrypt_many(values, self._encryption_key)
+        except InvalidToken:
+            raise ValueError("密钥解密失败，加密密钥与写入时不一致") from None
+    
+    def rekey(self, new_key: str, workers: Optional[int] = None, chunk_size: int = 500) -> int:
+        """用新的主密钥重新加密存储中的全部密钥和密钥池，返回处理的记录数
+        
+        记录按块交给进程池（MultiCipher，新旧密钥都能解密）重新加密，
+        进度写入 <config_path>.rekey 检查点，中途崩溃后再次调用会从检查点继续。
+        整个过程持有同一把写锁（多进程时为跨进程文件锁），其它写操作等待更换完成。
+        全部完成后按可恢复的顺序写入：
+        
+          1. 检查点（每块完成即落盘）
+          2. 配置：json后端原子替换配置文件，日志后端同步压缩为快照；
+             同时写入security.key_check（新密钥加密的校验值），
+             其它进程同步配置时据此清除解密缓存，没有新密钥的进程拒绝加密写入
+          3. 外部存储后端批量写入
+          4. 删除检查点
         
-        self.config["api_keys"][service] = key
+        任何一步失败后，用 (新密钥, 旧密钥) 重启并再次执行rekey即可补完，
+        已完成的记录从检查点恢复。之后本实例同时接受新旧密钥解密（版本历史中仍是旧密文），
+        重启时应把旧密钥放在新密钥之后一并传入，直到不再需要读取旧的历史版本。
+        """
+        from rekey import rekey_items, remove_checkpoint
+        from utils.helpers import get_cipher
+        old_keys = self._encryption_key
+        if old_keys is None:
+            old_keys = ()
+        elif not isinstance(old_keys, tuple):
+            old_keys = (old_keys,)
+        checkpoint = f"{self.config_path}.rekey"
+        salt = self._ensure_kdf_salt()
+        
+        with self._write_guard():
+            items = [(("api_keys", service), value)
+                     for service, value in self._source_keys().items() if value]
+            pools = self.config.get("key_pools", {})
+            for service, entry in pools.items():
+                items += [(("key_pools", service, i), value) for i, value in enumerate(entry["keys"])]
+            
+            rotated = rekey_items(items, new_key, old_keys, workers=workers, chunk_size=chunk_size,
+                                  checkpoint_path=checkpoint, salt=salt)
+            keys = {item[1]: token for item, token in rotated.items() if item[0] == "api_keys"}
+            config = dict(self.config)
+            if pools:
+                config["key_pools"] = {
+                    service: dict(entry, keys=[rotated[("key_pools", service, i)]
+                                               for i in range(len(entry["keys"]))])
+                    for service, entry in pools.items()
+                }
+            if self._key_store is None:
+                config["api_keys"] = {**config.get("api_keys", {}), **keys}
+            key_check = get_cipher(new_key, salt).encrypt(b"key_check").decode()
+            config["security"] = {**config.get("security", {}), "key_check": key_check}
+            
+            if self._journal is not None:
+                self._journal.compact(config, background=False)
+            else:
+                from storage.fileio import atomic_write_json
+                atomic_write_json(self.config_path, config)
+                self._file_state = self._stat_config()
+            # 配置落盘后本实例立即改用新密钥，外部存储写入失败时仍能读取两种密文
+            self.config = config
+            self._encryption_key = tuple(dict.fromkeys((new_key, *old_keys)))
+            self._encrypt_writes = True
+            self._kdf_salt = salt
+            self._stale_key = False
+            if self._secret_cache is None:
+                from secret_cache import SecretCache
+                self._secret_cache = SecretCache()
+            self._secret_cache.clear()
+            self._pools.clear()
+            
+            if self._key_store is not None:
+                self._key_store.set_many(keys)
+            self._publish()
+            remove_checkpoint(checkpoint)
+        
+        print(f"🔐 已用新密钥重新加密 {len(rotated)} 条记录")
+        return len(rotated)
+    
+    def _publish(self):
+        """写操作后向共享内存发布新的密钥表，调用方需持有写锁"""
+        if self._shared_cache is not None:
+            self._shared_cache.publish(self._source_keys())
+    
+    def set_api_key(self, service: str, key: str, save_to_file: bool = True) -> Optional[Future]:
+        """设置API密钥"""
+        transaction = self._active_transaction()
+        if transaction is not None:
+            transaction.set(service, key)
+            return None
         
-        if save_to_file:
-            self.save_config()
+        future = None
+        encryption_key = self._encryption_key
+        stored = self._seal(key)
+        with self._write_guard():
+            if self._encryption_key is not encryption_key or self._stale_key:
+                # 等锁期间同步到了其它进程更换的主密钥：按新密钥重新加密，没有新密钥时报错
+                stored = self._seal(key)
+            if self._key_store is not None:
+                self._key_store.set(service, stored)
+            else:
+                self._replace_section("api_keys", {service: stored})
+                
+                if save_to_file:
+                    future = self._persist("set", "api_keys", service, stored)
+            self._purge_secrets((service,))
+            self._index_owners({service: key})
+            self._record_history({service: stored})
+            self._track_rotation({service: stored})
+            self._publish()
         
         # 同时设置环境变量
-        os.environ[f"{service.upper()}_API_KEY"] = key
+        self._set_env(service, key)
+        return future
     
-    def update_api_key(self, service: str, new_key: str):
+    def update_api_key(self, service: str, new_key: str) -> Optional[Future]:
         """更新API密钥"""
-        self.set_api_key(service, new_key)
+        future = self.set_api_key(service, new_key)
         print(f"✅ {service} API密钥已更新")
+        return future
     
-    def remove_api_key(self, service: str):
+    def remove_api_key(self, service: str) -> Optional[Future]:
         """删除API密钥"""
-        if "api_keys" in self.config and service in self.config["api_keys"]:
-            del self.config["api_keys"][service]
-            self.save_config()
+        transaction = self._active_transaction()
+        if transaction is not None:
+            transaction.remove(service)
+            return None
+        
+        future = None
+        with self._write_guard():
+            if self._key_store is not None:
+                removed = self._key_store.delete(service)
+            else:
+                removed = service in self.config.get("api_keys", {})
+                if removed:
+                    self._replace_section("api_keys", removals=(service,))
+                    future = self._persist("delete", "api_keys", service)
+            if removed:
+                self._purge_secrets((service,))
+                self._index_owners({service: None})
+                self._record_history({service: None})
+                self._track_rotation({service: None})
+            self._publish()
         
         # 删除环境变量
-        env_key = f"{service.upper()}_API_KEY"
-        if env_key in os.environ:
-            del os.environ[env_key]
+        self._unset_env(service)
         
         print(f"❌ {service} API密钥已删除")
+        return future
+    
+    @staticmethod
+    def _validate_keys(keys: Dict[str, str]):
+        """批量写入前校验全部条目，任何一条不合法都不写入"""
+        invalid = [service for service, key in keys.items()
+                   if not isinstance(service, str) or not service.strip()
+                   or not isinstance(key, str) or not key]
+        if invalid:
+            raise ValueError(f"无效的服务名或密钥: {', '.join(map(str, invalid))}")
+    
+    def set_api_keys(self, keys: Dict[str, str], save_to_file: bool = True) -> Optional[Future]:
+        """批量设置API密钥
+
+        先校验全部条目，再一次性更新内存并只持久化一次
+        （json后端整体写一次文件，日志后端一次追加全部记录）。
+        """
+        keys = dict(keys)
+        self._validate_keys(keys)
+        transaction = self._active_transaction()
+        if transaction is not None:
+            transaction.pending.update(keys)
+            return None
+        return self._apply_changes(keys, save_to_file=save_to_file)
+    
+    def remove_api_keys(self, services: Iterable[str]) -> Optional[Future]:
+        """批量删除API密钥，只持久化一次"""
+        services = list(dict.fromkeys(services))
+        invalid = [service for service in services
+                   if not isinstance(service, str) or not service.strip()]
+        if invalid:
+            raise ValueError(f"无效的服务名: {', '.join(map(str, invalid))}")
+        transaction = self._active_transaction()
+        if transaction is not None:
+            for service in services:
+                transaction.remove(service)
+            return None
+        
+        future = self._apply_changes(dict.fromkeys(services))
+        print(f"❌ 已删除 {len(services)} 个API密钥")
+        return future
+    
+    def _apply_changes(self, changes: Dict[str, Optional[str]], save_to_file: bool = True,
+                       pools: Optional[Dict[str, Optional[Dict[str, Any]]]] = None) -> Optional[Future]:
+        """一次性应用一批变更（值为None表示删除），只持久化一次
+
+        pools是密钥池变更（服务名 -> 明文密钥池配置项，None表示删除），
+        与密钥变更一起写入同一次持久化。
+        持久化失败时恢复变更前的状态并重新抛出异常。
+        """
+        if not changes and not pools:
+            return None
+        plain = {service: key for service, key in changes.items() if key is not None}
+        removals = [service for service, key in changes.items() if key is None]
+        
+        def seal():
+            sets = dict(zip(plain, self._seal_many(list(plain.values()))))
+            pool_sets = {service: dict(entry, keys=self._seal_many(entry["keys"]))
+                         for service, entry in (pools or {}).items() if entry is not None}
+            return sets, pool_sets
+        
+        encryption_key = self._encryption_key
+        sets, pool_sets = seal()
+        future = None
+        with self._write_guard():
+            if self._encryption_key is not encryption_key or self._stale_key:
+                # 等锁期间同步到了其它进程更换的主密钥：按新密钥重新加密，没有新密钥时报错
+                sets, pool_sets = seal()
+            before = self.config
+            pool_records = []
+            if pools:
+                pool_removals = [service for service, entry in pools.items()
+                                 if entry is None and service in before.get("key_pools", {})]
+                if pool_sets or pool_removals:
+                    self._replace_section("key_pools", pool_sets, pool_removals)
+                    pool_records = [("set", "key_pools", service, entry)
+                                    for service, entry in pool_sets.items()]
+                    pool_records += [("delete", "key_pools", service, None)
+                                     for service in pool_removals]
+            
+            if self._key_store is not None:
+                stored = {service: self._key_store.get(service) for service in changes}
+                present = [service for service in removals if stored[service] is not None]
+                try:
+                    if sets:
+                        self._key_store.set_many(sets)
+                    if removals:
+                        self._key_store.delete_many(removals)
+                    if pool_records:
+                        future = self._persist_many(pool_records)
+                except BaseException:
+                    self._key_store.set_many(
+                        {service: key for service, key in stored.items() if key is not None}
+                    )
+                    self._key_store.delete_many(
+                        [service for service, key in stored.items() if key is None]
+                    )
+                    self.config = before
+                    raise
+            else:
+                stored = before.get("api_keys", {})
+                present = [service for service in removals if service in stored]
+                records = list(pool_records)
+                if sets or present:
+                    self._replace_section("api_keys", sets, present)
+                    if save_to_file or present:
+                        records += [("set", "api_keys", service, key) for service, key in sets.items()]
+                        records += [("delete", "api_keys", service, None) for service in present]
+                if records:
+                    try:
+                        future = self._persist_many(records)
+                    except BaseException:
+                        self.config = before
+                        raise
+            if pools:
+                for service in pools:
+                    self._pools.pop(service, None)
+                if self._owner_index is not None:
+                    self._owner_index.update({("key_pools", service): entry["keys"] if entry else ()
+                                              for service, entry in pools.items()})
+            self._purge_secrets(changes)
+            self._index_owners({**{service: changes[service] for service in sets},
+                                **dict.fromkeys(present)})
+            self._record_history({**sets, **dict.fromkeys(present)})
+            self._track_rotation({**sets, **dict.fromkeys(present)})
+            self._publish()
+        
+        for service, key in changes.items():
+            if key is None:
+                self._unset_env(service)
+            else:
+                self._set_env(service, key)
+        return future
+    
+    def _require_history(self):
+        if self._history is None:
+            raise ValueError("未启用版本历史（history=True）")
+        return self._history
+    
+    def _record_history(self, changes: Dict[str, Optional[str]]):
+        """记录版本历史（值为存储中的值，启用加密时是密文），调用方需持有写锁"""
+        if self._history is not None and changes:
+            self._history.append(changes)
+    
+    def get_history(self, service: str) -> List[Dict[str, Any]]:
+        """列出服务的版本历史（版本号、时间戳、是否删除，不含密钥值）"""
+        return self._require_history().versions(service)
+    
+    def rollback(self, service: str, version: int) -> Optional[Future]:
+        """把服务恢复到指定版本的值
+
+        回滚本身作为一个新版本追加，不会丢弃之后的历史；
+        指定版本是删除记录时删除该密钥。
+        """
+        value = self._reveal(self._require_history().value(service, version))
+        if value is None:
+            return self.remove_api_key(service)
+        return self.set_api_key(service, value)
+    
+    def _rotation_days(self, service: str) -> float:
+        """服务的轮换周期：metadata中的rotation_days优先，其次security.rotation_days
+
+        直接读取配置节（每次写入都会调用，不能构建记录表或解密密钥）。
+        """
+        metadata = self.config.get("metadata", {}).get(service)
+        if isinstance(metadata, dict) and "rotation_days" in metadata:
+            return float(metadata["rotation_days"])
+        return float(self.config.get("security", {}).get("rotation_days", 90))
+    
+    def _start_rotation(self):
+        """创建轮换调度器，为尚未跟踪的密钥确定上次轮换时间，并启动后台线程
+        
+        上次轮换时间依次取自：调度器文件、metadata中的updated_at/created_at、
+        版本历史中最新版本的时间，都没有时从现在开始计算。
+        """
+        from rotation_scheduler import RotationScheduler, to_timestamp
+        scheduler = RotationScheduler(
+            rotation_days=float(self.config.get("security", {}).get("rotation_days", 90)),
+            path=f"{self.config_path}.rotation"
+        )
+        with self._write_guard():
+            keys = self._source_keys()
+            all_metadata = self.config.get("metadata", {})
+            seeds = {}
+            for service in keys:
+                rotated_at = scheduler.rotated_at(service)
+                if rotated_at is None:
+                    metadata = all_metadata.get(service)
+                    if isinstance(metadata, dict):
+                        rotated_at = to_timestamp(metadata.get("updated_at") or metadata.get("created_at"))
+                if rotated_at is None and self._history is not None:
+                    versions = self._history.versions(service)
+                    if versions:
+                        rotated_at = versions[-1]["timestamp"]
+                seeds[service] = (rotated_at, self._rotation_days(service))
+            for service in scheduler.services():
+                if service not in keys:
+                    scheduler.unschedule(service, persist=False)
+            scheduler.schedule_many(seeds)
+            self._rotation = scheduler
+        scheduler.start()
+    
+    def _track_rotation(self, changes: Dict[str, Optional[str]]):
+        """写入新密钥即视为完成轮换，删除的密钥不再跟踪；调用方需持有写锁"""
+        scheduler = self._rotation
+        if scheduler is None or not changes:
+            return
+        for service, key in changes.items():
+            if key is None:
+                scheduler.unschedule(service, persist=False)
+            else:
+                scheduler.schedule(service, rotation_days=self._rotation_days(service), persist=False)
+        scheduler.save()
+    
+    @property
+    def rotation_scheduler(self) -> "RotationScheduler":
+        if self._rotation is None:
+            raise ValueError("未启用密钥轮换调度（rotation=True）")
+        return self._rotation
+    
+    def on_rotation_due(self, callback):
+        """注册密钥到期回调 callback(service, due_at)
+        
+        回调返回新的密钥字符串时自动写入（完成轮换并重新计时）；
+        返回None时只作为通知，密钥未更换则每天再次提醒。
+        """
+        def run(service: str, due_at: float):
+            new_key = callback(service, due_at)
+            if isinstance(new_key, str) and new_key:
+                self.set_api_key(service, new_key)
+        self.rotation_scheduler.add_callback(run)
+    
+    def get_expiring_keys(self, days: float = 7) -> List[Dict[str, Any]]:
+        """未来days天内（含已过期）需要轮换的密钥，按到期时间排序"""
+        return self.rotation_scheduler.expiring_within(days)
+    
+    def _owner_records(self) -> Dict[Tuple[str, str], List[str]]:
+        """全部密钥和密钥池的 (配置节, 服务名) -> 明文密钥，用于建立反查索引"""
+        records = {("api_keys", service): [key]
+                   for service, key in self._stored_keys().items() if key}
+        for service in self.config.get("key_pools", {}):
+            records[("key_pools", service)] = self.get_key_pool(service).keys
+        return records
+    
+    def _index_owners(self, changes: Dict[str, Optional[str]]):
+        """增量更新反查索引（值为明文，None表示删除），调用方需持有写锁"""
+        if self._owner_index is not None and changes:
+            self._owner_index.update({("api_keys", service): [key] if key else []
+                                      for service, key in changes.items()})
+    
+    def find_owner(self, key: str) -> List[Dict[str, str]]:
+        """查找密钥属于哪些服务/记录（O(1)，不解密也不遍历存储）
+        
+        返回 [{"service": 服务名, "record": "api_keys" 或 "key_pools"}]，
+        未找到时为空列表；环境变量中的密钥不在索引中。
+        """
+        if self._owner_index is None:
+            raise ValueError("未启用密钥反查索引（owner_index=True）")
+        return [{"service": service, "record": record}
+                for record, service in self._owner_index.find(key)]
+    
+    def _active_transaction(self) -> Optional["KeyTransaction"]:
+        """当前线程正在进行的事务"""
+        transaction = self._transaction
+        if transaction is not None and transaction.owner == threading.get_ident():
+            return transaction
+        return None
+    
+    @contextmanager
+    def transaction(self):
+        """事务上下文
+
+        with块内的set/remove调用（包括密钥池的set_key_pool/remove_key_pool，
+        以及返回的事务对象上的操作）只暂存在内存中，
+        正常退出时一次性应用并只持久化一次；块内抛出异常则丢弃全部暂存变更。
+        事务期间持有写锁，其它线程（多进程模式下还有其它进程）的写操作会等待提交完成；
+        读操作不加锁，在提交前看到的始终是事务开始前的状态。嵌套调用并入外层事务。
+        提交后组提交模式下的落盘Future保存在事务对象的future属性上。
+        """
+        transaction = self._active_transaction()
+        if transaction is not None:
+            yield transaction
+            return
+        
+        with self._write_guard():
+            transaction = KeyTransaction(self)
+            self._transaction = transaction
+            try:
+                yield transaction
+                self._transaction = None
+                transaction.future = self._apply_changes(transaction.pending,
+                                                         pools=transaction.pools)
+            finally:
+                self._transaction = None
     
     def list_all_keys(self) -> Dict[str, str]:
         """列出所有API密钥"""
+        if self._file_lock is not None:
+            self._sync()
         keys = {}
         
-        # 从配置文件获取
-        config_keys = self.config.get("api_keys", {})
+        # 从存储获取
+        config_keys = self._stored_keys()
         for service, key in config_keys.items():
             keys[service] = f"{key[:10]}..." if len(key) > 10 else "***"
         
-        # 从环境变量获取
-        env_keys = {k: v for k, v in os.environ.items() if k.endswith("_API_KEY")}
-        for env_key, value in env_keys.items():
-            service = env_key.lower().replace("_api_key", "")
+        # 从环境变量索引获取
+        for service, value in self._env_index.items():
             keys[service] = f"{value[:10]}..." if len(value) > 10 else "***"
         
+        # 密钥池优先于单个密钥
+        for service, entry in self.config.get("key_pools", {}).items():
+            keys[service] = f"密钥池({len(entry['keys'])}个)"
+        
         return keys
     
+    @property
+    def health_checker(self) -> "HealthChecker":
+        """健康检查引擎（按配置的health_check节创建）"""
+        checker = self._health_checker
+        if checker is None:
+            from health_check import HealthChecker
+            with self._lock:
+                if self._health_checker is None:
+                    self._health_checker = HealthChecker.from_config(self.config)
+                checker = self._health_checker
+        return checker
+    
+    def health_targets(self) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """所有待检查的 (服务, 密钥, endpoint)；密钥池中的每个密钥分别检查"""
+        if self._file_lock is not None:
+            self._sync()
+        endpoints = self.config.get("endpoints", {})
+        pools = self.config.get("key_pools", {})
+        services = dict.fromkeys(list(self._stored_keys(reveal=False)) + list(self._env_index) + list(pools))
+        
+        targets = []
+        for service in services:
+            if service in pools:
+                keys = self.get_key_pool(service).keys
+            else:
+                keys = [self.get_api_key(service)]
+            for key in keys:
+                if key:
+                    targets.append((service, key, endpoints.get(service)))
+        return targets
+    
+    @property
+    def circuit_breaker(self) -> "CircuitBreaker":
+        """按服务和密钥的熔断器（按配置的circuit_breaker节创建）"""
+        breaker = self._breaker
+        if breaker is None:
+            from circuit_breaker import CircuitBreaker
+            with self._lock:
+                if self._breaker is None:
+                    settings = self.config.get("circuit_breaker", {})
+                    self._breaker = CircuitBreaker(
+                        failure_threshold=settings.get("failure_threshold", 5),
+                        reset_timeout=settings.get("reset_timeout", 30.0),
+                        path=self._breaker_path
+                    )
+                breaker = self._breaker
+        return breaker
+    
+    def report_failure(self, service: str, key: Optional[str] = None, trip: bool = False):
+        """报告上游调用失败；不指定key时记入服务级熔断器，trip为True时立即熔断"""
+        self.circuit_breaker.record_failure(service, key, trip=trip)
+    
+    def report_success(self, service: str, key: Optional[str] = None):
+        """报告上游调用成功（关闭熔断器）"""
+        if self._breaker is not None:
+            self._breaker.record_success(service, key)
+    
+    def get_breaker_state(self, service: str, key: Optional[str] = None) -> str:
+        """熔断器状态: closed / open / half_open"""
+        if self._breaker is None:
+            return "closed"
+        return self._breaker.state(service, key)
+    
+    def _feed_breaker(self, result: Dict[str, Any]):
+        """用新的健康检查结果驱动熔断器（缓存结果不重复计入）"""
+        if result.get("cached"):
+            return
+        from health_check import INVALID, VALID
+        status = result["status"]
+        self.circuit_breaker.record_result(
+            result["service"], result["key_id"], status == VALID, trip=status == INVALID
+        )
+    
     def test_api_key(self, service: str) -> bool:
-        """测试API密钥是否有效"""
+        """测试API密钥是否有效
+
+        配置了endpoints时实际请求上游验证（结果按TTL缓存）；否则只检查密钥是否已设置。
+        """
         key = self.get_api_key(service)
         if not key:
             print(f"❌ {service} API密钥未设置")
             return False
         
-        # 这里可以添加具体的API测试逻辑
-        print(f"✅ {service} API密钥已设置")
-        return True
+        endpoint = self.config.get("endpoints", {}).get(service)
+        if not endpoint:
+            print(f"✅ {service} API密钥已设置")
+            return True
+        
+        from health_check import VALID
+        result = self.health_checker.check_sync(service, key, endpoint)
+        self._feed_breaker(result)
+        if result["status"] == VALID:
+            print(f"✅ {service} API密钥有效")
+            return True
+        print(f"❌ {service} API密钥检查失败: {result.get('error') or result['http_status']}")
+        return False
     
     def get_config_template(self) -> str:
         """获取配置模板"""
@@ -137,6 +1305,131 @@ class APIKeyManager:
 }
 """
 
+class KeyTransaction:
+    """事务中暂存的密钥变更（值为None表示删除）"""
+    
+    def __init__(self, manager: APIKeyManager):
+        self.owner = threading.get_ident()
+        self.pending: Dict[str, Optional[str]] = {}
+        # 密钥池变更：服务名 -> 明文密钥池配置项（None表示删除）
+        self.pools: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.future: Optional[Future] = None
+        self._manager = manager
+    
+    def set(self, service: str, key: str):
+        """暂存设置"""
+        self._manager._validate_keys({service: key})
+        self.pending[service] = key
+    
+    def remove(self, service: str):
+        """暂存删除"""
+        self.pending[service] = None
+    
+    def get(self, service: str) -> Optional[str]:
+        """读取密钥，包含本事务尚未提交的变更"""
+        if service in self.pending:
+            return self.pending[service]
+        return self._manager.get_api_key(service)
+
+class AsyncAPIKeyManager(APIKeyManager):
+    """异步API密钥管理器
+
+    供FastAPI等事件循环中的调用方使用：涉及磁盘I/O的操作交给有界线程池执行，
+    不阻塞事件循环；组提交模式下的落盘Future也以异步方式等待。
+    纯内存读取（无外部存储后端、非多进程模式）直接在事件循环中完成。
+    """
+    
+    def __init__(self, *args, io_workers: int = 4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = ThreadPoolExecutor(
+            max_workers=io_workers, thread_name_prefix="api-key-io"
+        )
+    
+    def _reads_in_memory(self) -> bool:
+        """读取是否只访问内存快照"""
+        # 启用加密时读取可能要解密（首次遇到某个盐时还要执行PBKDF2），不能在事件循环中执行
+        return (self._key_store is None and self._file_lock is None
+                and self._shared_cache is None and self._encryption_key is None)
+    
+    async def _run(self, func, *args):
+        """在I/O线程池中执行同步方法；返回组提交Future时等待其落盘"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, func, *args)
+        if isinstance(result, Future):
+            result = await asyncio.wrap_future(result)
+        return result
+    
+    async def aget(self, service: str) -> Optional[str]:
+        """异步获取API密钥"""
+        if self._reads_in_memory():
+            return self.get_api_key(service)
+        return await self._run(self.get_api_key, service)
+    
+    async def alist(self) -> Dict[str, str]:
+        """异步列出所有API密钥"""
+        if self._reads_in_memory():
+            return self.list_all_keys()
+        return await self._run(self.list_all_keys)
+    
+    async def aset(self, service: str, key: str):
+        """异步设置API密钥，返回时已持久化"""
+        await self._run(self.set_api_key, service, key)
+    
+    async def aupdate(self, service: str, new_key: str):
+        """异步更新API密钥"""
+        await self._run(self.update_api_key, service, new_key)
+    
+    async def aremove(self, service: str):
+        """异步删除API密钥"""
+        await self._run(self.remove_api_key, service)
+    
+    async def aset_many(self, keys: Dict[str, str]):
+        """异步批量设置API密钥"""
+        await self._run(self.set_api_keys, keys)
+    
+    async def aremove_many(self, services: List[str]):
+        """异步批量删除API密钥"""
+        await self._run(self.remove_api_keys, services)
+    
+    async def aacquire(self, service: str, tokens: float = 0,
+                       timeout: Optional[float] = None, key: Optional[str] = None) -> bool:
+        """异步获取限流配额，等待期间不阻塞事件循环"""
+        acquired = await self.rate_limiter.acquire_async(service, tokens, key, timeout)
+        if acquired:
+            self.usage.record(service, key, tokens=int(tokens))
+        return acquired
+    
+    async def atest(self, service: str) -> bool:
+        """异步测试API密钥，探测请求在健康检查引擎中并发执行"""
+        key = await self.aget(service)
+        endpoint = self.config.get("endpoints", {}).get(service)
+        if not key or not endpoint:
+            return await self._run(self.test_api_key, service)
+        
+        from health_check import VALID
+        result = await self.health_checker.check(service, key, endpoint)
+        self._feed_breaker(result)
+        return result["status"] == VALID
+    
+    async def atest_all(self, use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """并发检查所有密钥，按完成顺序产出结果（不含密钥明文）"""
+        from health_check import key_id
+        targets = await self._run(self.health_targets)
+        probes = []
+        for service, key, endpoint in targets:
+            if endpoint:
+                probes.append((service, key, endpoint))
+            else:
+                yield {"service": service, "key_id": key_id(key), "status": "no_endpoint"}
+        async for result in self.health_checker.check_many(probes, use_cache=use_cache):
+            self._feed_breaker(result)
+            yield result
+    
+    def close(self):
+        """关闭I/O线程池并释放存储资源"""
+        self._executor.shutdown(wait=True)
+        super().close()
+
 def main():
     """主函数 - 命令行界面"""
     manager = APIKeyManager()
@@ -0,0 +1,250 @@
+"""
+密钥熔断器
+按服务和按密钥分别维护 closed / open / half-open 三态：
+
+  closed     正常使用，连续失败达到阈值后打开
+  open       暂停使用reset_timeout秒
+  half-open  冷却结束后放行一次试探，成功则关闭，失败则重新打开
+
+状态保存在定长槽位表中：单进程时是内存中的bytearray，
+指定path时是各worker共同映射的文件，任何worker读取状态都只是一次内存查找。
+槽位格式（小端）: hash(Q) state(B) seq(B) pad(2x) failures(I) until(d)，线性探测。
+
+  - 写入在锁（多进程时还有文件锁）下进行，写入前后各递增一次seq（顺序锁），
+    无锁读取看到seq为奇数或前后不一致时重读，不会读到写了一半的槽位
+  - 槽位不清空（哈希保留，探测链不会断开）：closed且失败计数为0的槽位与不存在等价；
+    超过reclaim_after秒没有变化的槽位（如被吊销后轮换掉的密钥）视为废弃，
+    open/half-open以冷却结束时间、closed以最后一次失败时间（保存在until中）计算。
+    新条目在探测链上遇到空槽位之前先复用这两类槽位
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from usage_recorder import key_id
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATES = (CLOSED, OPEN, HALF_OPEN)
+_SLOT = struct.Struct("<QBB2xId")
+# seq字节在槽位中的偏移
+_SEQ = 9
+# 探测链上既没有空槽位也没有可复用槽位时，新条目无法跟踪，视为closed
+_PROBE_LIMIT = 64
+# 无锁读取遇到并发写入时的重试次数，之后加锁读取
+_READ_RETRIES = 8
+
+
+def _hash(service: str, kid: Optional[str]) -> int:
+    data = f"{service}\0{kid or ''}".encode('utf-8')
+    # 0保留给空槽位
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little") or 1
+
+
+class CircuitBreaker:
+    """按 (服务, 密钥) 的熔断器注册表"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 path: Optional[str] = None, slots: int = 4096, clock=time.time,
+                 reclaim_after: float = 3600.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.reclaim_after = reclaim_after
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._file_lock = None
+        # 因探测链已满而无法跟踪的写入次数
+        self.untracked = 0
+
+        size = slots * _SLOT.size
+        if path is None:
+            self.slots = slots
+            self._buf = bytearray(size)
+        else:
+            from storage.file_lock import FileLock
+            self._file_lock = FileLock(f"{path}.lock")
+            with self._file_lock:
+                directory = os.path.dirname(os.path.abspath(path))
+                os.makedirs(directory, exist_ok=True)
+                with open(path, 'a+b') as f:
+                    if os.fstat(f.fileno()).st_size < size:
+                        f.truncate(size)
+                    # 已有文件以其大小为准，各worker的槽位数必须一致
+                    self.slots = os.fstat(f.fileno()).st_size // _SLOT.size
+                    self._buf = mmap.mmap(f.fileno(), 0)
+
+    @contextmanager
+    def _locked(self):
+        """写锁：进程内互斥，映射文件时同时持有跨进程文件锁"""
+        with self._lock:
+            if self._file_lock is None:
+                yield
+                return
+            with self._file_lock:
+                yield
+
+    def _reclaimable(self, state: int, failures: int, until: float, now: float) -> bool:
+        """槽位能否让给新条目"""
+        if _STATES[state] == CLOSED and failures == 0:
+            return True
+        return now >= until + self.reclaim_after
+
+    def _find(self, h: int, claim: bool = False) -> Optional[int]:
+        """返回槽位偏移
+
+        claim为True时（调用方需持有写锁）在未找到时返回链上第一个可复用槽位或空槽位。
+        """
+        i = h % self.slots
+        reusable = None
+        now = self.clock() if claim else 0.0
+        for _ in range(min(self.slots, _PROBE_LIMIT)):
+            offset = i * _SLOT.size
+            slot_hash, state, _, failures, until = _SLOT.unpack_from(self._buf, offset)
+            if slot_hash == h:
+                return offset
+            if slot_hash == 0:
+                if not claim:
+                    return None
+                return offset if reusable is None else reusable
+            if claim and reusable is None and self._reclaimable(state, failures, until, now):
+                reusable = offset
+            i = (i + 1) % self.slots
+        if claim and reusable is None:
+            self.untracked += 1
+        return reusable
+
+    def _read(self, service: str, kid: Optional[str]) -> Tuple[str, int, float]:
+        """无锁读取条目状态（顺序锁校验），不存在时为closed"""
+        h = _hash(service, kid)
+        buf = self._buf
+        for _ in range(_READ_RETRIES):
+            offset = self._find(h)
+            if offset is None:
+                return CLOSED, 0, 0.0
+            seq = buf[offset + _SEQ]
+            if seq & 1:
+                continue
+            slot_hash, state, _, failures, until = _SLOT.unpack_from(buf, offset)
+            if buf[offset + _SEQ] == seq and slot_hash == h:
+                return _STATES[state], failures, until
+        # 一直有并发写入时加锁读取
+        with self._locked():
+            offset = self._find(h)
+            if offset is None:
+                return CLOSED, 0, 0.0
+            return self._current(offset, h)
+
+    def _current(self, offset: int, h: int) -> Tuple[str, int, float]:
+        """读取槽位（调用方需持有写锁）；空槽位和别的条目的槽位按closed处理"""
+        slot_hash, state, _, failures, until = _SLOT.unpack_from(self._buf, offset)
+        if slot_hash != h:
+            return CLOSED, 0, 0.0
+        return _STATES[state], failures, until
+
+    def _write(self, offset: int, h: int, state: str, failures: int, until: float):
+        """写入槽位（调用方需持有写锁），写入期间seq为奇数"""
+        buf = self._buf
+        seq = (buf[offset + _SEQ] + 1) & 0xFF
+        buf[offset + _SEQ] = seq
+        _SLOT.pack_into(buf, offset, h, _STATES.index(state), seq, failures, until)
+        buf[offset + _SEQ] = (seq + 1) & 0xFF
+
+    def _update(self, service: str, kid: Optional[str], transition):
+        """在写锁下读取-修改-写入一个槽位"""
+        h = _hash(service, kid)
+        with self._locked():
+            offset = self._find(h, claim=True)
+            if offset is None:
+                return
+            self._write(offset, h, *transition(*self._current(offset, h)))
+
+    def state(self, service: str, key: Optional[str] = None) -> str:
+        """当前状态（冷却结束的open报告为half_open）"""
+        state, _, until = self._read(service, key_id(key) if key is not None else None)
+        if state == OPEN and self.clock() >= until:
+            return HALF_OPEN
+        return state
+
+    def allow(self, service: str, key: Optional[str] = None) -> bool:
+        """是否可以使用该密钥：服务级和密钥级熔断器都未打开
+
+        冷却结束后只放行一次试探，试探结果由record_success/record_failure报告。
+        两级都确认可以放行后才一起开始试探，不会因为另一级拒绝而占用这一级的试探机会。
+        """
+        levels: List[Tuple[str, Optional[str]]] = [(service, None)]
+        if key is not None:
+            levels.append((service, key_id(key)))
+        now = self.clock()
+        trials = []
+        for level in levels:
+            state, _, until = self._read(*level)
+            if state == CLOSED:
+                continue
+            if now < until:
+                # open冷却中，或half-open的试探请求尚未返回
+                return False
+            trials.append(level)
+        if not trials:
+            return True
+
+        with self._locked():
+            slots = []
+            for level in trials:
+                h = _hash(*level)
+                offset = self._find(h)
+                if offset is None:
+                    continue
+                current, failures, until = self._current(offset, h)
+                if current == CLOSED:
+                    continue
+                if now < until:
+                    # 其它线程/进程已经抢先开始了试探
+                    return False
+                slots.append((offset, h, failures))
+            for offset, h, failures in slots:
+                self._write(offset, h, HALF_OPEN, failures, now + self.reset_timeout)
+        return True
+
+    def record_success(self, service: str, key: Optional[str] = None):
+        """报告成功，关闭熔断器"""
+        self.record_result(service, key_id(key) if key is not None else None, True)
+
+    def record_failure(self, service: str, key: Optional[str] = None, trip: bool = False):
+        """报告失败；trip为True时立即打开（如密钥已被吊销）"""
+        self.record_result(service, key_id(key) if key is not None else None, False, trip)
+
+    def record_result(self, service: str, kid: Optional[str], ok: bool, trip: bool = False):
+        """按服务名和密钥标识记录结果（供只持有密钥标识的健康检查结果使用）"""
+        if ok:
+            state, failures, _ = self._read(service, kid)
+            if state == CLOSED and failures == 0:
+                # 常见路径：无需加锁写入
+                return
+            self._update(service, kid, lambda current, failures, until: (CLOSED, 0, 0.0))
+            return
+
+        now = self.clock()
+
+        def fail(current, failures, until):
+            failures += 1
+            if trip or current == HALF_OPEN or failures >= self.failure_threshold:
+                return OPEN, failures, now + self.reset_timeout
+            if current == CLOSED:
+                # closed状态下until记录最后一次失败的时间
+                return CLOSED, failures, now
+            return current, failures, until
+        self._update(service, kid, fail)
+
+    def close(self):
+        """解除文件映射"""
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
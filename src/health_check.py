@@ -0,0 +1,281 @@
+"""
+密钥健康检查引擎
+用各服务配置的 endpoints 地址实际请求上游，判断密钥是否可用。
+
+  - 所有检查在一个专用事件循环线程中并发执行，同步和异步调用方共用同一个连接池
+  - HTTP/1.1 keep-alive 连接按 (scheme, host, port) 池化复用
+  - 每个服务可单独设置超时
+  - 结果按 (服务, 密钥) 缓存ttl秒，密钥变化后缓存自然失效；
+    超时和请求失败（status为error）只缓存error_ttl秒，上游恢复后很快重新探测
+
+配置（config["health_check"]，均可省略）::
+
+    {"ttl": 300, "error_ttl": 10, "timeout": 5.0, "timeouts": {"openai": 3.0},
+     "probes": {"openai": {"path": "/models", "auth": "bearer"}}}
+"""
+
+import asyncio
+import ssl
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from usage_recorder import key_id
+
+# 常见服务的探测方式：在endpoint后追加的路径和认证方式
+DEFAULT_PROBES = {
+    "openai": {"path": "/models", "auth": "bearer"},
+    "anthropic": {"path": "/v1/models", "auth": "x-api-key",
+                  "headers": {"anthropic-version": "2023-06-01"}},
+    "news_api": {"path": "/top-headlines/sources", "auth": "x-api-key"},
+    "weather_api": {"path": "/weather?q=London", "auth": "query:appid"},
+}
+
+VALID = "valid"
+INVALID = "invalid"
+ERROR = "error"
+
+
+class _ConnectionPool:
+    """keep-alive连接池，只在引擎的事件循环中使用"""
+
+    def __init__(self, max_idle: int = 8):
+        self.max_idle = max_idle
+        self._idle: Dict[Tuple[str, str, int], List[Tuple[Any, Any]]] = {}
+        self.opened = 0
+
+    async def get(self, scheme: str, host: str, port: int):
+        idle = self._idle.get((scheme, host, port))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        context = ssl.create_default_context() if scheme == "https" else None
+        reader, writer = await asyncio.open_connection(
+            host, port, ssl=context, server_hostname=host if context else None
+        )
+        self.opened += 1
+        return reader, writer
+
+    def put(self, scheme: str, host: str, port: int, conn):
+        idle = self._idle.setdefault((scheme, host, port), [])
+        if len(idle) < self.max_idle:
+            idle.append(conn)
+        else:
+            conn[1].close()
+
+    def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+async def _read_response(reader) -> Tuple[int, Dict[str, str], bytes, bool]:
+    """读取HTTP响应，返回 (状态码, 头部, 正文, 连接是否可复用)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("连接已关闭")
+    parts = status_line.decode('latin-1').split(" ", 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        raise ValueError(f"无效的HTTP状态行: {status_line[:80]!r}")
+    status = int(parts[1])
+
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    reusable = headers.get("connection", "").lower() != "close"
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        reusable = False
+    return status, headers, body, reusable
+
+
+class HealthChecker:
+    """并发健康检查引擎"""
+
+    def __init__(self, ttl: float = 300.0, timeout: float = 5.0,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 probes: Optional[Dict[str, Dict[str, Any]]] = None,
+                 max_concurrency: int = 32, error_ttl: float = 10.0):
+        self.ttl = ttl
+        # 失败结果的缓存时间，为0时不缓存
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.probes = {**DEFAULT_PROBES, **(probes or {})}
+        self.max_concurrency = max_concurrency
+        # (服务名, 密钥标识) -> (过期时间, 结果)
+        self._cache: Dict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = {}
+        self._pool = _ConnectionPool()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "HealthChecker":
+        """由配置文件的health_check节创建"""
+        settings = config.get("health_check", {})
+        return cls(ttl=settings.get("ttl", 300.0), timeout=settings.get("timeout", 5.0),
+                   timeouts=settings.get("timeouts"), probes=settings.get("probes"),
+                   error_ttl=settings.get("error_ttl", 10.0))
+
+    @property
+    def connections_opened(self) -> int:
+        """累计新建的连接数（用于观察连接复用）"""
+        return self._pool.opened
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=loop.run_forever, name="health-check", daemon=True
+                )
+                self._thread.start()
+                self._loop = loop
+        return self._loop
+
+    def _submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def cached(self, service: str, key: str) -> Optional[Dict[str, Any]]:
+        """未过期的缓存结果"""
+        entry = self._cache.get((service, key_id(key)))
+        if entry is not None and entry[0] > time.monotonic():
+            return dict(entry[1], cached=True)
+        return None
+
+    def invalidate(self, service: Optional[str] = None):
+        """清除某个服务（或全部）的缓存结果"""
+        if service is None:
+            self._cache.clear()
+            return
+        for cache_key in [k for k in self._cache if k[0] == service]:
+            self._cache.pop(cache_key, None)
+
+    def _request(self, service: str, key: str, endpoint: str) -> Tuple[str, str, int, bytes]:
+        """构造探测请求，返回 (scheme, host, port, 请求字节)"""
+        probe = self.probes.get(service, {"path": "", "auth": "bearer"})
+        url = urlsplit(endpoint.rstrip("/") + probe.get("path", ""))
+        scheme = url.scheme or "https"
+        host = url.hostname
+        port = url.port or (443 if scheme == "https" else 80)
+        target = url.path or "/"
+        query = url.query
+
+        headers = {"Host": url.netloc, "User-Agent": "api-key-manager-health-check",
+                   "Accept": "application/json", "Connection": "keep-alive"}
+        headers.update(probe.get("headers", {}))
+        auth = probe.get("auth", "bearer")
+        if auth == "bearer":
+            headers["Authorization"] = f"Bearer {key}"
+        elif auth.startswith("query:"):
+            query = f"{query}&{auth[6:]}={key}" if query else f"{auth[6:]}={key}"
+        else:
+            headers[auth] = key
+        if query:
+            target = f"{target}?{query}"
+
+        lines = [f"GET {target} HTTP/1.1"] + [f"{name}: {value}" for name, value in headers.items()]
+        return scheme, host, port, ("\r\n".join(lines) + "\r\n\r\n").encode('utf-8')
+
+    async def _probe(self, service: str, key: str, endpoint: str) -> Dict[str, Any]:
+        scheme, host, port, request = self._request(service, key, endpoint)
+        conn = await self._pool.get(scheme, host, port)
+        reader, writer = conn
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, _, _, reusable = await _read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if reusable:
+            self._pool.put(scheme, host, port, conn)
+        else:
+            writer.close()
+        return {"status": VALID if status < 400 else
+                INVALID if status in (401, 403) else ERROR,
+                "http_status": status}
+
+    async def _check(self, service: str, key: str, endpoint: str,
+                     use_cache: bool = True) -> Dict[str, Any]:
+        if use_cache:
+            cached = self.cached(service, key)
+            if cached is not None:
+                return cached
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        started = time.monotonic()
+        async with self._semaphore:
+            try:
+                result = await asyncio.wait_for(
+                    self._probe(service, key, endpoint),
+                    self.timeouts.get(service, self.timeout)
+                )
+            except asyncio.TimeoutError:
+                result = {"status": ERROR, "http_status": None, "error": "timeout"}
+            except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError) as e:
+                result = {"status": ERROR, "http_status": None, "error": str(e) or type(e).__name__}
+        result.update(service=service, key_id=key_id(key), cached=False,
+                      latency_ms=round((time.monotonic() - started) * 1000, 1),
+                      checked_at=time.time())
+        ttl = self.error_ttl if result["status"] == ERROR else self.ttl
+        if ttl > 0:
+            self._cache[(service, key_id(key))] = (time.monotonic() + ttl, result)
+        return dict(result)
+
+    def check_sync(self, service: str, key: str, endpoint: str,
+                   use_cache: bool = True) -> Dict[str, Any]:
+        """同步检查单个密钥（在引擎线程中执行）"""
+        return self._submit(self._check(service, key, endpoint, use_cache)).result()
+
+    async def check(self, service: str, key: str, endpoint: str,
+                    use_cache: bool = True) -> Dict[str, Any]:
+        """异步检查单个密钥，可在任意事件循环中等待"""
+        return await asyncio.wrap_future(self._submit(self._check(service, key, endpoint, use_cache)))
+
+    async def check_many(self, targets: Iterable[Tuple[str, str, str]],
+                         use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """并发检查多个 (服务, 密钥, endpoint)，按完成顺序产出结果"""
+        futures = [asyncio.wrap_future(self._submit(self._check(service, key, endpoint, use_cache)))
+                   for service, key, endpoint in targets]
+        for future in asyncio.as_completed(futures):
+            yield await future
+
+    def close(self):
+        """关闭连接池并停止引擎线程"""
+        loop = self._loop
+        if loop is None:
+            return
+        async def shutdown():
+            self._pool.close()
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+        self._loop = None
@@ -0,0 +1,164 @@
+"""
+密钥池
+同一服务持有多个密钥时按策略选取，用于提高总吞吐量。
+
+策略：
+  - round_robin: 轮询，O(1)，无锁
+  - lru:         选取最久未使用的密钥，O(1)
+  - weighted:    按剩余配额加权随机选取，树状数组实现 O(log n)
+"""
+
+import itertools
+import random
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+STRATEGIES = ("round_robin", "lru", "weighted")
+
+
+class _FenwickTree:
+    """树状数组：单点更新和按前缀和定位都是O(log n)"""
+
+    def __init__(self, values: Sequence[float]):
+        self.size = len(values)
+        self._tree = [0.0] * (self.size + 1)
+        for i, value in enumerate(values):
+            self.add(i, value)
+
+    def add(self, index: int, delta: float):
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def total(self) -> float:
+        return self.prefix(self.size)
+
+    def prefix(self, count: int) -> float:
+        """前count个元素之和"""
+        result = 0.0
+        while count > 0:
+            result += self._tree[count]
+            count -= count & -count
+        return result
+
+    def find(self, target: float) -> int:
+        """前缀和首次超过target的元素下标"""
+        index = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = index + step
+            if nxt <= self.size and self._tree[nxt] <= target:
+                index = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        return min(index, self.size - 1)
+
+
+class KeyPool:
+    """单个服务的密钥池
+
+    配置格式（config["key_pools"][service]）::
+
+        {"keys": ["sk-1", "sk-2"], "strategy": "weighted", "quotas": [1000, 500]}
+
+    quotas只用于weighted策略，表示各密钥在一个配额周期内的可用量；
+    调用方通过 record_usage 报告用量，reset_quotas 开始新的周期。
+    """
+
+    def __init__(self, keys: Sequence[str], strategy: str = "round_robin",
+                 quotas: Optional[Sequence[float]] = None):
+        if not keys:
+            raise ValueError("密钥池不能为空")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"不支持的选择策略: {strategy}")
+        if quotas is not None and len(quotas) != len(keys):
+            raise ValueError("quotas数量必须与keys一致")
+
+        self.keys: List[str] = list(keys)
+        self.strategy = strategy
+        self._positions: Dict[str, int] = {key: i for i, key in enumerate(self.keys)}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+        if strategy == "lru":
+            self._recent: "OrderedDict[str, None]" = OrderedDict.fromkeys(self.keys)
+        if strategy == "weighted":
+            self.quotas = [float(q) for q in (quotas or [1.0] * len(self.keys))]
+            self._remaining = list(self.quotas)
+            self._tree = _FenwickTree(self._remaining)
+
+    @classmethod
+    def from_config(cls, entry: Dict) -> "KeyPool":
+        """由配置项创建密钥池"""
+        return cls(entry["keys"], entry.get("strategy", "round_robin"), entry.get("quotas"))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def select(self, available: Optional[Callable[[str], bool]] = None) -> str:
+        """按策略选取一个密钥
+
+        available用于跳过暂不可用的密钥（如熔断中的密钥），最多尝试len(keys)次；
+        全部不可用时返回第一次选中的密钥，而不是拒绝服务。
+        """
+        key = self._select()
+        if available is None or available(key):
+            return key
+        for _ in range(len(self.keys) - 1):
+            candidate = self._select()
+            if available(candidate):
+                return candidate
+        return key
+
+    def _select(self) -> str:
+        if self.strategy == "round_robin":
+            # itertools.count的next在GIL下是原子的，无需加锁
+            return self.keys[next(self._counter) % len(self.keys)]
+        if self.strategy == "lru":
+            with self._lock:
+                key = next(iter(self._recent))
+                self._recent.move_to_end(key)
+                return key
+        return self._select_weighted()
+
+    def _select_weighted(self) -> str:
+        with self._lock:
+            total = self._tree.total()
+            if total <= 0:
+                # 所有配额都已用完时退化为轮询，而不是拒绝服务
+                return self.keys[next(self._counter) % len(self.keys)]
+            return self.keys[self._tree.find(random.random() * total)]
+
+    def touch(self, key: str):
+        """标记密钥刚被使用（lru策略下选取以外的使用方式）"""
+        if self.strategy == "lru" and key in self._positions:
+            with self._lock:
+                self._recent.move_to_end(key)
+
+    def record_usage(self, key: str, amount: float = 1):
+        """报告密钥用量，weighted策略下扣减剩余配额"""
+        index = self._positions.get(key)
+        if index is None or self.strategy != "weighted":
+            return
+        with self._lock:
+            used = min(amount, self._remaining[index])
+            if used > 0:
+                self._remaining[index] -= used
+                self._tree.add(index, -used)
+
+    def remaining(self, key: str) -> Optional[float]:
+        """密钥的剩余配额（仅weighted策略）"""
+        index = self._positions.get(key)
+        if index is None or self.strategy != "weighted":
+            return None
+        return self._remaining[index]
+
+    def reset_quotas(self):
+        """开始新的配额周期"""
+        if self.strategy != "weighted":
+            return
+        with self._lock:
+            self._remaining = list(self.quotas)
+            self._tree = _FenwickTree(self._remaining)
@@ -0,0 +1,176 @@
+"""
+密钥记录视图
+每个服务一条 __slots__ 记录，集中保存密钥、端点、速率限制、时间戳和元数据，
+调用方无需按服务名在 api_keys / endpoints / rates 等并列字典之间反复拼接。
+
+记录表是配置快照之上的只读派生视图，不是内存中的存储形式：get_api_key和各写操作
+仍直接使用配置字典。记录表只在首次调用 APIKeyManager.records() 时构建，构建后
+在配置之外额外占用内存（scripts/benchmark_records.py，10万个密钥时每个密钥
+约560字节增加到约733字节），不调用时不占用。
+"""
+
+import sys
+from typing import Any, Dict, Optional
+
+# 元数据中提升为独立槽位的字段
+TIMESTAMP_FIELDS = ("created_at", "updated_at")
+
+
+class KeyRecord:
+    """单个服务的密钥记录（只读）
+
+    没有实例字典，8个槽位固定占用约100字节；速率限制只保留rpm/tpm两个整数，
+    其余速率字段和元数据存放在共享的只读字典中（为空时为None，不额外占用内存）。
+    """
+
+    __slots__ = ("service", "key", "endpoint", "rpm", "tpm",
+                 "created_at", "updated_at", "metadata")
+
+    def __init__(self, service: str, key: Optional[str] = None,
+                 endpoint: Optional[str] = None, rpm: Optional[int] = None,
+                 tpm: Optional[int] = None, created_at: Optional[float] = None,
+                 updated_at: Optional[float] = None,
+                 metadata: Optional[Dict[str, Any]] = None):
+        self.service = service
+        self.key = key
+        self.endpoint = endpoint
+        self.rpm = rpm
+        self.tpm = tpm
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.metadata = metadata or None
+
+    @property
+    def rates(self) -> Dict[str, Any]:
+        """与配置文件rates节格式一致的速率限制"""
+        rates = {}
+        if self.rpm is not None:
+            rates["rpm"] = self.rpm
+        if self.tpm is not None:
+            rates["tpm"] = self.tpm
+        if self.metadata and "rates" in self.metadata:
+            rates.update(self.metadata["rates"])
+        return rates
+
+    def replace(self, **changes) -> "KeyRecord":
+        """返回修改了部分字段的新记录"""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return KeyRecord(**fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（供API返回）"""
+        return {
+            "service": self.service,
+            "key": self.key,
+            "endpoint": self.endpoint,
+            "rates": self.rates,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "metadata": {k: v for k, v in (self.metadata or {}).items() if k != "rates"},
+        }
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, KeyRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"KeyRecord(service={self.service!r}, endpoint={self.endpoint!r})"
+
+
+def _interner():
+    """返回值驻留函数：相同的端点/元数据值只保留一份对象"""
+    pool: Dict[Any, Any] = {}
+
+    def intern(value):
+        if value is None:
+            return None
+        try:
+            return pool.setdefault(value, value)
+        except TypeError:
+            # 不可哈希的元数据值原样保留
+            return value
+    return intern
+
+
+def build_records(config: Dict[str, Any],
+                  previous: Optional[Dict[str, KeyRecord]] = None,
+                  previous_config: Optional[Dict[str, Any]] = None) -> Dict[str, KeyRecord]:
+    """从配置构建 服务名 -> KeyRecord 表
+
+    服务名通过sys.intern驻留，与配置字典的键共享同一对象；端点等重复出现的值只保留一份。
+    传入上一版配置及其记录表时，各节中未变化（同一对象）的服务直接复用旧记录，
+    写时复制的配置快照之间只需为发生变更的服务创建新记录。
+    """
+    api_keys = config.get("api_keys", {})
+    endpoints = config.get("endpoints", {})
+    rates = config.get("rates", {})
+    metadata = config.get("metadata", {})
+
+    old_sections = None
+    if previous is not None and previous_config is not None:
+        old_sections = (previous_config.get("api_keys", {}), previous_config.get("endpoints", {}),
+                        previous_config.get("rates", {}), previous_config.get("metadata", {}))
+
+    intern = _interner()
+    records: Dict[str, KeyRecord] = {}
+    for service in {**api_keys, **endpoints, **rates, **metadata}:
+        values = (api_keys.get(service), endpoints.get(service),
+                  rates.get(service), metadata.get(service))
+        if old_sections is not None:
+            old = previous.get(service)
+            if old is not None and all(
+                value is section.get(service) for value, section in zip(values, old_sections)
+            ):
+                records[old.service] = old
+                continue
+        record = _make_record(sys.intern(service), values, intern)
+        records[record.service] = record
+    return records
+
+
+def update_records(records: Dict[str, KeyRecord], config: Dict[str, Any],
+                   services) -> Dict[str, KeyRecord]:
+    """只为services中的服务重建记录，返回新的记录表（原表不变）
+
+    单条写入后调用，不遍历其余服务；服务在各节中都已不存在时删除其记录。
+    """
+    sections = (config.get("api_keys", {}), config.get("endpoints", {}),
+                config.get("rates", {}), config.get("metadata", {}))
+    intern = _interner()
+    records = dict(records)
+    for service in services:
+        values = tuple(section.get(service) for section in sections)
+        if all(value is None for value in values):
+            records.pop(service, None)
+            continue
+        record = _make_record(sys.intern(service), values, intern)
+        records[record.service] = record
+    return records
+
+
+def _make_record(service: str, values, intern) -> KeyRecord:
+    """由配置各节的值创建一条记录"""
+    key, endpoint, rate, meta = values
+    extra: Dict[str, Any] = {}
+    rpm = tpm = None
+    if isinstance(rate, dict):
+        rpm = rate.get("rpm")
+        tpm = rate.get("tpm")
+        others = {k: v for k, v in rate.items() if k not in ("rpm", "tpm")}
+        if others:
+            extra["rates"] = others
+
+    timestamps = {}
+    if isinstance(meta, dict):
+        for name, value in meta.items():
+            if name in TIMESTAMP_FIELDS:
+                timestamps[name] = value
+            else:
+                extra[sys.intern(name)] = intern(value)
+
+    return KeyRecord(
+        service, key or None, intern(endpoint), rpm, tpm,
+        timestamps.get("created_at"), timestamps.get("updated_at"), extra,
+    )
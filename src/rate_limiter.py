@@ -0,0 +1,148 @@
+"""
+令牌桶限流器
+按配置文件中的 rates.{service}.rpm / tpm 限制每个密钥的请求数和token数。
+
+每个密钥一个桶对象，同时维护请求桶和token桶：容量为每分钟配额（允许一分钟的突发），
+按配额/60的速率连续补充。每个桶有自己的锁，不存在全局锁；
+热路径上只有两次字典查找和若干浮点运算，不分配新对象。
+"""
+
+import asyncio
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class _Bucket:
+    """单个密钥的请求桶 + token桶"""
+
+    __slots__ = ("lock", "request_capacity", "request_rate", "requests",
+                 "token_capacity", "token_rate", "tokens", "updated")
+
+    def __init__(self, rpm: Optional[float], tpm: Optional[float], now: float):
+        self.lock = threading.Lock()
+        # 未配置的限制视为无限
+        self.request_capacity = float(rpm) if rpm else math.inf
+        self.request_rate = self.request_capacity / 60
+        self.requests = self.request_capacity
+        self.token_capacity = float(tpm) if tpm else math.inf
+        self.token_rate = self.token_capacity / 60
+        self.tokens = self.token_capacity
+        self.updated = now
+
+    def take(self, tokens: float, now: float) -> float:
+        """尝试取出1个请求和tokens个token；成功返回0，否则返回需要等待的秒数"""
+        with self.lock:
+            elapsed = now - self.updated
+            if elapsed > 0:
+                self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+                self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+                self.updated = now
+
+            wait = 0.0
+            if self.requests < 1:
+                wait = (1 - self.requests) / self.request_rate
+            if self.tokens < tokens:
+                wait = max(wait, (tokens - self.tokens) / self.token_rate)
+            if wait == 0.0:
+                self.requests -= 1
+                self.tokens -= tokens
+            return wait
+
+
+class RateLimiter:
+    """按密钥的令牌桶限流器
+
+    rates: 与配置文件rates节格式相同，{service: {"rpm": 60, "tpm": 90000}}。
+    桶按 (服务名, 密钥) 区分，同一服务的多个密钥（密钥池）各自独立限流，
+    速率取该服务的配置；没有配置速率的服务不限流。
+    """
+
+    def __init__(self, rates: Optional[Dict[str, Dict[str, Any]]] = None, clock=time.monotonic):
+        self.rates = rates if rates is not None else {}
+        self.clock = clock
+        # 服务名 -> {密钥: 桶}，两级字典避免每次调用构造元组键
+        self._buckets: Dict[str, Dict[Optional[str], _Bucket]] = {}
+        # 只在首次创建桶时使用
+        self._create_lock = threading.Lock()
+
+    def _bucket(self, service: str, key: Optional[str]) -> Optional[_Bucket]:
+        buckets = self._buckets.get(service)
+        if buckets is not None:
+            bucket = buckets.get(key)
+            if bucket is not None:
+                return bucket
+
+        rate = self.rates.get(service)
+        if not rate or not (rate.get("rpm") or rate.get("tpm")):
+            return None
+        with self._create_lock:
+            buckets = self._buckets.setdefault(service, {})
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = _Bucket(rate.get("rpm"), rate.get("tpm"), self.clock())
+                buckets[key] = bucket
+        return bucket
+
+    def _check(self, bucket: _Bucket, tokens: float):
+        if tokens > bucket.token_capacity:
+            raise ValueError(f"单次请求的token数 {tokens} 超过每分钟上限 {bucket.token_capacity:g}")
+
+    def try_acquire(self, service: str, tokens: float = 0, key: Optional[str] = None) -> bool:
+        """非阻塞获取，配额不足时立即返回False"""
+        bucket = self._bucket(service, key)
+        if bucket is None:
+            return True
+        self._check(bucket, tokens)
+        return bucket.take(tokens, self.clock()) == 0.0
+
+    def acquire(self, service: str, tokens: float = 0, key: Optional[str] = None,
+                timeout: Optional[float] = None) -> bool:
+        """阻塞获取，等到配额补充为止；超过timeout秒返回False"""
+        bucket = self._bucket(service, key)
+        if bucket is None:
+            return True
+        self._check(bucket, tokens)
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            now = self.clock()
+            wait = bucket.take(tokens, now)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            time.sleep(wait)
+
+    async def acquire_async(self, service: str, tokens: float = 0, key: Optional[str] = None,
+                            timeout: Optional[float] = None) -> bool:
+        """异步获取，等待期间不阻塞事件循环"""
+        bucket = self._bucket(service, key)
+        if bucket is None:
+            return True
+        self._check(bucket, tokens)
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            now = self.clock()
+            wait = bucket.take(tokens, now)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            await asyncio.sleep(wait)
+
+    def update_rates(self, rates: Dict[str, Dict[str, Any]]):
+        """速率配置变更后丢弃受影响服务的桶，下次获取时按新配置创建"""
+        old = self.rates
+        self.rates = rates if rates is not None else {}
+        changed = {service for service in set(old) | set(self.rates)
+                   if old.get(service) != self.rates.get(service)}
+        if not changed:
+            return
+        with self._create_lock:
+            self._buckets = {service: buckets for service, buckets in self._buckets.items()
+                             if service not in changed}
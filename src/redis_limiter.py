@@ -0,0 +1,276 @@
+"""
+分布式令牌桶限流
+多个副本通过同一个Redis（或兼容Redis协议的服务）共享限流状态，
+每次获取只需一次往返：令牌桶的补充与扣减在服务端Lua脚本中原子完成，时间取服务端TIME。
+Redis不可用或返回错误时退回进程内限流器，并在retry_interval秒后重新尝试连接。
+
+客户端只实现了限流所需的最小RESP协议子集，不依赖redis-py。
+"""
+
+import asyncio
+import hashlib
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote, urlparse
+
+from rate_limiter import RateLimiter
+from usage_recorder import key_id
+
+TOKEN_BUCKET_SCRIPT = """
+local rcap = tonumber(ARGV[1])
+local tcap = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'r', 't', 'u')
+local r = tonumber(state[1]) or rcap
+local tk = tonumber(state[2]) or tcap
+local elapsed = now - (tonumber(state[3]) or now)
+if elapsed > 0 then
+  if rcap > 0 then r = math.min(rcap, r + elapsed * rcap / 60) end
+  if tcap > 0 then tk = math.min(tcap, tk + elapsed * tcap / 60) end
+end
+local wait = 0
+if rcap > 0 and r < 1 then wait = (1 - r) * 60 / rcap end
+if tcap > 0 and tk < tokens then wait = math.max(wait, (tokens - tk) * 60 / tcap) end
+if wait == 0 then
+  if rcap > 0 then r = r - 1 end
+  if tcap > 0 then tk = tk - tokens end
+end
+redis.call('HSET', KEYS[1], 'r', r, 't', tk, 'u', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(wait)
+"""
+TOKEN_BUCKET_SHA = hashlib.sha1(TOKEN_BUCKET_SCRIPT.encode('utf-8')).hexdigest()
+
+
+class RedisError(Exception):
+    """服务端返回的错误回复"""
+
+
+class RESPClient:
+    """最小的RESP客户端，带简单连接池（线程安全）"""
+
+    def __init__(self, url: str = "redis://localhost:6379/0", timeout: float = 1.0):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", ""):
+            raise ValueError(f"不支持的地址: {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    @classmethod
+    def _read_reply(cls, reader):
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("连接已关闭")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode('utf-8')
+        if kind == b"-":
+            return RedisError(payload.decode('utf-8'))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("连接已关闭")
+            return data[:-2].decode('utf-8')
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [cls._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"无法解析的回复: {line!r}")
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile('rb'))
+        try:
+            if self.password:
+                self._roundtrip(conn, ("AUTH", self.password))
+            if self.db:
+                self._roundtrip(conn, ("SELECT", self.db))
+        except RedisError as e:
+            # 认证或选择数据库失败时这个连接不可用，按连接错误处理
+            self._close(conn)
+            raise ConnectionError(f"Redis连接初始化失败: {e}") from e
+        except BaseException:
+            self._close(conn)
+            raise
+        return conn
+
+    def _roundtrip(self, conn, args):
+        sock, reader = conn
+        sock.sendall(self._encode(args))
+        reply = self._read_reply(reader)
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn[1].close()
+            conn[0].close()
+        except OSError:
+            pass
+
+    def execute(self, *args):
+        """执行一条命令并返回回复；连接错误时关闭该连接并抛出OSError"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            reply = self._roundtrip(conn, args)
+        except RedisError:
+            with self._lock:
+                self._idle.append(conn)
+            raise
+        except BaseException:
+            self._close(conn)
+            raise
+        with self._lock:
+            self._idle.append(conn)
+        return reply
+
+    def close(self):
+        """关闭所有空闲连接"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+
+class RedisRateLimiter:
+    """基于Redis的分布式令牌桶限流器，接口与RateLimiter相同
+
+    桶的键为 <prefix><service>:<密钥标识>，空闲两分钟后过期（此时桶必然已补满）。
+    """
+
+    def __init__(self, url: str, rates: Optional[Dict[str, Dict[str, Any]]] = None,
+                 prefix: str = "akm:rl:", retry_interval: float = 5.0,
+                 client: Optional[RESPClient] = None):
+        self.client = client or RESPClient(url)
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self.fallback = RateLimiter(rates)
+        self._down_until = 0.0
+
+    @property
+    def rates(self) -> Dict[str, Dict[str, Any]]:
+        return self.fallback.rates
+
+    def update_rates(self, rates: Dict[str, Dict[str, Any]]):
+        """更新速率配置（服务端的桶在下次获取时按新容量补充）"""
+        self.fallback.update_rates(rates)
+
+    @property
+    def available(self) -> bool:
+        """当前是否在使用Redis（而非进程内回退）"""
+        return time.monotonic() >= self._down_until
+
+    def _take(self, service: str, tokens: float, key: Optional[str]) -> Optional[float]:
+        """在服务端尝试获取，返回等待秒数；Redis不可用时返回None"""
+        if time.monotonic() < self._down_until:
+            return None
+        rate = self.rates.get(service)
+        rpm = (rate or {}).get("rpm") or 0
+        tpm = (rate or {}).get("tpm") or 0
+        bucket = f"{self.prefix}{service}:{key_id(key)}"
+        try:
+            try:
+                reply = self.client.execute("EVALSHA", TOKEN_BUCKET_SHA, 1, bucket, rpm, tpm, tokens)
+            except RedisError as e:
+                if not str(e).startswith("NOSCRIPT"):
+                    raise
+                # 服务端还没有缓存脚本，EVAL一次后之后都走EVALSHA
+                reply = self.client.execute("EVAL", TOKEN_BUCKET_SCRIPT, 1, bucket, rpm, tpm, tokens)
+            return float(reply)
+        except (OSError, RedisError, TypeError, ValueError):
+            # 连接失败、服务端错误（AUTH/OOM/READONLY等）或无法解析的回复都退回进程内限流
+            self._down_until = time.monotonic() + self.retry_interval
+            return None
+
+    def _limited(self, service: str, tokens: float) -> bool:
+        rate = self.rates.get(service)
+        if not rate or not (rate.get("rpm") or rate.get("tpm")):
+            return False
+        tpm = rate.get("tpm")
+        if tpm and tokens > tpm:
+            raise ValueError(f"单次请求的token数 {tokens} 超过每分钟上限 {tpm}")
+        return True
+
+    def try_acquire(self, service: str, tokens: float = 0, key: Optional[str] = None) -> bool:
+        """非阻塞获取"""
+        if not self._limited(service, tokens):
+            return True
+        wait = self._take(service, tokens, key)
+        if wait is None:
+            return self.fallback.try_acquire(service, tokens, key)
+        return wait == 0.0
+
+    def acquire(self, service: str, tokens: float = 0, key: Optional[str] = None,
+                timeout: Optional[float] = None) -> bool:
+        """阻塞获取"""
+        if not self._limited(service, tokens):
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._take(service, tokens, key)
+            if wait is None:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                return self.fallback.acquire(service, tokens, key, remaining)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                now = time.monotonic()
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            time.sleep(wait)
+
+    async def acquire_async(self, service: str, tokens: float = 0, key: Optional[str] = None,
+                            timeout: Optional[float] = None) -> bool:
+        """异步获取，网络往返在默认线程池中执行"""
+        if not self._limited(service, tokens):
+            return True
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = await loop.run_in_executor(None, self._take, service, tokens, key)
+            if wait is None:
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                return await self.fallback.acquire_async(service, tokens, key, remaining)
+            if wait == 0.0:
+                return True
+            if deadline is not None:
+                now = time.monotonic()
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            await asyncio.sleep(wait)
+
+    def close(self):
+        """关闭连接"""
+        self.client.close()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+更换静态加密主密钥
+把存储中的全部密文用新密钥重新加密：
+
+  - 记录按块分发到进程池，每个worker进程只构造一次MultiCipher(新密钥, 旧密钥...)，
+    用rotate解密并以新密钥重新加密，吞吐量随CPU核数增长
+  - 每完成一块就把结果追加到检查点文件，中途崩溃后重新执行会跳过已完成的记录。
+    检查点首行是随机标识和用新密钥加密的该标识（不含新密钥的任何摘要），
+    恢复时能用新密钥解密才沿用；原值摘要是以新密钥为键的HMAC
+  - 全部完成后由管理器按 配置 → 外部存储 → 删除检查点 的顺序写入（见 APIKeyManager.rekey）
+
+命令行::
+
+    KEY_ENCRYPTION_KEY=<旧密钥> NEW_KEY_ENCRYPTION_KEY=<新密钥> \\
+        python src/rekey.py --config config/api_config.json --workers 8
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+from utils.helpers import get_cipher, is_encrypted
+
+# (记录标识, 存储中的值)；记录标识是可JSON序列化的元组
+Item = Tuple[Tuple[Hashable, ...], str]
+
+_worker_cipher = None
+
+
+def _init_worker(keys: Tuple[str, ...], salt: Optional[str] = None):
+    """worker进程初始化：构造一次加密器，之后处理的每一块都复用"""
+    global _worker_cipher
+    _worker_cipher = get_cipher(keys, salt)
+
+
+def _rotate_chunk(chunk: List[Item]) -> List[Item]:
+    """用新密钥重新加密一块记录；加密前写入的明文直接加密"""
+    cipher = _worker_cipher
+    result = []
+    for item, value in chunk:
+        if is_encrypted(value):
+            token = cipher.rotate(value.encode())
+        else:
+            token = cipher.encrypt(value.encode())
+        result.append((item, token.decode()))
+    return result
+
+
+def _chunks(items: Sequence[Item], size: int) -> Iterator[List[Item]]:
+    for start in range(0, len(items), size):
+        yield list(items[start:start + size])
+
+
+class _Checkpoint:
+    """检查点文件（JSON Lines）：首行是本次更换的标识，之后每行是一块已完成的结果
+
+    首行 {"id": 随机标识, "check": 新密钥加密的标识}：只有用同一个新密钥重新执行时
+    才能解密check，否则检查点作废。每条结果同时记录原值的摘要（以新密钥为键的HMAC，
+    检查点中不出现明文值的普通哈希），恢复时原值已变化（期间又写入过）的记录重新处理。
+    """
+
+    def __init__(self, path: Optional[str], new_key: str, salt: Optional[str] = None):
+        self.path = path
+        self.new_key = new_key
+        self.salt = salt
+        self.id = secrets.token_hex(16)
+        self._file = None
+        # 已有检查点属于本次的新密钥时在其后追加
+        self._resume = False
+
+    def digest(self, value: str) -> str:
+        message = f"{self.id}\0{value}".encode('utf-8')
+        return hmac.new(self.new_key.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+    def _owned(self, header: Dict[str, str]) -> bool:
+        """检查点是否由同一个新密钥写入"""
+        from cryptography.fernet import InvalidToken
+        try:
+            check = get_cipher(self.new_key).decrypt(header["check"].encode())
+        except (KeyError, AttributeError, InvalidToken):
+            return False
+        return hmac.compare_digest(check, str(header.get("id", "")).encode())
+
+    def load(self) -> Dict[Tuple[Hashable, ...], Tuple[str, str]]:
+        """记录标识 -> (原值摘要, 新密文)"""
+        done: Dict[Tuple[Hashable, ...], Tuple[str, str]] = {}
+        if self.path is None or not os.path.exists(self.path):
+            return done
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except json.JSONDecodeError:
+            header = {}
+        if not isinstance(header, dict) or not self._owned(header):
+            # 上次更换的目标不是这个密钥，检查点作废
+            return done
+        self.id = header["id"]
+        self._resume = True
+        for line in lines[1:]:
+            try:
+                chunk = json.loads(line)
+            except json.JSONDecodeError:
+                # 崩溃时写了一半的最后一行
+                break
+            for item, digest, token in chunk:
+                done[tuple(item)] = (digest, token)
+        return done
+
+    def append(self, chunk: List[Item], sources: Dict[Tuple[Hashable, ...], str]):
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a' if self._resume else 'w', encoding='utf-8')
+            if not self._resume:
+                check = get_cipher(self.new_key, self.salt).encrypt(self.id.encode()).decode()
+                self._file.write(json.dumps({"id": self.id, "check": check}) + "\n")
+        self._file.write(json.dumps(
+            [[list(item), self.digest(sources[item]), token] for item, token in chunk]
+        ) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def remove_checkpoint(path: str):
+    """更换完成并落盘后删除检查点"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def rekey_items(items: Sequence[Item], new_key: str, old_keys: Sequence[str] = (),
+                workers: Optional[int] = None, chunk_size: int = 500,
+                checkpoint_path: Optional[str] = None,
+                salt: Optional[str] = None) -> Dict[Tuple[Hashable, ...], str]:
+    """把items中的值用new_key重新加密，返回 记录标识 -> 新密文
+
+    old_keys是存储中现有密文可能使用的密钥；salt是存储共用的口令派生盐（见Cipher）；
+    workers默认为CPU核数，记录不超过一块或workers为1时在当前进程中处理。
+    """
+    keys = tuple(dict.fromkeys((new_key, *old_keys)))
+    sources = {tuple(item): value for item, value in items}
+    checkpoint = _Checkpoint(checkpoint_path, new_key, salt)
+    done: Dict[Tuple[Hashable, ...], str] = {}
+    for item, (digest, token) in checkpoint.load().items():
+        if item in sources and hmac.compare_digest(digest, checkpoint.digest(sources[item])):
+            done[item] = token
+    pending = [(item, value) for item, value in sources.items() if item not in done]
+    if not pending:
+        return done
+
+    def finish(rotated: List[Item]):
+        rotated = [(tuple(item), token) for item, token in rotated]
+        checkpoint.append(rotated, sources)
+        done.update(rotated)
+
+    workers = workers or os.cpu_count() or 1
+    try:
+        if workers == 1 or len(pending) <= chunk_size:
+            _init_worker(keys, salt)
+            for chunk in _chunks(pending, chunk_size):
+                finish(_rotate_chunk(chunk))
+            return done
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(keys, salt)) as executor:
+            # 同时在途的块数有上限，记录逐块流过进程池
+            in_flight = set()
+            for chunk in _chunks(pending, chunk_size):
+                if len(in_flight) >= workers * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        finish(future.result())
+                in_flight.add(executor.submit(_rotate_chunk, chunk))
+            for future in in_flight:
+                finish(future.result())
+        return done
+    finally:
+        checkpoint.close()
+
+
+def main():
+    """命令行入口"""
+    import argparse
+    from api_key_manager import APIKeyManager
+
+    parser = argparse.ArgumentParser(description="更换静态加密主密钥")
+    parser.add_argument("--config", default="config/api_config.json", help="配置文件路径")
+    parser.add_argument("--workers", type=int, default=None, help="worker进程数（默认CPU核数）")
+    parser.add_argument("--chunk-size", type=int, default=500, help="每块记录数")
+    args = parser.parse_args()
+
+    old_key = os.getenv("KEY_ENCRYPTION_KEY")
+    new_key = os.getenv("NEW_KEY_ENCRYPTION_KEY")
+    if not new_key:
+        parser.error("需要通过 NEW_KEY_ENCRYPTION_KEY 环境变量提供新密钥")
+
+    manager = APIKeyManager(args.config, encryption_key=old_key)
+    try:
+        manager.rekey(new_key, workers=args.workers, chunk_size=args.chunk_size)
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+密钥轮换调度
+按到期时间维护一个最小堆，堆顶始终是最先需要轮换的密钥：
+
+  - 更换/删除密钥时O(log n)更新（旧条目惰性删除，过期条目过多时整体重建）
+  - 后台线程只睡眠到堆顶的到期时间，到期时依次触发回调
+  - "未来N天内到期" 从堆顶沿堆结构向下遍历，只访问结果条目及其子节点，O(k log n)
+
+到期时间 = 上次轮换时间 + rotation_days（config["security"]["rotation_days"]，
+可用 metadata[service]["rotation_days"] 按服务覆盖）。上次轮换时间保存在path文件中，
+重启后继续计算密钥年龄。
+"""
+
+import heapq
+import itertools
+import json
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from storage.fileio import atomic_write_json
+
+DAY = 86400.0
+
+# callback(service, due_at)，due_at为到期时间戳
+RotationCallback = Callable[[str, float], Any]
+
+
+def to_timestamp(value: Any) -> Optional[float]:
+    """把元数据中的时间（时间戳、ISO字符串或datetime）转换为时间戳"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+class RotationScheduler:
+    """按到期时间排序的密钥轮换调度器
+
+    到期回调触发后，若密钥仍未被更换，则在renotify_interval秒后再次触发。
+    """
+
+    def __init__(self, rotation_days: float = 90, path: Optional[str] = None,
+                 renotify_interval: float = DAY, clock=time.time):
+        self.rotation_days = rotation_days
+        self.path = path
+        self.renotify_interval = renotify_interval
+        self.clock = clock
+        # 堆条目: [到期时间, 序号, 服务名]；_entries中不是该服务当前条目的即为过期条目
+        self._heap: List[list] = []
+        self._entries: Dict[str, list] = {}
+        # 服务名 -> (上次轮换时间, 轮换周期天数)
+        self._rotated: Dict[str, Tuple[float, float]] = {}
+        self._counter = itertools.count()
+        self._callbacks: List[RotationCallback] = []
+        self._cond = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+        if path is not None:
+            self._load()
+
+    # ---- 堆维护 ----
+
+    def _push(self, service: str, due: float):
+        """调用方需持有锁"""
+        entry = [due, next(self._counter), service]
+        self._entries[service] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 16:
+            # 惰性删除留下的过期条目过多时整体重建
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def _is_live(self, entry: list) -> bool:
+        return self._entries.get(entry[2]) is entry
+
+    def _discard_stale_top(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    # ---- 调度 ----
+
+    def schedule(self, service: str, rotated_at: Optional[float] = None,
+                 rotation_days: Optional[float] = None, persist: bool = True):
+        """记录服务的密钥在rotated_at（默认当前时间）完成轮换，并安排下次到期"""
+        rotated_at = self.clock() if rotated_at is None else rotated_at
+        days = self.rotation_days if rotation_days is None else rotation_days
+        with self._cond:
+            self._rotated[service] = (rotated_at, days)
+            self._push(service, rotated_at + days * DAY)
+            self._cond.notify()
+        if persist:
+            self.save()
+
+    def schedule_many(self, services: Dict[str, Tuple[Optional[float], Optional[float]]]):
+        """批量安排，只写一次文件；值为 (上次轮换时间, 轮换周期天数)"""
+        for service, (rotated_at, days) in services.items():
+            self.schedule(service, rotated_at, days, persist=False)
+        self.save()
+
+    def unschedule(self, service: str, persist: bool = True):
+        """服务的密钥已删除，不再跟踪"""
+        with self._cond:
+            self._rotated.pop(service, None)
+            if self._entries.pop(service, None) is None:
+                return
+        if persist:
+            self.save()
+
+    def services(self) -> List[str]:
+        """正在跟踪的服务"""
+        return list(self._rotated)
+
+    def rotated_at(self, service: str) -> Optional[float]:
+        """服务的上次轮换时间"""
+        entry = self._rotated.get(service)
+        return entry[0] if entry is not None else None
+
+    def due_at(self, service: str) -> Optional[float]:
+        """服务下次触发回调（到期或再次提醒）的时间戳"""
+        entry = self._entries.get(service)
+        return entry[0] if entry is not None else None
+
+    def next_due(self) -> Optional[Tuple[str, float]]:
+        """最先到期的 (服务, 到期时间)"""
+        with self._cond:
+            self._discard_stale_top()
+            if not self._heap:
+                return None
+            due, _, service = self._heap[0]
+            return service, due
+
+    def expiring_within(self, days: float) -> List[Dict[str, Any]]:
+        """未来days天内（含已过期）到期的服务，按到期时间排序
+
+        从堆顶开始用一个辅助堆按调度时间展开子节点，超出范围的节点不再展开，
+        只访问k个结果及其子节点。已提醒过的过期条目被推迟到了renotify_interval之内，
+        因此展开范围至少覆盖renotify_interval，再按实际到期时间筛选。
+        """
+        now = self.clock()
+        horizon = now + days * DAY
+        limit = max(horizon, now + self.renotify_interval)
+        results = []
+        with self._cond:
+            heap = self._heap
+            frontier = [(heap[0][0], 0)] if heap else []
+            while frontier:
+                scheduled, index = heapq.heappop(frontier)
+                if scheduled > limit:
+                    break
+                entry = heap[index]
+                if self._is_live(entry):
+                    service = entry[2]
+                    rotated_at, rotation_days = self._rotated[service]
+                    due = rotated_at + rotation_days * DAY
+                    if due <= horizon:
+                        results.append({
+                            "service": service,
+                            "due_at": due,
+                            "days_left": max(0, int((due - now) // DAY)),
+                            "expired": due <= now,
+                            "age_days": int((now - rotated_at) // DAY),
+                        })
+                for child in (2 * index + 1, 2 * index + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child][0], child))
+        results.sort(key=lambda item: item["due_at"])
+        return results
+
+    # ---- 回调与后台线程 ----
+
+    def add_callback(self, callback: RotationCallback):
+        """注册到期回调（轮换或通知），回调在调度线程中执行"""
+        self._callbacks.append(callback)
+
+    def run_due(self) -> List[str]:
+        """触发所有已到期服务的回调，返回触发的服务名
+
+        先把到期条目推迟renotify_interval再调用回调：回调中更换密钥时
+        schedule会用新的到期时间覆盖该条目。
+        """
+        fired = []
+        now = self.clock()
+        with self._cond:
+            while True:
+                self._discard_stale_top()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, _, service = heapq.heappop(self._heap)
+                self._push(service, now + self.renotify_interval)
+                fired.append((service, due))
+        for service, due in fired:
+            for callback in list(self._callbacks):
+                try:
+                    callback(service, due)
+                except Exception as e:
+                    print(f"❌ {service} 轮换回调失败: {e}")
+        return [service for service, _ in fired]
+
+    def start(self):
+        """启动后台调度线程（只有一个）"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="key-rotation", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                self._discard_stale_top()
+                timeout = None
+                if self._heap:
+                    timeout = max(0.0, self._heap[0][0] - self.clock())
+                if timeout is None or timeout > 0:
+                    # 新条目可能更早到期，schedule会唤醒线程重新计算
+                    self._cond.wait(timeout)
+                    continue
+            self.run_due()
+
+    def stop(self):
+        """停止后台线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    # ---- 持久化 ----
+
+    def save(self):
+        """写入各服务的上次轮换时间"""
+        if self.path is None:
+            return
+        with self._cond:
+            data = {service: {"rotated_at": rotated_at, "rotation_days": days}
+                    for service, (rotated_at, days) in self._rotated.items()}
+        atomic_write_json(self.path, data, fsync=False)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        for service, entry in data.items():
+            self.schedule(service, entry["rotated_at"], entry.get("rotation_days"), persist=False)
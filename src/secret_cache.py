@@ -0,0 +1,91 @@
+"""
+解密结果缓存
+启用静态加密后，热路径上的每次读取都要做一次HMAC校验和AES解密。
+本缓存按服务名保存最近解密的明文：
+
+  - 容量有上限，超出时淘汰最久未访问的条目（LRU）
+  - 条目超过ttl秒后过期，过期后的读取重新解密
+  - 条目同时记录对应的密文，存储中的密文变化（如其它进程写入）时自动失效
+  - set/remove时由管理器显式清除对应条目
+
+配置（config["security"]，均可省略）::
+
+    {"decrypted_cache_size": 1024, "decrypted_cache_ttl": 300}
+
+decrypted_cache_size为0时不缓存。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class SecretCache:
+    """有界、带TTL的LRU解密缓存"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        # 服务名 -> (密文, 明文, 过期时间)
+        self._entries: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, service: str, token: str) -> Optional[str]:
+        """命中时返回明文；未缓存、已过期或密文已变化时返回None"""
+        with self._lock:
+            entry = self._entries.get(service)
+            if entry is not None:
+                if entry[0] == token and entry[2] > self.clock():
+                    self._entries.move_to_end(service)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[service]
+                if entry[0] == token:
+                    self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, service: str, token: str, value: str):
+        """缓存一次解密结果"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[service] = (token, value, self.clock() + self.ttl)
+            self._entries.move_to_end(service)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, services: Iterable[str]):
+        """立即清除指定服务的条目"""
+        with self._lock:
+            for service in services:
+                self._entries.pop(service, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """命中/未命中/淘汰/过期计数和当前大小"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
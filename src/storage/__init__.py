@@ -0,0 +1,31 @@
+"""
+存储引擎模块
+提供API密钥配置的持久化后端
+"""
+
+from .base import KeyStore, create_key_store
+from .memory_store import MemoryKeyStore
+from .json_store import JSONKeyStore
+from .sqlite_store import SQLiteKeyStore
+from .mmap_store import MmapKeyStore
+from .sharded_store import ShardedKeyStore
+from .shm_cache import SharedKeyCache
+from .journal import JournalStore
+from .group_commit import GroupCommitWriter
+from .history import KeyHistory
+from .owner_index import OwnerIndex
+
+__all__ = [
+    "KeyStore",
+    "create_key_store",
+    "MemoryKeyStore",
+    "JSONKeyStore",
+    "SQLiteKeyStore",
+    "MmapKeyStore",
+    "ShardedKeyStore",
+    "SharedKeyCache",
+    "JournalStore",
+    "GroupCommitWriter",
+    "KeyHistory",
+    "OwnerIndex",
+]
@@ -0,0 +1,75 @@
+"""
+密钥存储后端接口
+所有HTTP前端通过同一接口访问密钥，按部署环境选择后端
+"""
+
+import os
+from typing import Dict, Iterable, Optional, Protocol, runtime_checkable
+
+# 各后端在指定目录下的默认文件名（memory后端不需要路径）
+DEFAULT_NAMES = {
+    "json": "keys.json",
+    "sqlite": "keys.db",
+    "mmap": "keys.bin",
+    "sharded": "shards",
+}
+
+
+@runtime_checkable
+class KeyStore(Protocol):
+    """服务名 -> API密钥 的存储后端"""
+
+    def get(self, service: str) -> Optional[str]:
+        """获取密钥，不存在时返回None"""
+        ...
+
+    def set(self, service: str, key: str) -> None:
+        """设置密钥"""
+        ...
+
+    def set_many(self, keys: Dict[str, str]) -> None:
+        """批量设置密钥，只持久化一次"""
+        ...
+
+    def delete(self, service: str) -> bool:
+        """删除密钥，返回是否存在"""
+        ...
+
+    def delete_many(self, services: Iterable[str]) -> int:
+        """批量删除密钥，只持久化一次，返回实际删除的数量"""
+        ...
+
+    def items(self) -> Dict[str, str]:
+        """返回全部密钥的副本"""
+        ...
+
+    def close(self) -> None:
+        """释放资源"""
+        ...
+
+
+def create_key_store(backend: str = "json", path: Optional[str] = None,
+                     directory: Optional[str] = None) -> KeyStore:
+    """按名称创建存储后端: json / sqlite / mmap / sharded / memory
+
+    未指定path时：给出directory则使用该目录下此后端的默认文件名（如 keys.db、shards），
+    否则使用各后端自己的默认位置。
+    """
+    if path is None and directory is not None and backend in DEFAULT_NAMES:
+        path = os.path.join(directory, DEFAULT_NAMES[backend])
+    if backend == "memory":
+        from .memory_store import MemoryKeyStore
+        return MemoryKeyStore()
+    if backend == "json":
+        from .json_store import JSONKeyStore
+        return JSONKeyStore(path or "config/api_config.json")
+    if backend == "sqlite":
+        from .sqlite_store import SQLiteKeyStore
+        return SQLiteKeyStore(path or "data/keys.db")
+    if backend == "mmap":
+        from .mmap_store import MmapKeyStore
+        return MmapKeyStore(path or "data/keys.bin")
+    if backend == "sharded":
+        from .sharded_store import ShardedKeyStore
+        return ShardedKeyStore(path or "data/shards")
+    raise ValueError(f"不支持的存储后端: {backend}")
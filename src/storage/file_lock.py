@@ -0,0 +1,81 @@
+"""
+跨进程文件锁
+多个uvicorn worker写同一份配置时用建议锁串行化写操作
+"""
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """可重入的跨进程排它锁
+
+    同一进程内的线程先通过内部RLock排队，最外层进入时才对锁文件加锁，
+    嵌套进入只增加计数。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        """获取锁（阻塞）"""
+        self._local.acquire()
+        if self._depth == 0:
+            try:
+                self._fd = self._lock_file()
+            except BaseException:
+                self._local.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        """释放锁"""
+        self._depth -= 1
+        if self._depth == 0:
+            fd, self._fd = self._fd, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            finally:
+                os.close(fd)
+        self._local.release()
+
+    def _lock_file(self) -> int:
+        """打开锁文件并加排它锁"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK重试10次后仍失败会抛错，继续等待
+                        continue
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,38 @@
+"""
+文件读写工具
+提供原子写入，避免进程崩溃时留下半截文件
+"""
+
+import json
+import os
+import tempfile
+from typing import Any
+
+
+def atomic_write_bytes(path: str, data: bytes, fsync: bool = True):
+    """原子写入二进制文件（临时文件 + rename）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_text(path: str, text: str, fsync: bool = True):
+    """原子写入文本文件"""
+    atomic_write_bytes(path, text.encode('utf-8'), fsync=fsync)
+
+
+def atomic_write_json(path: str, data: Any, fsync: bool = True):
+    """原子写入JSON文件"""
+    atomic_write_text(path, json.dumps(data, indent=2, ensure_ascii=False), fsync=fsync)
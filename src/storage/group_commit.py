@@ -0,0 +1,82 @@
+"""
+组提交写入线程
+把一个时间窗口内到达的多次保存请求合并为一次原子写入
+"""
+
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+from .fileio import atomic_write_text
+
+
+class GroupCommitWriter:
+    """组提交写入器
+
+    调用 ``submit()`` 登记一次保存请求并立即返回 ``Future``；
+    专用写入线程在收到第一个请求后等待 ``window`` 秒，
+    然后把当前状态序列化一次、原子写入磁盘，并完成这一批所有的 ``Future``。
+    ``source`` 需返回不会被原地修改的快照，写入线程序列化时不加锁。
+    """
+
+    def __init__(self, path: str, source: Callable[[], Dict[str, Any]],
+                 window: float = 0.005, fsync: bool = True):
+        self.path = path
+        self.window = window
+        self.fsync = fsync
+        self.commits = 0
+
+        self._source = source
+        self._cond = threading.Condition()
+        self._pending: List[Future] = []
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="group-commit-writer", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self) -> Future:
+        """登记一次保存请求，返回在数据落盘后完成的Future"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("组提交写入线程已关闭")
+            self._pending.append(future)
+            self._cond.notify()
+        return future
+
+    def flush(self):
+        """阻塞直到当前所有变更落盘"""
+        self.submit().result()
+
+    def _run(self):
+        """写入线程主循环"""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                if self.window > 0:
+                    # 等待窗口内的其它请求加入本批次，关闭时提前结束等待
+                    self._cond.wait_for(lambda: self._closed, timeout=self.window)
+                batch, self._pending = self._pending, []
+
+            try:
+                text = json.dumps(self._source(), indent=2, ensure_ascii=False)
+                atomic_write_text(self.path, text, fsync=self.fsync)
+            except BaseException as e:
+                for future in batch:
+                    future.set_exception(e)
+            else:
+                self.commits += 1
+                for future in batch:
+                    future.set_result(None)
+
+    def close(self):
+        """写完剩余请求后停止写入线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
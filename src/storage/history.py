@@ -0,0 +1,149 @@
+"""
+密钥版本历史
+每次变更只向历史文件追加一行增量（服务名、时间戳、新值），不复制整个存储；
+内存中按服务维护有序的时间戳索引，时间点查询用二分查找。
+
+记录格式（JSON Lines）::
+
+    {"s": "openai", "t": 1700000000.0, "v": "sk-..."}   设置
+    {"s": "openai", "t": 1700000100.0, "v": null}       删除
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class KeyHistory:
+    """按服务的追加式版本历史
+
+    服务的第N条记录即其版本N（从1开始）。索引的两个列表只追加，
+    读取方无需加锁：先追加值再追加时间戳，二分查找命中的位置总有对应的值。
+    """
+
+    def __init__(self, path: str, shared: bool = False):
+        """
+        shared:
+          多进程共享同一历史文件。调用方在写入时持有跨进程锁；
+          读取前检查文件是否增长并增量加载其它进程追加的记录
+        """
+        self.path = path
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._file = None
+        self._offset = 0
+        # 服务名 -> (时间戳列表, 值列表)
+        self._index: Dict[str, Tuple[List[float], List[Optional[str]]]] = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            self._load(truncate=True)
+
+    def _load(self, truncate: bool = False):
+        """从上次读到的位置继续加载记录"""
+        with self._lock:
+            valid = 0
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        break
+                    self._add(record["s"], record["t"], record["v"])
+                    valid += len(line)
+            if truncate and self._offset + valid < os.path.getsize(self.path):
+                # 截掉崩溃留下的半条记录
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self._offset + valid)
+            self._offset += valid
+
+    def refresh(self):
+        """加载其它进程追加的记录"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size > self._offset:
+            self._load()
+
+    def _add(self, service: str, timestamp: float, value: Optional[str]) -> int:
+        """把一条记录加入索引，返回版本号"""
+        timestamps, values = self._index.setdefault(service, ([], []))
+        if timestamps and timestamp < timestamps[-1]:
+            # 系统时钟回拨时保持单调，二分查找依赖有序
+            timestamp = timestamps[-1]
+        values.append(value)
+        timestamps.append(timestamp)
+        return len(values)
+
+    def append(self, changes: Dict[str, Optional[str]],
+               timestamp: Optional[float] = None) -> Dict[str, int]:
+        """追加一批变更（值为None表示删除），一次写入；返回各服务的新版本号"""
+        if not changes:
+            return {}
+        timestamp = time.time() if timestamp is None else timestamp
+        data = "".join(
+            json.dumps({"s": service, "t": timestamp, "v": value},
+                       ensure_ascii=False, separators=(",", ":")) + "\n"
+            for service, value in changes.items()
+        ).encode('utf-8')
+
+        if self.shared:
+            self.refresh()
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'ab')
+                self.exists = True
+            self._file.write(data)
+            self._file.flush()
+            self._offset += len(data)
+            return {service: self._add(service, timestamp, value)
+                    for service, value in changes.items()}
+
+    def value_at(self, service: str, timestamp: float) -> Optional[str]:
+        """服务在某一时刻的值，当时不存在或已删除时返回None（O(log n)）"""
+        if self.shared:
+            self.refresh()
+        entry = self._index.get(service)
+        if entry is None:
+            return None
+        timestamps, values = entry
+        i = bisect.bisect_right(timestamps, timestamp)
+        return values[i - 1] if i else None
+
+    def value(self, service: str, version: int) -> Optional[str]:
+        """服务指定版本的值"""
+        if self.shared:
+            self.refresh()
+        entry = self._index.get(service)
+        if entry is None or not 1 <= version <= len(entry[1]):
+            raise KeyError(f"{service} 没有版本 {version}")
+        return entry[1][version - 1]
+
+    def versions(self, service: str) -> List[Dict[str, object]]:
+        """列出服务的全部版本（不含密钥值）"""
+        if self.shared:
+            self.refresh()
+        timestamps, values = self._index.get(service, ([], []))
+        return [
+            {"version": i + 1, "timestamp": timestamps[i], "deleted": values[i] is None}
+            for i in range(len(timestamps))
+        ]
+
+    def services(self) -> Iterable[str]:
+        """有历史记录的服务"""
+        return list(self._index)
+
+    def close(self):
+        """关闭历史文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,258 @@
+"""
+追加式日志存储引擎
+每次变更只向日志文件追加一行JSON，写入代价与存储规模无关；
+日志达到阈值后在后台线程中压缩为快照。
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from .fileio import atomic_write_json
+
+
+class JournalStore:
+    """快照 + 追加日志存储
+
+    启动时加载快照并按顺序重放日志。压缩时先把当前日志轮转为
+    ``.old`` 文件，再在后台写入新快照，写完后删除 ``.old``。
+    日志中的每条记录都是绝对值写入（set/delete），重复重放是幂等的，
+    因此在任何时刻崩溃都能恢复出一致的状态。
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: Optional[str] = None,
+                 compact_threshold: int = 1000, fsync: bool = False,
+                 shared: bool = False):
+        """
+        shared:
+          多进程共享同一组文件。调用方负责在写入和压缩时持有跨进程锁；
+          追加前会检查日志是否已被其它进程轮转，读取方用 ``refresh()`` 增量同步
+        """
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or f"{snapshot_path}.journal"
+        self.rotated_path = f"{self.journal_path}.old"
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self.shared = shared
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._entries = 0
+        self._compactor: Optional[threading.Thread] = None
+        # 已同步到的文件状态，用于增量刷新
+        self._snapshot_state = None
+        self._journal_ino = None
+        self._offset = 0
+
+    @staticmethod
+    def _file_state(path: str):
+        """文件身份：被原子替换后inode变化，原地重写后mtime变化"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self, recover: bool = True) -> Optional[Dict[str, Any]]:
+        """加载快照并重放日志，两者都不存在时返回None
+
+        recover为False时只读不写（不合并旧日志、不截断损坏的尾部），
+        用于未持有跨进程锁的读取方。
+        """
+        while True:
+            config = None
+            snapshot_state = None
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                    st = os.fstat(f.fileno())
+                    snapshot_state = (st.st_ino, st.st_mtime_ns, st.st_size)
+                    config = json.load(f)
+
+            if os.path.exists(self.rotated_path):
+                config = config if config is not None else {}
+                self._replay(self.rotated_path, config, truncate=recover)
+                if recover:
+                    # 上次压缩未完成就退出了，先把旧日志合并进快照
+                    self._write_snapshot(config)
+                    snapshot_state = self._file_state(self.snapshot_path)
+
+            self._entries = 0
+            self._offset = 0
+            self._journal_ino = None
+            if os.path.exists(self.journal_path):
+                config = config if config is not None else {}
+                self._journal_ino = os.stat(self.journal_path).st_ino
+                self._entries, self._offset = self._replay(
+                    self.journal_path, config, truncate=recover
+                )
+
+            if recover or self._file_state(self.snapshot_path) == snapshot_state:
+                self._snapshot_state = snapshot_state
+                return config
+            # 读取期间其它进程完成了压缩，重新加载
+
+    def _journal_stat(self):
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def changed(self) -> bool:
+        """快照或日志是否被其它进程修改（只做stat，开销很小）"""
+        if self._file_state(self.snapshot_path) != self._snapshot_state:
+            return True
+        journal_ino, journal_size = self._journal_stat()
+        return journal_ino != self._journal_ino or journal_size > self._offset
+
+    def refresh(self, config: Dict[str, Any], recover: bool = False) -> Optional[Dict[str, Any]]:
+        """同步其它进程的变更，没有变化时返回None
+
+        只有日志增长时只重放新增的尾部；快照被替换或日志被轮转时整体重新加载。
+        传入的config不会被修改。recover为True表示调用方持有跨进程锁，可以截断损坏的尾部。
+        """
+        journal_ino, journal_size = self._journal_stat()
+        if (self._file_state(self.snapshot_path) != self._snapshot_state
+                or journal_ino != self._journal_ino):
+            return self.load(recover=recover)
+
+        if journal_size <= self._offset:
+            return None
+
+        # 写时复制：只复制顶层和各节字典，不修改调用方持有的快照
+        config = {k: dict(v) if isinstance(v, dict) else v for k, v in config.items()}
+        count, consumed = self._replay(
+            self.journal_path, config, start=self._offset, truncate=recover
+        )
+        self._entries += count
+        self._offset += consumed
+        return config if count else None
+
+    def _replay(self, path: str, config: Dict[str, Any], start: int = 0,
+                truncate: bool = True):
+        """重放日志文件，返回 (应用的记录数, 消费的字节数)"""
+        count = 0
+        valid_size = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 进程在写入过程中崩溃留下的半条记录（或其它进程正在写入）
+                    break
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    break
+                self.apply(config, record)
+                count += 1
+                valid_size += len(line)
+
+        if truncate and start + valid_size < os.path.getsize(path):
+            # 截掉损坏的尾部，避免后续追加的记录与之拼接
+            with open(path, 'r+b') as f:
+                f.truncate(start + valid_size)
+        return count, valid_size
+
+    @staticmethod
+    def apply(config: Dict[str, Any], record: Dict[str, Any]):
+        """把一条日志记录应用到配置上"""
+        section = config.setdefault(record["section"], {})
+        if record["op"] == "set":
+            section[record["name"]] = record.get("value")
+        elif record["op"] == "delete":
+            section.pop(record["name"], None)
+
+    def append(self, op: str, section: str, name: str, value: Any = None):
+        """追加一条变更记录"""
+        self.append_many([(op, section, name, value)])
+
+    def append_many(self, changes: Iterable[Tuple[str, str, str, Any]]):
+        """一次写入追加多条变更记录 (op, section, name, value)"""
+        lines = []
+        for op, section, name, value in changes:
+            record = {"op": op, "section": section, "name": name}
+            if op == "set":
+                record["value"] = value
+            lines.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        if not lines:
+            return
+        data = "".join(lines).encode('utf-8')
+
+        with self._lock:
+            if self._file is not None and self.shared and self._rotated_elsewhere():
+                self._file.close()
+                self._file = None
+            if self._file is None:
+                directory = os.path.dirname(os.path.abspath(self.journal_path))
+                os.makedirs(directory, exist_ok=True)
+                self._file = open(self.journal_path, 'ab')
+                self._journal_ino = os.fstat(self._file.fileno()).st_ino
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._entries += len(lines)
+            self._offset += len(data)
+
+    def _rotated_elsewhere(self) -> bool:
+        """日志文件是否已被其它进程轮转"""
+        try:
+            return os.stat(self.journal_path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def needs_compaction(self) -> bool:
+        """日志条数是否达到压缩阈值"""
+        return self._entries >= self.compact_threshold and not self.is_compacting()
+
+    def is_compacting(self) -> bool:
+        """后台压缩是否正在进行"""
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def compact(self, config: Dict[str, Any], background: bool = True):
+        """把当前状态压缩为快照并清空日志"""
+        if not background and self._compactor is not None:
+            self._compactor.join()
+
+        with self._lock:
+            if self.is_compacting():
+                # 上一轮的.old文件还没合并进快照，不能再次轮转
+                return
+            # 调用方传入的是写时复制的快照，后台线程可以直接序列化
+            snapshot = config
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.journal_path):
+                os.replace(self.journal_path, self.rotated_path)
+            self._entries = 0
+            self._offset = 0
+            self._journal_ino = None
+
+            if background:
+                self._compactor = threading.Thread(
+                    target=self._write_snapshot, args=(snapshot,),
+                    name="journal-compactor", daemon=True
+                )
+                self._compactor.start()
+                return
+
+        self._write_snapshot(snapshot)
+
+    def _write_snapshot(self, snapshot: Dict[str, Any]):
+        """写入快照并删除已合并的旧日志"""
+        atomic_write_json(self.snapshot_path, snapshot)
+        self._snapshot_state = self._file_state(self.snapshot_path)
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def close(self):
+        """等待后台压缩完成并关闭日志文件"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
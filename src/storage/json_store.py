@@ -0,0 +1,106 @@
+"""
+JSON文件存储后端
+密钥保存在配置文件的api_keys节中，与APIKeyManager的配置格式兼容。
+多个进程可以共用同一文件：读取前检查文件身份（inode、mtime、大小），被其它进程替换后
+重新加载；写入持有跨进程文件锁（<path>.keys.lock），在最新内容上合并变更。
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional
+
+from .file_lock import FileLock
+from .fileio import atomic_write_json
+
+
+def _identity(st: os.stat_result) -> tuple:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class JSONKeyStore:
+    """JSON配置文件存储，每次写入原子重写整个文件"""
+
+    def __init__(self, path: str = "config/api_config.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        # 与APIKeyManager的 <config_path>.lock 区分，两者指向同一文件时不会互相等待
+        self._file_lock = FileLock(f"{path}.keys.lock")
+        self._identity = None
+        self._config = self._load()
+
+    def _load(self) -> Dict[str, Any]:
+        """加载配置文件并记录其身份"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._identity = _identity(os.fstat(f.fileno()))
+                config = json.load(f)
+        except FileNotFoundError:
+            self._identity = None
+            config = {}
+        config.setdefault("api_keys", {})
+        return config
+
+    def _refresh(self):
+        """文件被其它进程替换后重新加载（调用方需持有self._lock）"""
+        try:
+            identity = _identity(os.stat(self.path))
+        except FileNotFoundError:
+            identity = None
+        if identity != self._identity:
+            self._config = self._load()
+
+    def _save(self):
+        """原子写入配置文件"""
+        atomic_write_json(self.path, self._config, fsync=False)
+        self._identity = _identity(os.stat(self.path))
+
+    @contextmanager
+    def _writing(self):
+        """写操作：持有进程内锁和跨进程文件锁，先加载其它进程的写入，产出api_keys"""
+        with self._lock, self._file_lock:
+            self._refresh()
+            yield self._config["api_keys"]
+
+    def get(self, service: str) -> Optional[str]:
+        """获取密钥"""
+        with self._lock:
+            self._refresh()
+            return self._config["api_keys"].get(service)
+
+    def set(self, service: str, key: str) -> None:
+        """设置密钥"""
+        self.set_many({service: key})
+
+    def set_many(self, keys: Dict[str, str]) -> None:
+        """批量设置密钥"""
+        with self._writing() as current:
+            current.update(keys)
+            self._save()
+
+    def delete(self, service: str) -> bool:
+        """删除密钥"""
+        with self._writing() as current:
+            if service not in current:
+                return False
+            del current[service]
+            self._save()
+            return True
+
+    def delete_many(self, services: Iterable[str]) -> int:
+        """批量删除密钥，只写一次文件"""
+        with self._writing() as current:
+            removed = sum(current.pop(service, None) is not None for service in services)
+            if removed:
+                self._save()
+            return removed
+
+    def items(self) -> Dict[str, str]:
+        """返回全部密钥"""
+        with self._lock:
+            self._refresh()
+            return dict(self._config["api_keys"])
+
+    def close(self) -> None:
+        """每次写入都已落盘，无需释放资源"""
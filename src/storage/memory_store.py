@@ -0,0 +1,50 @@
+"""
+内存存储后端
+不做持久化，适合测试和临时进程
+"""
+
+import threading
+from typing import Dict, Iterable, Optional
+
+
+class MemoryKeyStore:
+    """基于字典的内存存储"""
+
+    # 只在本进程内可见，不能供多进程模式的APIKeyManager共用
+    shared = False
+
+    def __init__(self, keys: Optional[Dict[str, str]] = None):
+        self._keys: Dict[str, str] = dict(keys or {})
+        self._lock = threading.Lock()
+
+    def get(self, service: str) -> Optional[str]:
+        """获取密钥"""
+        return self._keys.get(service)
+
+    def set(self, service: str, key: str) -> None:
+        """设置密钥"""
+        with self._lock:
+            self._keys[service] = key
+
+    def set_many(self, keys: Dict[str, str]) -> None:
+        """批量设置密钥"""
+        with self._lock:
+            self._keys.update(keys)
+
+    def delete(self, service: str) -> bool:
+        """删除密钥"""
+        with self._lock:
+            return self._keys.pop(service, None) is not None
+
+    def delete_many(self, services: Iterable[str]) -> int:
+        """批量删除密钥"""
+        with self._lock:
+            return sum(self._keys.pop(service, None) is not None for service in services)
+
+    def items(self) -> Dict[str, str]:
+        """返回全部密钥"""
+        with self._lock:
+            return dict(self._keys)
+
+    def close(self) -> None:
+        """内存存储无需释放资源"""
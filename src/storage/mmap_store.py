@@ -0,0 +1,248 @@
+"""
+内存映射二进制存储后端
+定长哈希索引 + 变长数据区，通过mmap按需读取，无需反序列化整个文件。
+同一主机上的多个进程共享同一份页缓存。
+
+文件格式（小端）：
+  头部   magic(4s) version(H) superseded(H) slot_count(I) entry_count(I)
+  索引   slot_count 个槽位: hash(Q) offset(Q) service_len(H) key_len(I)
+  数据区 每条记录为 service字节 + key字节
+offset为0表示空槽位；索引采用线性探测，装载因子不超过0.5。
+
+写入方原子替换文件后把旧文件头部的superseded置1，仍映射着旧文件的进程
+在下一次读取时只需检查这一个字节就能发现文件已被替换并重新映射。
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .file_lock import FileLock
+from .fileio import atomic_write_bytes
+
+MAGIC = b"AKMS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+SLOT = struct.Struct("<QQHI")
+# 头部superseded字段的偏移
+_SUPERSEDED = 6
+
+
+def _hash(data: bytes) -> int:
+    """跨进程稳定的64位哈希"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def encode_table(keys: Dict[str, str]) -> bytes:
+    """把密钥编码为二进制表（头部 + 索引 + 数据区）"""
+    slot_count = 1
+    while slot_count < len(keys) * 2:
+        slot_count <<= 1
+    mask = slot_count - 1
+
+    index = bytearray(slot_count * SLOT.size)
+    data = bytearray()
+    data_start = HEADER.size + len(index)
+    for service, key in keys.items():
+        service_bytes = service.encode('utf-8')
+        key_bytes = key.encode('utf-8')
+        h = _hash(service_bytes)
+        i = h & mask
+        while SLOT.unpack_from(index, i * SLOT.size)[1] != 0:
+            i = (i + 1) & mask
+        SLOT.pack_into(index, i * SLOT.size, h, data_start + len(data),
+                       len(service_bytes), len(key_bytes))
+        data += service_bytes
+        data += key_bytes
+
+    header = HEADER.pack(MAGIC, VERSION, 0, slot_count, len(keys))
+    return header + bytes(index) + bytes(data)
+
+
+def read_header(buf) -> Tuple[int, int]:
+    """校验头部，返回 (slot_count, entry_count)"""
+    magic, version, _, slot_count, count = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("不是有效的密钥表")
+    return slot_count, count
+
+
+def lookup(buf, slot_count: int, service: str) -> Optional[str]:
+    """在二进制表中按服务名查找密钥，buf可以是mmap或共享内存的memoryview"""
+    service_bytes = service.encode('utf-8')
+    h = _hash(service_bytes)
+    mask = slot_count - 1
+    i = h & mask
+    while True:
+        slot_hash, offset, service_len, key_len = SLOT.unpack_from(
+            buf, HEADER.size + i * SLOT.size
+        )
+        if offset == 0:
+            return None
+        if (slot_hash == h and service_len == len(service_bytes)
+                and buf[offset:offset + service_len] == service_bytes):
+            start = offset + service_len
+            return bytes(buf[start:start + key_len]).decode('utf-8')
+        i = (i + 1) & mask
+
+
+def iter_table(buf, slot_count: int) -> Iterator[Tuple[str, str]]:
+    """遍历二进制表中的所有记录"""
+    for i in range(slot_count):
+        _, offset, service_len, key_len = SLOT.unpack_from(buf, HEADER.size + i * SLOT.size)
+        if offset == 0:
+            continue
+        start = offset + service_len
+        yield (bytes(buf[offset:start]).decode('utf-8'),
+               bytes(buf[start:start + key_len]).decode('utf-8'))
+
+
+class MmapKeyStore:
+    """只读优化的mmap存储
+
+    打开文件只读取16字节头部，``get`` 为O(1)的哈希探测。
+    写操作会重建整个文件并原子替换，适合读多写少的sidecar场景。
+    其它进程重建文件后，读取时发现旧文件已被标记替换会自动切换到新版本；
+    写操作持有跨进程文件锁（<path>.lock），在最新版本上合并变更，多个进程写入互不覆盖。
+    """
+
+    def __init__(self, path: str = "data/keys.bin"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock")
+        self._view = None
+        self._stat = None
+        if not os.path.exists(path):
+            with self._file_lock:
+                if not os.path.exists(path):
+                    self.write(path, {})
+        self._open()
+
+    @staticmethod
+    def write(path: str, keys: Dict[str, str]):
+        """把密钥写成二进制存储文件，并标记被替换的旧文件"""
+        try:
+            old = open(path, 'r+b')
+        except FileNotFoundError:
+            old = None
+        try:
+            atomic_write_bytes(path, encode_table(keys))
+            if old is not None and old.read(len(MAGIC)) == MAGIC:
+                old.seek(_SUPERSEDED)
+                old.write(b"\x01")
+                old.flush()
+        finally:
+            if old is not None:
+                old.close()
+
+    @classmethod
+    def from_config(cls, config_path: str, path: str) -> "MmapKeyStore":
+        """从api_config.json生成二进制存储"""
+        with open(config_path, 'r', encoding='utf-8') as f:
+            keys = json.load(f).get("api_keys", {})
+        cls.write(path, {service: key for service, key in keys.items() if key})
+        return cls(path)
+
+    def _open(self):
+        """映射文件并校验头部"""
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            st = os.fstat(f.fileno())
+        try:
+            slot_count, count = read_header(mm)
+        except ValueError:
+            mm.close()
+            raise ValueError(f"不是有效的密钥存储文件: {self.path}")
+
+        # 整体替换视图；旧映射不主动关闭，正在读取的线程释放引用后自动解除映射
+        self._view = (mm, slot_count, count)
+        self._stat = st
+
+    def _replaced(self) -> bool:
+        """路径上的文件是否已不是当前映射的文件"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (st.st_ino, st.st_mtime_ns) != (self._stat.st_ino, self._stat.st_mtime_ns)
+
+    def refresh(self) -> bool:
+        """文件被替换时重新映射，返回是否发生了切换"""
+        if not self._replaced():
+            return False
+        with self._lock:
+            self._open()
+        return True
+
+    def _current(self):
+        """当前视图；映射的文件已被标记替换时先重新映射"""
+        view = self._view
+        if view[0][_SUPERSEDED]:
+            self.refresh()
+            view = self._view
+        return view
+
+    def __len__(self) -> int:
+        return self._current()[2]
+
+    def get(self, service: str) -> Optional[str]:
+        """获取密钥"""
+        mm, slot_count, _ = self._current()
+        return lookup(mm, slot_count, service)
+
+    def items(self) -> Dict[str, str]:
+        """返回全部密钥"""
+        mm, slot_count, _ = self._current()
+        return dict(iter_table(mm, slot_count))
+
+    @contextmanager
+    def _writing(self):
+        """写操作：持有进程内锁和跨进程文件锁，产出最新版本的全部密钥"""
+        with self._lock, self._file_lock:
+            if self._replaced():
+                self._open()
+            mm, slot_count, _ = self._view
+            yield dict(iter_table(mm, slot_count))
+
+    def _rewrite(self, keys: Dict[str, str]):
+        """重建文件并切换映射（调用方需在_writing中）"""
+        self.write(self.path, keys)
+        self._open()
+
+    def set(self, service: str, key: str) -> None:
+        """设置密钥（重建文件）"""
+        self.set_many({service: key})
+
+    def set_many(self, keys: Dict[str, str]) -> None:
+        """批量设置密钥，只重建一次"""
+        with self._writing() as merged:
+            merged.update(keys)
+            self._rewrite(merged)
+
+    def delete(self, service: str) -> bool:
+        """删除密钥（重建文件）"""
+        with self._writing() as keys:
+            if keys.pop(service, None) is None:
+                return False
+            self._rewrite(keys)
+            return True
+
+    def delete_many(self, services: Iterable[str]) -> int:
+        """批量删除密钥，只重建一次"""
+        with self._writing() as keys:
+            removed = sum(keys.pop(service, None) is not None for service in services)
+            if removed:
+                self._rewrite(keys)
+            return removed
+
+    def close(self) -> None:
+        """解除映射"""
+        with self._lock:
+            if self._view is not None:
+                self._view[0].close()
+                self._view = None
@@ -0,0 +1,169 @@
+"""
+密钥反查索引
+按 hash_key(密钥) 索引其所属的服务和记录，泄露事件中拿到一个密钥字符串时
+无需解密或遍历全部密钥即可O(1)查到归属。
+
+每次变更只向索引文件追加一行（该记录当前全部密钥的摘要，空列表表示删除），
+记录数超过存活记录的两倍时压缩为每条记录一行。文件中只有SHA-256摘要，没有密钥明文。
+
+记录格式（JSON Lines）::
+
+    {"r": "api_keys", "s": "openai", "h": ["<sha256>"]}
+    {"r": "key_pools", "s": "openai", "h": ["<sha256>", "<sha256>"]}
+    {"r": "api_keys", "s": "openai", "h": []}                       删除
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from utils.helpers import hash_key
+
+from .fileio import atomic_write_bytes
+
+# (所在配置节, 服务名)
+Record = Tuple[str, str]
+
+
+class OwnerIndex:
+    """摘要 -> 所属记录 的持久化索引"""
+
+    def __init__(self, path: str, shared: bool = False, compact_min: int = 1000):
+        """
+        shared:
+          多进程共享同一索引文件。调用方在写入时持有跨进程锁；
+          读取前检查文件是否增长（或被压缩替换）并加载其它进程的变更
+        """
+        self.path = path
+        self.shared = shared
+        self.compact_min = compact_min
+        self._lock = threading.Lock()
+        self._file = None
+        self._offset = 0
+        self._ino = None
+        self._lines = 0
+        # 摘要 -> 所属记录列表；记录 -> 其密钥摘要
+        self._owners: Dict[str, List[Record]] = {}
+        self._digests: Dict[Record, Tuple[str, ...]] = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            self._load(truncate=True)
+
+    def _apply(self, record: Record, digests: Iterable[str]):
+        """用记录当前的摘要替换旧摘要，调用方需持有锁"""
+        digests = tuple(dict.fromkeys(digests))
+        for digest in self._digests.pop(record, ()):
+            owners = self._owners.get(digest)
+            if owners is not None:
+                owners = [owner for owner in owners if owner != record]
+                if owners:
+                    self._owners[digest] = owners
+                else:
+                    del self._owners[digest]
+        if digests:
+            self._digests[record] = digests
+            for digest in digests:
+                # 整体替换列表，无锁读取方不会看到修改了一半的列表
+                self._owners[digest] = self._owners.get(digest, []) + [record]
+
+    def _load(self, truncate: bool = False):
+        """从上次读到的位置继续加载记录"""
+        with self._lock:
+            valid = 0
+            with open(self.path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._ino:
+                    # 首次加载，或文件被其它进程压缩替换：从头重建
+                    self._owners, self._digests = {}, {}
+                    self._offset, self._lines, self._ino = 0, 0, st.st_ino
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line.decode('utf-8'))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        break
+                    self._apply((entry["r"], entry["s"]), entry["h"])
+                    valid += len(line)
+                    self._lines += 1
+            if truncate and self._offset + valid < os.path.getsize(self.path):
+                # 截掉崩溃留下的半条记录
+                with open(self.path, 'r+b') as f:
+                    f.truncate(self._offset + valid)
+            self._offset += valid
+
+    def refresh(self):
+        """加载其它进程的变更"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._ino or st.st_size > self._offset:
+            if self._file is not None and st.st_ino != self._ino:
+                with self._lock:
+                    self._file.close()
+                    self._file = None
+            self._load()
+
+    def update(self, changes: Dict[Record, Iterable[str]]):
+        """更新一批记录的密钥（明文只用于计算摘要，空列表表示删除），一次写入"""
+        if not changes:
+            return
+        hashed = {record: [hash_key(key) for key in keys] for record, keys in changes.items()}
+        data = "".join(
+            json.dumps({"r": record[0], "s": record[1], "h": digests},
+                       ensure_ascii=False, separators=(",", ":")) + "\n"
+            for record, digests in hashed.items()
+        ).encode('utf-8')
+
+        if self.shared:
+            self.refresh()
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, 'ab')
+                self._ino = os.fstat(self._file.fileno()).st_ino
+                self.exists = True
+            self._file.write(data)
+            self._file.flush()
+            self._offset += len(data)
+            self._lines += len(hashed)
+            for record, digests in hashed.items():
+                self._apply(record, digests)
+            if self._lines > max(self.compact_min, 2 * len(self._digests)):
+                self._compact()
+
+    def _compact(self):
+        """把当前状态重写为每条记录一行，调用方需持有锁"""
+        data = "".join(
+            json.dumps({"r": record[0], "s": record[1], "h": list(digests)},
+                       ensure_ascii=False, separators=(",", ":")) + "\n"
+            for record, digests in self._digests.items()
+        ).encode('utf-8')
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        atomic_write_bytes(self.path, data, fsync=False)
+        self._ino = os.stat(self.path).st_ino
+        self._offset = len(data)
+        self._lines = len(self._digests)
+
+    def find(self, key: str) -> List[Record]:
+        """密钥所属的全部记录（O(1)）"""
+        return self.find_digest(hash_key(key))
+
+    def find_digest(self, digest: str) -> List[Record]:
+        """按摘要查找所属记录"""
+        if self.shared:
+            self.refresh()
+        return list(self._owners.get(digest, ()))
+
+    def close(self):
+        """关闭索引文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,175 @@
+"""
+哈希分片存储后端
+服务名按哈希分散到N个分片文件，分片在首次访问时加载，
+常驻内存的分片数量由LRU限制，内存与加载时间只随工作集增长。
+
+多个进程可以共用同一目录：常驻分片记录加载时分片文件的身份（inode、mtime、大小），
+文件被其它进程改写后重新加载；写入持有跨进程文件锁（<目录>/lock），
+在磁盘上的最新分片上合并变更。
+"""
+
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from .file_lock import FileLock
+from .fileio import atomic_write_json
+
+MANIFEST = "manifest.json"
+LOCK = "lock"
+
+
+class ShardedKeyStore:
+    """分片JSON存储
+
+    目录结构::
+
+        manifest.json        {"shard_count": N}
+        shard-0000.json      {service: key, ...}
+        ...
+
+    写入只重写目标分片，代价为O(总量/N)。
+    """
+
+    def __init__(self, directory: str = "data/shards", shard_count: int = 64,
+                 max_resident: int = 8):
+        self.directory = directory
+        self.path = directory
+        self.max_resident = max_resident
+        self.loads = 0
+
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(directory, LOCK))
+        # 分片编号 -> (加载时的文件身份, 分片内容)
+        self._shards: "OrderedDict[int, Tuple[Optional[tuple], Dict[str, str]]]" = OrderedDict()
+
+        manifest_path = os.path.join(directory, MANIFEST)
+        with self._file_lock:
+            if os.path.exists(manifest_path):
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    # 已有数据以创建时的分片数为准，否则哈希映射会错位
+                    self.shard_count = json.load(f)["shard_count"]
+            else:
+                self.shard_count = shard_count
+                atomic_write_json(manifest_path, {"shard_count": shard_count}, fsync=False)
+
+    def shard_of(self, service: str) -> int:
+        """服务名所在的分片编号"""
+        return zlib.crc32(service.encode('utf-8')) % self.shard_count
+
+    def _shard_path(self, index: int) -> str:
+        return os.path.join(self.directory, f"shard-{index:04d}.json")
+
+    @staticmethod
+    def _identity(st: os.stat_result) -> tuple:
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _stat_shard(self, index: int) -> Optional[tuple]:
+        """分片文件当前的身份，文件不存在时为None"""
+        try:
+            return self._identity(os.stat(self._shard_path(index)))
+        except FileNotFoundError:
+            return None
+
+    def _read_shard(self, index: int) -> Tuple[Optional[tuple], Dict[str, str]]:
+        """从磁盘读取分片，返回 (文件身份, 分片内容)"""
+        try:
+            with open(self._shard_path(index), 'r', encoding='utf-8') as f:
+                return self._identity(os.fstat(f.fileno())), json.load(f)
+        except FileNotFoundError:
+            return None, {}
+
+    def _shard(self, index: int) -> Dict[str, str]:
+        """获取常驻分片，必要时（未加载或文件已被改写）加载并淘汰最久未用的分片"""
+        cached = self._shards.get(index)
+        if cached is not None and cached[0] == self._stat_shard(index):
+            self._shards.move_to_end(index)
+            return cached[1]
+
+        identity, shard = self._read_shard(index)
+        self.loads += 1
+        self._cache_shard(index, identity, shard)
+        return shard
+
+    def _cache_shard(self, index: int, identity: Optional[tuple], shard: Dict[str, str]):
+        self._shards[index] = (identity, shard)
+        self._shards.move_to_end(index)
+        # 分片每次修改都已落盘，淘汰时无需回写
+        while len(self._shards) > self.max_resident:
+            self._shards.popitem(last=False)
+
+    def _write_shard(self, index: int, shard: Dict[str, str]):
+        """写入分片并更新常驻副本（调用方需持有文件锁）"""
+        atomic_write_json(self._shard_path(index), shard, fsync=False)
+        self._cache_shard(index, self._stat_shard(index), shard)
+
+    @property
+    def resident_shards(self) -> int:
+        """当前常驻内存的分片数"""
+        return len(self._shards)
+
+    def get(self, service: str) -> Optional[str]:
+        """获取密钥"""
+        with self._lock:
+            return self._shard(self.shard_of(service)).get(service)
+
+    def set(self, service: str, key: str) -> None:
+        """设置密钥"""
+        self.set_many({service: key})
+
+    def set_many(self, keys: Dict[str, str]) -> None:
+        """批量设置密钥，每个涉及的分片只写一次"""
+        grouped: Dict[int, Dict[str, str]] = {}
+        for service, key in keys.items():
+            grouped.setdefault(self.shard_of(service), {})[service] = key
+
+        with self._lock, self._file_lock:
+            for index, updates in grouped.items():
+                shard = {**self._shard(index), **updates}
+                self._write_shard(index, shard)
+
+    def delete(self, service: str) -> bool:
+        """删除密钥"""
+        index = self.shard_of(service)
+        with self._lock, self._file_lock:
+            shard = dict(self._shard(index))
+            if shard.pop(service, None) is None:
+                return False
+            self._write_shard(index, shard)
+            return True
+
+    def delete_many(self, services: Iterable[str]) -> int:
+        """批量删除密钥，每个涉及的分片只写一次"""
+        grouped: Dict[int, list] = {}
+        for service in services:
+            grouped.setdefault(self.shard_of(service), []).append(service)
+
+        removed = 0
+        with self._lock, self._file_lock:
+            for index, names in grouped.items():
+                shard = dict(self._shard(index))
+                count = sum(shard.pop(service, None) is not None for service in names)
+                if count:
+                    self._write_shard(index, shard)
+                    removed += count
+        return removed
+
+    def items(self) -> Dict[str, str]:
+        """返回全部密钥（逐个读取分片，不占用LRU）"""
+        result: Dict[str, str] = {}
+        with self._lock:
+            for index in range(self.shard_count):
+                cached = self._shards.get(index)
+                if cached is not None and cached[0] == self._stat_shard(index):
+                    result.update(cached[1])
+                else:
+                    result.update(self._read_shard(index)[1])
+        return result
+
+    def close(self) -> None:
+        """释放常驻分片"""
+        with self._lock:
+            self._shards.clear()
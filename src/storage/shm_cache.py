@@ -0,0 +1,160 @@
+"""
+跨进程共享内存密钥缓存
+密钥表只序列化一次放进共享内存段，各worker零拷贝读取。
+
+布局：
+  控制段 <name>          version(Q)，当前生效的数据段版本号，0表示尚未发布
+  数据段 <name>.<version> 与mmap存储相同的二进制表（头部 + 哈希索引 + 数据区）
+写入方发布新数据段后更新版本号并删除旧数据段；已经映射旧段的读取方不受影响，
+下次读取时发现版本号变化再切换到新段。
+"""
+
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional
+
+from .mmap_store import encode_table, iter_table, lookup, read_header
+
+CONTROL = struct.Struct("<Q")
+
+
+def _open_segment(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    """打开共享内存段，不交给resource_tracker管理
+
+    默认情况下进程退出时resource_tracker会删除它登记过的段，
+    这会让其它worker正在使用的缓存消失，因此段的生命周期由本模块自行管理。
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Python 3.13之前没有track参数
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def _unlink_segment(shm: shared_memory.SharedMemory):
+    """删除共享内存段"""
+    if getattr(shm, "_track", None) is None:
+        # Python 3.13之前unlink()会向resource_tracker注销，先补登记避免其报错
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+class SharedKeyCache:
+    """共享内存密钥缓存"""
+
+    def __init__(self, name: str = "api_key_manager"):
+        self.name = name
+        self._lock = threading.Lock()
+        try:
+            self._control = _open_segment(name, create=True, size=CONTROL.size)
+            CONTROL.pack_into(self._control.buf, 0, 0)
+        except FileExistsError:
+            self._control = _open_segment(name)
+        # (版本号, 数据段, 槽位数)
+        self._view = (0, None, 0)
+
+    @property
+    def version(self) -> int:
+        """共享控制段中的当前版本号"""
+        return CONTROL.unpack_from(self._control.buf, 0)[0]
+
+    def _current(self):
+        """返回与共享版本号一致的本地视图，必要时切换到新数据段"""
+        view = self._view
+        version = self.version
+        if version == view[0]:
+            return view
+
+        with self._lock:
+            while True:
+                view = self._view
+                version = self.version
+                if version == view[0]:
+                    return view
+                if version == 0:
+                    return view
+                try:
+                    segment = _open_segment(f"{self.name}.{version}")
+                except FileNotFoundError:
+                    # 读取版本号之后写入方又发布了新版本并删除了这一段
+                    continue
+                slot_count, _ = read_header(segment.buf)
+                # 旧段的映射交给垃圾回收，正在读取的线程仍持有引用
+                self._view = (version, segment, slot_count)
+                return self._view
+
+    def published(self) -> bool:
+        """是否已有进程发布过密钥表"""
+        return self.version != 0
+
+    def get(self, service: str) -> Optional[str]:
+        """读取密钥"""
+        _, segment, slot_count = self._current()
+        if segment is None:
+            return None
+        return lookup(segment.buf, slot_count, service)
+
+    def items(self) -> Dict[str, str]:
+        """读取全部密钥"""
+        _, segment, slot_count = self._current()
+        if segment is None:
+            return {}
+        return dict(iter_table(segment.buf, slot_count))
+
+    def publish(self, keys: Dict[str, str]) -> int:
+        """发布新的密钥表并返回新版本号
+
+        多个进程同时发布时由调用方持有跨进程锁串行化；
+        即使没有锁，段名冲突时也会顺延版本号，不会互相覆盖。
+        """
+        image = encode_table(keys)
+        with self._lock:
+            old_version = self.version
+            version = old_version + 1
+            while True:
+                try:
+                    segment = _open_segment(f"{self.name}.{version}", create=True,
+                                            size=len(image))
+                    break
+                except FileExistsError:
+                    version += 1
+            segment.buf[:len(image)] = image
+            CONTROL.pack_into(self._control.buf, 0, version)
+            self._view = (version, segment, read_header(segment.buf)[0])
+
+        if old_version:
+            try:
+                stale = _open_segment(f"{self.name}.{old_version}")
+            except FileNotFoundError:
+                return version
+            stale.close()
+            _unlink_segment(stale)
+        return version
+
+    def close(self):
+        """解除本进程的映射（不删除共享段）"""
+        with self._lock:
+            segment = self._view[1]
+            self._view = (0, None, 0)
+            if segment is not None:
+                try:
+                    segment.close()
+                except BufferError:
+                    # 仍有memoryview引用时交给垃圾回收
+                    pass
+            self._control.close()
+
+    def unlink(self):
+        """删除控制段和当前数据段（部署下线时调用）"""
+        version = self.version
+        if version:
+            try:
+                segment = _open_segment(f"{self.name}.{version}")
+                segment.close()
+                _unlink_segment(segment)
+            except FileNotFoundError:
+                pass
+        _unlink_segment(self._control)
@@ -0,0 +1,85 @@
+"""
+SQLite存储后端
+表结构与simple_web_interface和Vercel入口使用的api_keys表一致
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+
+class SQLiteKeyStore:
+    """SQLite存储，复用单个连接并启用WAL"""
+
+    def __init__(self, path: str = "data/keys.db"):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_keys (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                service TEXT UNIQUE NOT NULL,
+                key TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self._conn.commit()
+
+    _UPSERT = '''
+        INSERT INTO api_keys (service, key, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(service) DO UPDATE SET key = excluded.key, updated_at = excluded.updated_at
+    '''
+
+    def get(self, service: str) -> Optional[str]:
+        """获取密钥"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT key FROM api_keys WHERE service = ?', (service,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, service: str, key: str) -> None:
+        """设置密钥"""
+        with self._lock, self._conn:
+            self._conn.execute(self._UPSERT, (service, key, datetime.now()))
+
+    def set_many(self, keys: Dict[str, str]) -> None:
+        """批量设置密钥，单个事务提交"""
+        now = datetime.now()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                self._UPSERT, [(service, key, now) for service, key in keys.items()]
+            )
+
+    def delete(self, service: str) -> bool:
+        """删除密钥"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute('DELETE FROM api_keys WHERE service = ?', (service,))
+        return cursor.rowcount > 0
+
+    def delete_many(self, services: Iterable[str]) -> int:
+        """批量删除密钥，单个事务提交"""
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                'DELETE FROM api_keys WHERE service = ?', [(service,) for service in services]
+            )
+        return cursor.rowcount
+
+    def items(self) -> Dict[str, str]:
+        """返回全部密钥"""
+        with self._lock:
+            rows = self._conn.execute('SELECT service, key FROM api_keys').fetchall()
+        return {service: key for service, key in rows}
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
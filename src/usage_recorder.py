@@ -0,0 +1,195 @@
+"""
+密钥用量统计
+每个密钥在三种粒度上各有一个定长环形缓冲区，记录最近一分钟/一小时/一天的请求数和token数：
+
+  minute  60个1秒的桶
+  hour    60个1分钟的桶
+  day     24个1小时的桶
+
+计数为O(1)：按时间算出桶位置，桶里的时间戳过期时先清零再累加；
+窗口求和为O(桶数)。统计数据由后台线程定期写入文件，重启后继续累计。
+"""
+
+import hashlib
+import json
+import threading
+import time
+from array import array
+from typing import Any, Dict, Optional
+
+from storage.fileio import atomic_write_json
+
+# (名称, 桶宽度秒, 桶数)
+RESOLUTIONS = (("minute", 1, 60), ("hour", 60, 60), ("day", 3600, 24))
+
+
+def key_id(key: Optional[str]) -> str:
+    """密钥的统计标识，文件和接口中不出现密钥明文"""
+    if key is None:
+        return "default"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:12]
+
+
+class _Ring:
+    """单一粒度的环形缓冲区（预分配数组）"""
+
+    __slots__ = ("width", "size", "stamps", "requests", "tokens")
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.size = size
+        self.stamps = array('q', [-1] * size)
+        self.requests = array('q', [0] * size)
+        self.tokens = array('q', [0] * size)
+
+    def add(self, now: float, requests: int, tokens: int):
+        index = int(now // self.width)
+        slot = index % self.size
+        if self.stamps[slot] != index:
+            self.stamps[slot] = index
+            self.requests[slot] = 0
+            self.tokens[slot] = 0
+        self.requests[slot] += requests
+        self.tokens[slot] += tokens
+
+    def total(self, now: float):
+        """返回窗口内的 (请求数, token数)"""
+        oldest = int(now // self.width) - self.size
+        requests = tokens = 0
+        for slot in range(self.size):
+            if self.stamps[slot] > oldest:
+                requests += self.requests[slot]
+                tokens += self.tokens[slot]
+        return requests, tokens
+
+    def dump(self) -> Dict[str, list]:
+        return {"stamps": self.stamps.tolist(), "requests": self.requests.tolist(),
+                "tokens": self.tokens.tolist()}
+
+    def restore(self, data: Dict[str, list]):
+        if len(data.get("stamps", ())) != self.size:
+            return
+        self.stamps = array('q', data["stamps"])
+        self.requests = array('q', data["requests"])
+        self.tokens = array('q', data["tokens"])
+
+
+class _KeyUsage:
+    """单个密钥的三种粒度计数"""
+
+    __slots__ = ("lock", "rings")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rings = tuple(_Ring(width, size) for _, width, size in RESOLUTIONS)
+
+
+class UsageRecorder:
+    """按服务和密钥的用量统计
+
+    path为None时只在内存中统计；否则每隔persist_interval秒在后台写入一次（有变化时）。
+    """
+
+    def __init__(self, path: Optional[str] = None, persist_interval: float = 60.0,
+                 clock=time.time):
+        self.path = path
+        self.persist_interval = persist_interval
+        self.clock = clock
+        # 服务名 -> {密钥标识: _KeyUsage}
+        self._usage: Dict[str, Dict[str, _KeyUsage]] = {}
+        self._create_lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        if path is not None:
+            self._load()
+            self._thread = threading.Thread(target=self._run, name="usage-persist", daemon=True)
+            self._thread.start()
+
+    def _counter(self, service: str, kid: str) -> _KeyUsage:
+        keys = self._usage.get(service)
+        if keys is not None:
+            usage = keys.get(kid)
+            if usage is not None:
+                return usage
+        with self._create_lock:
+            keys = self._usage.setdefault(service, {})
+            usage = keys.get(kid)
+            if usage is None:
+                usage = keys[kid] = _KeyUsage()
+            return usage
+
+    def record(self, service: str, key: Optional[str] = None, requests: int = 1, tokens: int = 0):
+        """记录一次使用"""
+        usage = self._counter(service, key_id(key))
+        now = self.clock()
+        with usage.lock:
+            for ring in usage.rings:
+                ring.add(now, requests, tokens)
+        self._dirty = True
+
+    def usage(self, service: str) -> Dict[str, Any]:
+        """服务在最近一分钟/一小时/一天的用量，含按密钥的明细"""
+        now = self.clock()
+        totals = {name: {"requests": 0, "tokens": 0} for name, _, _ in RESOLUTIONS}
+        per_key = {}
+        for kid, usage in list(self._usage.get(service, {}).items()):
+            detail = {}
+            with usage.lock:
+                for (name, _, _), ring in zip(RESOLUTIONS, usage.rings):
+                    requests, tokens = ring.total(now)
+                    detail[name] = {"requests": requests, "tokens": tokens}
+                    totals[name]["requests"] += requests
+                    totals[name]["tokens"] += tokens
+            per_key[kid] = detail
+        return {"service": service, **totals, "keys": per_key}
+
+    def _dump(self) -> Dict[str, Any]:
+        data = {}
+        for service, keys in list(self._usage.items()):
+            data[service] = {}
+            for kid, usage in list(keys.items()):
+                with usage.lock:
+                    data[service][kid] = {
+                        name: ring.dump() for (name, _, _), ring in zip(RESOLUTIONS, usage.rings)
+                    }
+        return data
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        for service, keys in data.items():
+            for kid, rings in keys.items():
+                usage = self._counter(service, kid)
+                for (name, _, _), ring in zip(RESOLUTIONS, usage.rings):
+                    if name in rings:
+                        ring.restore(rings[name])
+
+    def save(self):
+        """立即写入统计文件"""
+        if self.path is None:
+            return
+        self._dirty = False
+        atomic_write_json(self.path, self._dump(), fsync=False)
+
+    def _run(self):
+        while not self._stop.wait(self.persist_interval):
+            if self._dirty:
+                try:
+                    self.save()
+                except OSError:
+                    # 写入失败下个周期重试
+                    self._dirty = True
+
+    def close(self):
+        """停止后台线程并写入最后一次统计"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            if self._dirty:
+                self.save()
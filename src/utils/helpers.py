@@ -5,10 +5,13 @@
 
 import os
 import json
+import base64
+import binascii
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from cryptography.fernet import Fernet
+from functools import lru_cache
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Union
+from cryptography.fernet import Fernet, InvalidToken
 import hashlib
 
 def setup_logging(log_file: str = "logs/api_manager.log", level: str = "INFO"):
@@ -45,15 +48,161 @@ def generate_key() -> str:
     """生成加密密钥"""
     return Fernet.generate_key().decode()
 
-def encrypt_data(data: str, key: str) -> str:
+# 密文信封: enc:v1:<盐(base64)>:<Fernet令牌>，用Fernet密钥加密时盐为空。
+# 是否为密文看这个前缀；信封格式之前encrypt_data写入的裸Fernet令牌按令牌结构识别
+_ENVELOPE = "enc:v1:"
+# Fernet令牌: 版本(0x80) + 时间戳(8) + IV(16) + 密文(16的倍数) + HMAC(32)
+_FERNET_OVERHEAD = 57
+# 口令派生Fernet密钥的PBKDF2-HMAC-SHA256迭代次数
+KDF_ITERATIONS = 480000
+_SALT_SIZE = 16
+
+def generate_salt() -> str:
+    """生成口令派生用的盐（base64文本，可直接保存在配置中）"""
+    return base64.urlsafe_b64encode(os.urandom(_SALT_SIZE)).decode()
+
+@lru_cache(maxsize=64)
+def _derive(passphrase: str, salt: bytes) -> Fernet:
+    """由口令和盐派生Fernet密钥（按 (口令, 盐) 缓存，PBKDF2每次需要数百毫秒）"""
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KDF_ITERATIONS)
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(passphrase.encode())))
+
+def _open_envelope(token: bytes) -> Tuple[bytes, bytes]:
+    """拆开密文信封，返回 (盐, Fernet令牌)"""
+    prefix = _ENVELOPE.encode()
+    if not token.startswith(prefix):
+        raise InvalidToken
+    salt, sep, body = token[len(prefix):].partition(b":")
+    if not sep:
+        raise InvalidToken
+    try:
+        return base64.urlsafe_b64decode(salt), body
+    except (ValueError, binascii.Error):
+        raise InvalidToken from None
+
+def _is_fernet_token(value: str) -> bool:
+    """值是否为裸Fernet令牌（只检查结构，不校验HMAC）"""
+    if not value.startswith("gAAAAA"):
+        return False
+    try:
+        raw = base64.urlsafe_b64decode(value.encode())
+    except (ValueError, binascii.Error):
+        return False
+    size = len(raw) - _FERNET_OVERHEAD
+    return raw[0] == 0x80 and size >= 16 and size % 16 == 0
+
+class Cipher:
+    """单个密钥的加密器，输出密文信封
+
+    key是Fernet密钥（generate_key生成）时直接使用；否则视为口令，经PBKDF2加盐派生
+    Fernet密钥，盐写在每个密文的信封中。salt是加密使用的盐，应为整个存储共用的一个
+    （APIKeyManager保存在security.kdf_salt），这样所有进程、所有重启只需派生一次；
+    不指定时在第一次加密时随机生成。解密按信封中的盐派生（并缓存）对应的密钥。
+    """
+
+    def __init__(self, key: str, salt: Optional[str] = None):
+        self._passphrase: Optional[str] = None
+        self._salt: Optional[bytes] = None
+        self._fernet: Optional[Fernet] = None
+        try:
+            fernet_key = len(base64.urlsafe_b64decode(key.encode())) == 32
+        except (ValueError, binascii.Error):
+            fernet_key = False
+        if fernet_key:
+            self._salt = b""
+            self._fernet = Fernet(key.encode())
+        else:
+            self._passphrase = key
+            if salt is not None:
+                self._salt = base64.urlsafe_b64decode(salt.encode())
+
+    def _encryptor(self) -> Tuple[bytes, Fernet]:
+        """加密用的 (信封前缀, Fernet)，口令首次加密时才派生"""
+        if self._fernet is None:
+            if self._salt is None:
+                self._salt = os.urandom(_SALT_SIZE)
+            self._fernet = _derive(self._passphrase, self._salt)
+        salt = base64.urlsafe_b64encode(self._salt).decode()
+        return f"{_ENVELOPE}{salt}:".encode(), self._fernet
+
+    def encrypt(self, data: bytes) -> bytes:
+        prefix, fernet = self._encryptor()
+        return prefix + fernet.encrypt(data)
+
+    def decrypt(self, token: bytes) -> bytes:
+        if not token.startswith(_ENVELOPE.encode()):
+            # 信封格式之前写入的裸Fernet令牌，只能是Fernet密钥加密的
+            if self._passphrase is None and _is_fernet_token(token.decode('ascii', 'replace')):
+                return self._fernet.decrypt(token)
+            raise InvalidToken
+        salt, body = _open_envelope(token)
+        if self._passphrase is None:
+            if salt:
+                # Fernet密钥和口令加密的密文互相不能解密
+                raise InvalidToken
+            return self._fernet.decrypt(body)
+        if not salt:
+            raise InvalidToken
+        return _derive(self._passphrase, salt).decrypt(body)
+
+class MultiCipher:
+    """多个密钥的加密器：用第一个加密，任意一个都可以解密（用于更换密钥期间）"""
+
+    def __init__(self, ciphers: List[Cipher]):
+        self._ciphers = ciphers
+
+    def encrypt(self, data: bytes) -> bytes:
+        return self._ciphers[0].encrypt(data)
+
+    def decrypt(self, token: bytes) -> bytes:
+        for cipher in self._ciphers:
+            try:
+                return cipher.decrypt(token)
+            except InvalidToken:
+                continue
+        raise InvalidToken
+
+    def rotate(self, token: bytes) -> bytes:
+        """解密后用第一个密钥重新加密"""
+        return self.encrypt(self.decrypt(token))
+
+Key = Union[str, Tuple[str, ...]]
+
+@lru_cache(maxsize=16)
+def get_cipher(key: Key, salt: Optional[str] = None) -> Union[Cipher, MultiCipher]:
+    """获取加密器（按 (密钥, 盐) 缓存，避免每次加解密都重新构造）
+
+    key可以是Fernet密钥（generate_key生成），也可以是任意口令（加盐经PBKDF2派生，
+    salt见Cipher）。key为元组时返回MultiCipher：用第一个密钥加密，任意一个密钥都可以解密。
+    """
+    if isinstance(key, tuple):
+        return MultiCipher([get_cipher(k, salt) for k in key])
+    return Cipher(key, salt)
+
+def is_encrypted(value: str) -> bool:
+    """值是否为密文信封或旧的裸Fernet令牌（用于兼容加密前写入的明文）"""
+    return isinstance(value, str) and (value.startswith(_ENVELOPE) or _is_fernet_token(value))
+
+def encrypt_data(data: str, key: str, salt: Optional[str] = None) -> str:
     """加密数据"""
-    f = Fernet(key.encode())
-    return f.encrypt(data.encode()).decode()
+    return get_cipher(key, salt).encrypt(data.encode()).decode()
 
 def decrypt_data(encrypted_data: str, key: str) -> str:
     """解密数据"""
-    f = Fernet(key.encode())
-    return f.decrypt(encrypted_data.encode()).decode()
+    return get_cipher(key).decrypt(encrypted_data.encode()).decode()
+
+def encrypt_many(values: Iterable[str], key: Key, salt: Optional[str] = None) -> List[str]:
+    """批量加密，共用同一个加密器"""
+    encrypt = get_cipher(key, salt).encrypt
+    return [encrypt(value.encode()).decode() for value in values]
+
+def decrypt_many(values: Iterable[str], key: Key) -> List[str]:
+    """批量解密，共用同一个加密器；不是密文的值（加密前写入的明文）原样返回"""
+    decrypt = get_cipher(key).decrypt
+    return [decrypt(value.encode()).decode() if is_encrypted(value) else value
+            for value in values]
 
 def hash_key(key: str) -> str:
     """哈希API密钥"""
@@ -4,19 +4,21 @@ Web界面模块
 """
 
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from typing import Dict, List, Optional
 import uvicorn
+import json
 import os
 import sys
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from api_key_manager import APIKeyManager
+from api_key_manager import AsyncAPIKeyManager
+from storage import create_key_store
 
 app = FastAPI(title="API密钥管理器", version="1.0.0")
 
@@ -25,7 +27,37 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 # 初始化管理器
-manager = APIKeyManager()
+# GROUP_COMMIT_WINDOW_MS > 0 时启用组提交，突发写入合并为一次原子落盘
+# KEY_STORE_BACKEND 可选 json / sqlite / mmap / sharded / memory，KEY_STORE_PATH 指定存储位置
+# MULTIPROCESS=true 时多个worker通过文件锁共享同一配置文件
+# SHARED_CACHE_NAME 设置后各worker从同一共享内存段读取密钥表
+# IO_WORKERS 为磁盘I/O线程池大小，路由中的读写都不会阻塞事件循环
+# KEY_HISTORY=true 时记录密钥版本历史，支持时间点查询和回滚
+# USAGE_PATH 设置后用量统计定期写入该文件
+# RATE_LIMIT_REDIS_URL 设置后多个副本通过Redis共享限流状态（如 redis://redis:6379/0）
+# BREAKER_PATH 熔断器状态文件，多worker时默认与配置文件同目录
+# KEY_ENCRYPTION_KEY 设置后密钥以密文保存（配合security.encrypt_keys），读取时才解密
+# KEY_OWNER_INDEX=true 时维护密钥反查索引，可按密钥值查出所属服务
+# KEY_ROTATION=true 时按security.rotation_days跟踪密钥年龄，到期时在日志中提醒（不能与MULTIPROCESS同时启用）
+_group_commit_ms = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+_key_store_backend = os.getenv("KEY_STORE_BACKEND")
+manager = AsyncAPIKeyManager(
+    io_workers=int(os.getenv("IO_WORKERS", "4")),
+    group_commit_window=_group_commit_ms / 1000 if _group_commit_ms > 0 else None,
+    key_store=create_key_store(_key_store_backend, os.getenv("KEY_STORE_PATH"))
+    if _key_store_backend else None,
+    multiprocess=os.getenv("MULTIPROCESS") == "true",
+    shared_cache=os.getenv("SHARED_CACHE_NAME"),
+    history=os.getenv("KEY_HISTORY") == "true",
+    usage_path=os.getenv("USAGE_PATH"),
+    rate_limit_url=os.getenv("RATE_LIMIT_REDIS_URL"),
+    breaker_path=os.getenv("BREAKER_PATH"),
+    rotation=os.getenv("KEY_ROTATION") == "true",
+    encryption_key=os.getenv("KEY_ENCRYPTION_KEY"),
+    owner_index=os.getenv("KEY_OWNER_INDEX") == "true"
+)
+if os.getenv("KEY_ROTATION") == "true":
+    manager.on_rotation_due(lambda service, due_at: print(f"⚠️ {service} API密钥已到轮换期限，请及时更换"))
 
 # Pydantic模型
 class APIKeyRequest(BaseModel):
@@ -42,6 +74,20 @@ class ServiceResponse(BaseModel):
     status: str
     message: str
 
+class APIKeyBatchRequest(BaseModel):
+    keys: Dict[str, str]
+
+class ServiceBatchRequest(BaseModel):
+    services: List[str]
+
+class BatchResponse(BaseModel):
+    services: List[str]
+    status: str
+    message: str
+
+class KeyLookupRequest(BaseModel):
+    key: str
+
 # 路由
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -56,12 +102,22 @@ async def health_check():
 @app.get("/api/keys", response_model=Dict[str, str])
 async def get_all_keys():
     """获取所有API密钥"""
-    return manager.list_all_keys()
+    return await manager.alist()
+
+# 直接调用同步管理器方法（读文件、构建记录、解密）的路由用普通def，
+# 由FastAPI放到线程池执行，不阻塞事件循环
+@app.get("/api/keys/expiring")
+def get_expiring_keys(days: float = 7):
+    """获取未来days天内（含已过期）需要轮换的密钥"""
+    try:
+        return manager.get_expiring_keys(days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/keys/{service}", response_model=APIKeyResponse)
 async def get_key(service: str):
     """获取特定服务的API密钥"""
-    key = manager.get_api_key(service)
+    key = await manager.aget(service)
     if not key:
         raise HTTPException(status_code=404, detail=f"{service} API密钥未找到")
     
@@ -75,7 +131,7 @@ async def get_key(service: str):
 async def set_key(request: APIKeyRequest):
     """设置API密钥"""
     try:
-        manager.set_api_key(request.service, request.key)
+        await manager.aset(request.service, request.key)
         return ServiceResponse(
             service=request.service,
             status="success",
@@ -84,11 +140,52 @@ async def set_key(request: APIKeyRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/keys/owner")
+def find_key_owner(request: KeyLookupRequest):
+    """按密钥值查找所属服务（密钥放在请求体中，不出现在URL和访问日志里）"""
+    try:
+        owners = manager.find_owner(request.key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not owners:
+        raise HTTPException(status_code=404, detail="未找到该密钥的归属")
+    return {"owners": owners}
+
+@app.post("/api/keys:batch", response_model=BatchResponse)
+async def set_keys_batch(request: APIKeyBatchRequest):
+    """批量设置API密钥（全部校验通过后一次写入）"""
+    try:
+        await manager.aset_many(request.keys)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return BatchResponse(
+        services=list(request.keys),
+        status="success",
+        message=f"已设置 {len(request.keys)} 个API密钥"
+    )
+
+@app.delete("/api/keys:batch", response_model=BatchResponse)
+async def delete_keys_batch(request: ServiceBatchRequest):
+    """批量删除API密钥"""
+    try:
+        await manager.aremove_many(request.services)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return BatchResponse(
+        services=request.services,
+        status="success",
+        message=f"已删除 {len(request.services)} 个API密钥"
+    )
+
 @app.put("/api/keys/{service}", response_model=ServiceResponse)
 async def update_key(service: str, request: APIKeyRequest):
     """更新API密钥"""
     try:
-        manager.update_api_key(service, request.key)
+        await manager.aupdate(service, request.key)
         return ServiceResponse(
             service=service,
             status="success",
@@ -101,7 +198,7 @@ async def update_key(service: str, request: APIKeyRequest):
 async def delete_key(service: str):
     """删除API密钥"""
     try:
-        manager.remove_api_key(service)
+        await manager.aremove(service)
         return ServiceResponse(
             service=service,
             status="success",
@@ -110,11 +207,22 @@ async def delete_key(service: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/keys/test-all")
+async def test_all_keys(refresh: bool = False):
+    """并发检查所有密钥，每完成一个就以一行JSON推送结果（NDJSON）
+
+    refresh为true时忽略缓存重新探测。
+    """
+    async def stream():
+        async for result in manager.atest_all(use_cache=not refresh):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/api/keys/{service}/test", response_model=ServiceResponse)
 async def test_key(service: str):
     """测试API密钥"""
     try:
-        success = manager.test_api_key(service)
+        success = await manager.atest(service)
         if success:
             return ServiceResponse(
                 service=service,
@@ -130,6 +238,16 @@ async def test_key(service: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/keys/{service}/usage")
+def get_key_usage(service: str):
+    """获取服务最近一分钟/一小时/一天的用量（按密钥标识分别统计，不返回密钥明文）"""
+    return manager.get_usage(service)
+
+@app.get("/api/metrics/secret-cache")
+async def get_secret_cache_metrics():
+    """获取解密缓存的命中率等指标（未启用加密时为null）"""
+    return {"secret_cache": manager.secret_cache_stats()}
+
 @app.get("/api/config/template")
 async def get_config_template():
     """获取配置模板"""
@@ -160,9 +278,14 @@ def main():
     parser.add_argument("--host", default="127.0.0.1", help="主机地址")
     parser.add_argument("--port", type=int, default=8080, help="端口号")
     parser.add_argument("--dev", action="store_true", help="开发模式")
+    parser.add_argument("--workers", type=int, default=1, help="worker进程数")
     
     args = parser.parse_args()
     
+    if args.workers > 1:
+        # worker进程重新导入本模块时据此启用跨进程同步
+        os.environ["MULTIPROCESS"] = "true"
+    
     print(f"🚀 启动API密钥管理器Web界面")
     print(f"📍 地址: http://{args.host}:{args.port}")
     print(f"📖 API文档: http://{args.host}:{args.port}/docs")
@@ -172,6 +295,7 @@ def main():
         host=args.host,
         port=args.port,
         reload=args.dev,
+        workers=args.workers,
         log_level="info"
     )
 
@@ -5,14 +5,18 @@ API密钥管理工具测试套件
 import pytest
 import json
 import tempfile
+import threading
+import asyncio
+import time
 import os
+from datetime import datetime
 from unittest.mock import Mock, patch, MagicMock
 import sys
 
 # 添加src目录到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from api_key_manager import APIKeyManager
+from api_key_manager import APIKeyManager, AsyncAPIKeyManager
 from utils.helpers import (
     setup_logging, 
     load_config, 
@@ -75,9 +79,104 @@ class TestAPIKeyManager:
         key = "env_api_key_12345"
         
         with patch.dict(os.environ, {f"{service.upper()}_API_KEY": key}):
+            # 环境变量索引只在启动时构建，运行中修改的环境变量需要显式刷新
+            self.manager.refresh_env()
             retrieved_key = self.manager.get_api_key(service)
             assert retrieved_key == key
     
+    def test_set_and_remove_api_keys(self):
+        """测试批量设置和删除只持久化一次"""
+        keys = {f"bulk_service{i}": f"bulk-key-{i}" for i in range(100)}
+        
+        with patch.dict(os.environ):
+            with patch.object(self.manager, 'save_config', wraps=self.manager.save_config) as save:
+                self.manager.set_api_keys(keys)
+                assert save.call_count == 1
+            
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                assert json.load(f)["api_keys"] == keys
+            assert self.manager.get_api_key("bulk_service42") == "bulk-key-42"
+            
+            with patch.object(self.manager, 'save_config', wraps=self.manager.save_config) as save:
+                self.manager.remove_api_keys([f"bulk_service{i}" for i in range(50)])
+                assert save.call_count == 1
+            assert set(APIKeyManager(self.config_path).config["api_keys"]) == set(list(keys)[50:])
+            assert "BULK_SERVICE0_API_KEY" not in os.environ
+    
+    def test_set_api_keys_validates_up_front(self):
+        """测试批量设置中任何一条无效时不写入任何密钥"""
+        with pytest.raises(ValueError):
+            self.manager.set_api_keys({"bulk_valid": "bulk-key-1", "bulk_invalid": ""})
+        assert self.manager.get_api_key("bulk_valid") is None
+    
+    def test_transaction_commits_once(self):
+        """测试事务内的变更在提交时一次写入"""
+        with patch.dict(os.environ):
+            self.manager.set_api_key("txn_old", "txn-old-key")
+            with patch.object(self.manager, 'save_config', wraps=self.manager.save_config) as save:
+                with self.manager.transaction() as txn:
+                    self.manager.set_api_key("txn_a", "txn-key-a")
+                    txn.set("txn_b", "txn-key-b")
+                    self.manager.remove_api_key("txn_old")
+                    # 提交前其它读取方看不到暂存的变更
+                    assert self.manager.config["api_keys"].get("txn_a") is None
+                    assert txn.get("txn_a") == "txn-key-a"
+                    assert txn.get("txn_old") is None
+                    assert save.call_count == 0
+                assert save.call_count == 1
+            
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                assert json.load(f)["api_keys"] == {"txn_a": "txn-key-a", "txn_b": "txn-key-b"}
+            assert os.environ["TXN_A_API_KEY"] == "txn-key-a"
+    
+    def test_transaction_rollback(self):
+        """测试事务内抛出异常时不应用任何变更"""
+        with patch.dict(os.environ):
+            self.manager.set_api_key("txn_keep", "txn-keep-key")
+            before = self.manager.config
+            
+            with pytest.raises(RuntimeError):
+                with self.manager.transaction():
+                    self.manager.set_api_key("txn_new", "txn-new-key")
+                    self.manager.remove_api_key("txn_keep")
+                    raise RuntimeError("中途失败")
+            
+            assert self.manager.config is before
+            assert "TXN_NEW_API_KEY" not in os.environ
+            assert APIKeyManager(self.config_path).config["api_keys"] == {"txn_keep": "txn-keep-key"}
+    
+    def test_transaction_restores_state_when_write_fails(self):
+        """测试提交时写入失败会恢复内存状态"""
+        before = self.manager.config
+        with patch.object(self.manager, 'save_config', side_effect=OSError("磁盘已满")):
+            with pytest.raises(OSError):
+                with self.manager.transaction():
+                    self.manager.set_api_key("txn_fail", "txn-fail-key")
+        assert self.manager.config is before
+        assert self.manager.get_api_key("txn_fail") is None
+    
+    def test_env_index_invalidate(self):
+        """测试按服务失效环境变量索引"""
+        service = "env_index_service"
+        env_key = f"{service.upper()}_API_KEY"
+        
+        with patch.dict(os.environ, {env_key: "env_index_value_1"}):
+            self.manager.invalidate_env(service)
+            assert self.manager.get_api_key(service) == "env_index_value_1"
+            assert self.manager.get_api_key(service.upper()) == "env_index_value_1"
+            
+            del os.environ[env_key]
+            self.manager.invalidate_env(service)
+            assert self.manager.get_api_key(service) is None
+            
+            # set/remove同步维护索引，无需刷新
+            self.manager.set_api_key(service, "env_index_value_2", save_to_file=False)
+            assert os.environ[env_key] == "env_index_value_2"
+            assert self.manager.list_all_keys()[service] == "env_index_..."
+            self.manager.remove_api_key(service)
+            assert env_key not in os.environ
+            assert self.manager.get_api_key(service) is None
+    
     def test_update_api_key(self):
         """测试更新API密钥"""
         service = "test_service"
@@ -142,6 +241,967 @@ class TestAPIKeyManager:
         assert "endpoints" in template
         assert "rates" in template
 
+class TestKeyRecords:
+    """测试KeyRecord记录表"""
+    
+    def test_records_join_sections(self, tmp_path):
+        """测试记录合并密钥、端点、速率和元数据"""
+        from key_records import KeyRecord
+        
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({
+            "api_keys": {"openai": "sk-record-123456"},
+            "endpoints": {"openai": "https://api.openai.com/v1", "anthropic": "https://api.anthropic.com"},
+            "rates": {"openai": {"rpm": 60, "tpm": 90000, "burst": 5}},
+            "metadata": {"openai": {"owner": "team-a", "created_at": 1700000000}}
+        }))
+        manager = APIKeyManager(str(config_path))
+        
+        record = manager.get_record("openai")
+        assert isinstance(record, KeyRecord)
+        assert not hasattr(record, "__dict__")
+        assert (record.key, record.endpoint, record.rpm, record.tpm) == (
+            "sk-record-123456", "https://api.openai.com/v1", 60, 90000)
+        assert record.rates == {"rpm": 60, "tpm": 90000, "burst": 5}
+        assert record.created_at == 1700000000
+        assert record.metadata["owner"] == "team-a"
+        assert manager.get_record("anthropic").key is None
+        assert manager.get_record("missing") is None
+    
+    def test_records_rebuilt_incrementally(self, tmp_path):
+        """测试写入后只为变更的服务创建新记录"""
+        manager = APIKeyManager(str(tmp_path / "config.json"))
+        with patch.dict(os.environ):
+            manager.set_api_keys({"record_a": "record-key-a", "record_b": "record-key-b"})
+            before = manager.records()
+            manager.set_api_key("record_a", "record-key-a2")
+            after = manager.records()
+        
+        assert after["record_b"] is before["record_b"]
+        assert after["record_a"].key == "record-key-a2"
+        assert before["record_a"].key == "record-key-a"
+
+    def test_records_built_lazily_and_patched_per_write(self, tmp_path):
+        """测试加载时不构建记录表，构建后的写入只更新变更的服务"""
+        import key_records
+        manager = APIKeyManager(str(tmp_path / "config.json"))
+        assert manager._records == (None, None)
+        with patch.dict(os.environ):
+            manager.set_api_keys({"lazy_a": "lazy-key-a", "lazy_b": "lazy-key-b"})
+            manager.records()
+            with patch('key_records.build_records', wraps=key_records.build_records) as build:
+                manager.set_api_key("lazy_a", "lazy-key-a2")
+                manager.remove_api_key("lazy_b")
+                records = manager.records()
+            assert build.call_count == 0
+        assert records["lazy_a"].key == "lazy-key-a2"
+        assert "lazy_b" not in records
+
+class TestKeyPool:
+    """测试密钥池"""
+    
+    def test_round_robin(self):
+        """测试轮询选取"""
+        from key_pool import KeyPool
+        pool = KeyPool(["k1", "k2", "k3"])
+        assert [pool.select() for _ in range(6)] == ["k1", "k2", "k3", "k1", "k2", "k3"]
+    
+    def test_lru(self):
+        """测试选取最久未使用的密钥"""
+        from key_pool import KeyPool
+        pool = KeyPool(["k1", "k2", "k3"], strategy="lru")
+        assert pool.select() == "k1"
+        pool.touch("k2")
+        assert pool.select() == "k3"
+        assert pool.select() == "k1"
+    
+    def test_weighted_by_remaining_quota(self):
+        """测试按剩余配额加权，配额用完的密钥不再被选中"""
+        from key_pool import KeyPool
+        pool = KeyPool(["k1", "k2", "k3"], strategy="weighted", quotas=[100, 300, 0])
+        picks = [pool.select() for _ in range(2000)]
+        assert "k3" not in picks
+        assert picks.count("k2") > picks.count("k1")
+        
+        pool.record_usage("k2", 300)
+        assert pool.remaining("k2") == 0
+        assert {pool.select() for _ in range(200)} == {"k1"}
+        pool.reset_quotas()
+        assert pool.remaining("k2") == 300
+    
+    def test_invalid_pool(self):
+        """测试非法参数"""
+        from key_pool import KeyPool
+        with pytest.raises(ValueError):
+            KeyPool([])
+        with pytest.raises(ValueError):
+            KeyPool(["k1"], strategy="random")
+        with pytest.raises(ValueError):
+            KeyPool(["k1"], strategy="weighted", quotas=[1, 2])
+    
+    def test_manager_selects_from_pool(self, tmp_path):
+        """测试get_api_key从持久化的密钥池中选取"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path)
+        manager.set_key_pool("pool_service", ["pool-key-1", "pool-key-2"])
+        assert [manager.get_api_key("pool_service") for _ in range(4)] == [
+            "pool-key-1", "pool-key-2", "pool-key-1", "pool-key-2"]
+        
+        reopened = APIKeyManager(config_path)
+        assert reopened.get_key_pool("pool_service").keys == ["pool-key-1", "pool-key-2"]
+        reopened.remove_key_pool("pool_service")
+        assert reopened.get_api_key("pool_service") is None
+
+    def test_pool_changes_join_transaction(self, tmp_path):
+        """测试事务内的密钥池变更随事务一次提交，事务失败时不落盘"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path)
+        with patch.dict(os.environ):
+            with pytest.raises(RuntimeError):
+                with manager.transaction():
+                    manager.set_key_pool("txn_pool", ["txn-pool-1", "txn-pool-2"])
+                    raise RuntimeError("中途失败")
+            assert manager.get_key_pool("txn_pool") is None
+            assert "txn_pool" not in APIKeyManager(config_path).config.get("key_pools", {})
+
+            with patch.object(manager, 'save_config', wraps=manager.save_config) as save:
+                with manager.transaction():
+                    manager.set_api_key("txn_single", "txn-single-key")
+                    manager.set_key_pool("txn_pool", ["txn-pool-1", "txn-pool-2"])
+                    assert manager.get_key_pool("txn_pool") is None
+                assert save.call_count == 1
+            assert APIKeyManager(config_path).get_key_pool("txn_pool").keys == ["txn-pool-1", "txn-pool-2"]
+
+    def test_key_store_failure_restores_config(self, tmp_path):
+        """测试外部存储写入失败时恢复密钥和完整的配置快照"""
+        from storage.memory_store import MemoryKeyStore
+        key_store = MemoryKeyStore({"kept": "sk-kept-123456"})
+        manager = APIKeyManager(str(tmp_path / "config.json"), key_store=key_store)
+        before = manager.config
+        with patch.dict(os.environ):
+            with patch.object(key_store, 'set_many', side_effect=[OSError("存储不可用"), None]):
+                with pytest.raises(OSError):
+                    manager.set_api_keys({"failed": "sk-failed-123456", "kept": "sk-kept-changed"})
+        assert manager.config is before
+        assert "endpoints" in manager.config and "rates" in manager.config
+        assert key_store.items() == {"kept": "sk-kept-123456"}
+
+class TestRateLimiter:
+    """测试令牌桶限流器"""
+    
+    def setup_method(self):
+        """使用可控时钟"""
+        from rate_limiter import RateLimiter
+        self.now = 0.0
+        self.limiter = RateLimiter({"openai": {"rpm": 60, "tpm": 1000}}, clock=lambda: self.now)
+    
+    def test_request_bucket(self):
+        """测试每分钟请求数限制和补充"""
+        assert all(self.limiter.try_acquire("openai") for _ in range(60))
+        assert not self.limiter.try_acquire("openai")
+        self.now += 1.0
+        assert self.limiter.try_acquire("openai")
+        assert not self.limiter.try_acquire("openai")
+    
+    def test_token_bucket(self):
+        """测试token数限制，请求配额不会被失败的获取消耗"""
+        assert self.limiter.try_acquire("openai", tokens=900)
+        assert not self.limiter.try_acquire("openai", tokens=200)
+        self.now += 6.0
+        assert self.limiter.try_acquire("openai", tokens=200)
+        with pytest.raises(ValueError):
+            self.limiter.try_acquire("openai", tokens=5000)
+    
+    def test_per_key_and_unlimited(self):
+        """测试按密钥独立限流，未配置速率的服务不限流"""
+        for _ in range(60):
+            self.limiter.try_acquire("openai", key="k1")
+        assert not self.limiter.try_acquire("openai", key="k1")
+        assert self.limiter.try_acquire("openai", key="k2")
+        assert all(self.limiter.try_acquire("news_api") for _ in range(1000))
+    
+    def test_blocking_and_async_acquire(self):
+        """测试阻塞和异步获取会等待补充，超时返回False"""
+        from rate_limiter import RateLimiter
+        limiter = RateLimiter({"fast": {"rpm": 600}})
+        for _ in range(600):
+            limiter.try_acquire("fast")
+        assert limiter.acquire("fast", timeout=1.0)
+        assert not limiter.acquire("fast", timeout=0.01)
+        assert asyncio.run(limiter.acquire_async("fast", timeout=1.0))
+    
+    def test_manager_follows_rate_config(self, tmp_path):
+        """测试管理器按rates配置限流"""
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({"api_keys": {}, "rates": {"limited": {"rpm": 2}}}))
+        manager = AsyncAPIKeyManager(str(config_path))
+        assert manager.acquire("limited", blocking=False)
+        assert manager.acquire("limited", blocking=False)
+        assert not manager.acquire("limited", blocking=False)
+        assert not asyncio.run(manager.aacquire("limited", timeout=0))
+        manager.close()
+
+    def test_manager_skips_update_without_rates_section(self, tmp_path):
+        """测试没有rates节时不在每次访问时重复更新限流器"""
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({"api_keys": {}}))
+        manager = APIKeyManager(str(config_path))
+        limiter = manager.rate_limiter
+        with patch.object(limiter, 'update_rates', wraps=limiter.update_rates) as update:
+            for _ in range(5):
+                assert manager.acquire("unlimited", blocking=False)
+            assert update.call_count == 0
+
+class TestUsageRecorder:
+    """测试环形缓冲区用量统计"""
+    
+    def test_sliding_windows(self):
+        """测试分钟/小时/天窗口随时间滑动"""
+        from usage_recorder import UsageRecorder, key_id
+        now = [1_000_000.0]
+        recorder = UsageRecorder(clock=lambda: now[0])
+        
+        recorder.record("openai", "sk-usage-1", tokens=100)
+        recorder.record("openai", "sk-usage-2", tokens=50)
+        now[0] += 30
+        recorder.record("openai", "sk-usage-1", tokens=10)
+        
+        usage = recorder.usage("openai")
+        assert usage["minute"] == {"requests": 3, "tokens": 160}
+        assert usage["keys"][key_id("sk-usage-1")]["minute"]["requests"] == 2
+        assert "sk-usage-1" not in json.dumps(usage)
+        
+        now[0] += 45
+        assert recorder.usage("openai")["minute"] == {"requests": 1, "tokens": 10}
+        assert recorder.usage("openai")["hour"]["requests"] == 3
+        now[0] += 2 * 3600
+        assert recorder.usage("openai")["hour"]["requests"] == 0
+        assert recorder.usage("openai")["day"]["requests"] == 3
+        now[0] += 86400
+        assert recorder.usage("openai")["day"]["requests"] == 0
+    
+    def test_persist_and_restore(self, tmp_path):
+        """测试统计写入文件后重新加载"""
+        from usage_recorder import UsageRecorder
+        path = str(tmp_path / "usage.json")
+        recorder = UsageRecorder(path, persist_interval=3600)
+        recorder.record("openai", tokens=5)
+        recorder.close()
+        
+        restored = UsageRecorder(path, persist_interval=3600)
+        assert restored.usage("openai")["hour"] == {"requests": 1, "tokens": 5}
+        restored.close()
+    
+    def test_usage_route(self, tmp_path):
+        """测试acquire记录用量并通过路由查询"""
+        from fastapi.testclient import TestClient
+        import web_interface
+        
+        original = web_interface.manager
+        web_interface.manager = AsyncAPIKeyManager(str(tmp_path / "config.json"))
+        try:
+            web_interface.manager.acquire("usage_service", tokens=42)
+            response = TestClient(web_interface.app).get('/api/keys/usage_service/usage')
+            assert response.status_code == 200
+            assert response.json()["minute"] == {"requests": 1, "tokens": 42}
+        finally:
+            web_interface.manager.close()
+            web_interface.manager = original
+
+class TestKeyHistory:
+    """测试密钥版本历史"""
+    
+    def test_point_in_time_reads_and_rollback(self, tmp_path):
+        """测试按时间点读取和回滚到历史版本"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, history=True)
+        
+        with patch.dict(os.environ):
+            with patch('storage.history.time.time', side_effect=[100.0, 200.0, 300.0, 400.0]):
+                manager.set_api_key("history_service", "history-key-1")
+                manager.set_api_key("history_service", "history-key-2")
+                manager.remove_api_key("history_service")
+                manager.set_api_key("history_service", "history-key-3")
+            
+            assert manager.get_api_key("history_service", as_of=50.0) is None
+            assert manager.get_api_key("history_service", as_of=150.0) == "history-key-1"
+            assert manager.get_api_key("history_service", as_of=200.0) == "history-key-2"
+            assert manager.get_api_key("history_service", as_of=350.0) is None
+            assert manager.get_api_key("history_service", as_of=datetime.fromtimestamp(500)) == "history-key-3"
+            assert [v["deleted"] for v in manager.get_history("history_service")] == [False, False, True, False]
+            
+            manager.rollback("history_service", 1)
+            assert manager.get_api_key("history_service") == "history-key-1"
+            assert len(manager.get_history("history_service")) == 5
+            manager.close()
+            
+            # 重新打开后从历史文件恢复索引
+            reopened = APIKeyManager(config_path, history=True)
+            assert reopened.get_api_key("history_service", as_of=250.0) == "history-key-2"
+            assert len(reopened.get_history("history_service")) == 5
+    
+    def test_existing_keys_seeded_as_first_version(self, tmp_path):
+        """测试首次启用历史时现有密钥记为版本1"""
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            APIKeyManager(config_path).set_api_key("history_seed", "history-seed-key")
+            manager = APIKeyManager(config_path, history=True)
+        assert manager.get_history("history_seed")[0]["version"] == 1
+        assert manager._history.value("history_seed", 1) == "history-seed-key"
+    
+    def test_history_disabled(self):
+        """测试未启用历史时时间点查询报错"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            manager = APIKeyManager(os.path.join(temp_dir, 'config.json'))
+            with pytest.raises(ValueError):
+                manager.get_api_key("openai", as_of=0)
+
+class TestRotationScheduler:
+    """测试密钥轮换调度"""
+
+    def setup_method(self):
+        self.now = 1_000_000.0
+
+    def _scheduler(self, **kwargs):
+        from rotation_scheduler import RotationScheduler
+        return RotationScheduler(rotation_days=90, clock=lambda: self.now, **kwargs)
+
+    def test_expiring_within_sorted_by_due(self):
+        """测试按到期时间查询，重新安排后旧条目不再出现"""
+        from rotation_scheduler import DAY
+        scheduler = self._scheduler()
+        for i in range(100):
+            scheduler.schedule(f"svc{i}", rotated_at=self.now - i * DAY)
+        expiring = scheduler.expiring_within(5)
+        assert [item["service"] for item in expiring] == [f"svc{i}" for i in range(99, 84, -1)]
+        assert expiring[0]["expired"] and expiring[0]["age_days"] == 99
+
+        scheduler.schedule("svc99")
+        scheduler.unschedule("svc98")
+        services = [item["service"] for item in scheduler.expiring_within(5)]
+        assert "svc99" not in services and "svc98" not in services
+        assert scheduler.next_due()[0] == "svc97"
+
+    def test_run_due_fires_callbacks_and_renotifies(self):
+        """测试到期回调，未更换的密钥推迟一天后再次提醒"""
+        from rotation_scheduler import DAY
+        scheduler = self._scheduler()
+        fired = []
+        scheduler.add_callback(lambda service, due: fired.append(service))
+        scheduler.schedule("old", rotated_at=self.now - 91 * DAY)
+        scheduler.schedule("new", rotated_at=self.now)
+
+        assert scheduler.run_due() == ["old"]
+        assert scheduler.run_due() == []
+        assert scheduler.due_at("old") == self.now + DAY
+        # 已提醒过的过期密钥仍然出现在查询结果中
+        assert [item["service"] for item in scheduler.expiring_within(0)] == ["old"]
+        self.now += DAY
+        assert scheduler.run_due() == ["old"]
+        assert fired == ["old", "old"]
+
+    def test_background_thread_wakes_for_earlier_due(self):
+        """测试后台线程在新条目更早到期时被唤醒"""
+        from rotation_scheduler import RotationScheduler
+        scheduler = RotationScheduler(rotation_days=1)
+        fired = threading.Event()
+        scheduler.add_callback(lambda service, due: fired.set())
+        scheduler.schedule("later")
+        scheduler.start()
+        scheduler.schedule("soon", rotated_at=time.time() - 86400 + 0.05)
+        assert fired.wait(2.0)
+        scheduler.stop()
+
+    def test_manager_rotation(self, tmp_path):
+        """测试管理器按rotation_days跟踪密钥年龄并在回调返回新密钥时完成轮换"""
+        from rotation_scheduler import DAY
+        config_path = tmp_path / "config.json"
+        updated = datetime.fromtimestamp(time.time() - 88 * DAY).isoformat()
+        config_path.write_text(json.dumps({
+            "api_keys": {"rot_old": "sk-rot-old-123456", "rot_new": "sk-rot-new-123456"},
+            "metadata": {"rot_old": {"updated_at": updated}, "rot_new": {"rotation_days": 30}},
+            "security": {"rotation_days": 90},
+        }))
+        with patch.dict(os.environ):
+            manager = APIKeyManager(str(config_path), rotation=True)
+            expiring = manager.get_expiring_keys(3)
+            assert [item["service"] for item in expiring] == ["rot_old"]
+            assert expiring[0]["days_left"] == 1
+            assert 29 <= manager.rotation_scheduler.due_at("rot_new") / DAY - time.time() / DAY <= 30
+
+            manager.on_rotation_due(lambda service, due: "sk-rotated-123456")
+            manager.rotation_scheduler.clock = lambda: time.time() + 3 * DAY
+            assert manager.rotation_scheduler.run_due() == ["rot_old"]
+            manager.rotation_scheduler.clock = time.time
+            assert manager.get_api_key("rot_old") == "sk-rotated-123456"
+            assert manager.get_expiring_keys(3) == []
+
+            manager.remove_api_key("rot_new")
+            manager.close()
+
+            # 重启后从调度文件恢复上次轮换时间
+            reopened = APIKeyManager(str(config_path), rotation=True)
+            assert reopened.rotation_scheduler.services() == ["rot_old"]
+            assert reopened.rotation_scheduler.rotated_at("rot_old") > time.time() - 60
+            reopened.close()
+
+    def test_rotation_rejected_in_multiprocess_mode(self, tmp_path):
+        """测试多进程模式下不能启用轮换调度（各worker的调度状态无法同步）"""
+        with pytest.raises(ValueError):
+            APIKeyManager(str(tmp_path / "config.json"), multiprocess=True, rotation=True)
+
+    def test_rotation_writes_skip_record_table(self, tmp_path):
+        """测试启用轮换调度后写入不构建记录表也不解密"""
+        with patch.dict(os.environ):
+            manager = APIKeyManager(str(tmp_path / "config.json"), rotation=True,
+                                    encryption_key="rotation-passphrase")
+            with patch.object(manager, '_reveal', wraps=manager._reveal) as reveal:
+                manager.set_api_key("rot_fast", "sk-rot-fast-123456")
+                manager.set_api_keys({"rot_bulk": "sk-rot-bulk-123456"})
+            assert reveal.call_count == 0
+            assert manager._records == (None, None)
+            assert manager.rotation_scheduler.services() == ["rot_fast", "rot_bulk"]
+            manager.close()
+
+    def test_rotation_disabled(self, tmp_path):
+        """测试未启用轮换调度时查询报错"""
+        manager = APIKeyManager(str(tmp_path / "config.json"))
+        with pytest.raises(ValueError):
+            manager.get_expiring_keys()
+
+class TestEncryptionAtRest:
+    """测试静态加密"""
+
+    PASSPHRASE = "test-encryption-passphrase"
+
+    def test_cipher_cached_and_batch_roundtrip(self):
+        """测试加密器按密钥缓存，批量加解密，明文原样返回"""
+        from utils.helpers import decrypt_many, encrypt_many, generate_key, get_cipher
+        assert get_cipher(self.PASSPHRASE) is get_cipher(self.PASSPHRASE)
+        fernet_key = generate_key()
+        for key in (self.PASSPHRASE, fernet_key):
+            tokens = encrypt_many(["sk-a-123456", "sk-b-123456"], key)
+            assert all(token.startswith("enc:v1:") for token in tokens)
+            assert decrypt_many(tokens + ["sk-plain-123456"], key) == \
+                ["sk-a-123456", "sk-b-123456", "sk-plain-123456"]
+
+    def test_passphrase_salted_envelope(self):
+        """测试口令加盐派生：盐写在信封中，换一个加密器（新盐）仍可解密"""
+        from cryptography.fernet import InvalidToken
+        from utils.helpers import Cipher, generate_key, is_encrypted
+        first, second = Cipher(self.PASSPHRASE), Cipher(self.PASSPHRASE)
+        token = first.encrypt(b"sk-salted-123456")
+        assert token.split(b":")[2] != second.encrypt(b"sk-salted-123456").split(b":")[2]
+        assert second.decrypt(token) == b"sk-salted-123456"
+        with pytest.raises(InvalidToken):
+            Cipher("another-passphrase").decrypt(token)
+        with pytest.raises(InvalidToken):
+            Cipher(generate_key()).decrypt(token)
+        # 形似Fernet令牌的明文不会被当作密文
+        assert not is_encrypted("gAAAAABplaintext-key")
+
+    def test_bare_fernet_tokens_still_decrypt(self, tmp_path):
+        """测试信封格式之前用Fernet密钥写入的裸令牌仍可解密，rekey后改为信封格式"""
+        from cryptography.fernet import Fernet
+        from utils.helpers import decrypt_data, decrypt_many, generate_key, is_encrypted
+        key = generate_key()
+        legacy = Fernet(key.encode()).encrypt(b"sk-legacy-123456").decode()
+        assert is_encrypted(legacy)
+        assert decrypt_data(legacy, key) == "sk-legacy-123456"
+        assert decrypt_many([legacy, "sk-plain-123456"], key) == ["sk-legacy-123456", "sk-plain-123456"]
+
+        config_path = str(tmp_path / "config.json")
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({"api_keys": {"legacy": legacy}}, f)
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, encryption_key=key)
+            assert manager.get_record("legacy").key == "sk-legacy-123456"
+            manager.rekey(key, workers=1)
+            assert manager.config["api_keys"]["legacy"].startswith("enc:v1:")
+            manager.close()
+
+    def test_store_salt_shared_across_instances(self, tmp_path):
+        """测试各实例共用配置中的盐，重启后读取全部密文只派生一次密钥"""
+        from utils import helpers
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            for i in range(3):
+                manager = APIKeyManager(config_path, encryption_key=self.PASSPHRASE)
+                manager.set_api_key(f"salted{i}", f"sk-salted-{i}-123456")
+                manager.close()
+            with open(config_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            salt = stored["security"]["kdf_salt"]
+            assert all(value.startswith(f"enc:v1:{salt}:") for value in stored["api_keys"].values())
+
+            helpers._derive.cache_clear()
+            reopened = APIKeyManager(config_path, encryption_key=self.PASSPHRASE)
+            assert [reopened.get_record(f"salted{i}").key for i in range(3)] == \
+                [f"sk-salted-{i}-123456" for i in range(3)]
+            assert helpers._derive.cache_info().misses == 1
+            reopened.close()
+            async_manager = AsyncAPIKeyManager(config_path, encryption_key=self.PASSPHRASE)
+            assert not async_manager._reads_in_memory()
+            async_manager.close()
+
+    def test_values_encrypted_on_disk(self, tmp_path):
+        """测试配置文件、密钥池和版本历史中只有密文"""
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, history=True, encryption_key=self.PASSPHRASE)
+            manager.set_api_key("enc_single", "sk-enc-single-123456")
+            manager.set_api_keys({"enc_bulk": "sk-enc-bulk-123456"})
+            manager.set_key_pool("enc_pool", ["sk-enc-pool-1", "sk-enc-pool-2"])
+            manager.close()
+
+            for path in (config_path, config_path + ".history"):
+                with open(path, 'r', encoding='utf-8') as f:
+                    assert "sk-enc" not in f.read()
+
+            reopened = APIKeyManager(config_path, history=True, encryption_key=self.PASSPHRASE)
+            assert reopened.get_api_key("enc_single") == "sk-enc-single-123456"
+            assert reopened.get_api_key("enc_single", as_of=time.time()) == "sk-enc-single-123456"
+            assert reopened.get_record("enc_bulk").key == "sk-enc-bulk-123456"
+            assert reopened.get_api_key("enc_pool") in ("sk-enc-pool-1", "sk-enc-pool-2")
+            assert reopened.list_all_keys()["enc_bulk"] == "sk-enc-bul..."
+            reopened.close()
+
+    def test_lazy_decryption(self, tmp_path):
+        """测试加载时不解密，读取哪个密钥才解密哪个"""
+        from utils import helpers
+        from utils.helpers import encrypt_many
+        config_path = tmp_path / "config.json"
+        keys = {f"lazy{i}": f"sk-lazy-{i}-123456" for i in range(50)}
+        config_path.write_text(json.dumps({
+            "api_keys": dict(zip(keys, encrypt_many(keys.values(), self.PASSPHRASE)))
+        }))
+        with patch('utils.helpers.decrypt_many', wraps=helpers.decrypt_many) as decrypt:
+            manager = APIKeyManager(str(config_path), encryption_key=self.PASSPHRASE)
+            assert decrypt.call_count == 0
+            assert manager.get_api_key("lazy7") == "sk-lazy-7-123456"
+            assert decrypt.call_count == 1
+
+    def test_plaintext_values_still_readable(self, tmp_path):
+        """测试启用加密前写入的明文仍可读取，错误的加密密钥报错"""
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            APIKeyManager(config_path).set_api_key("legacy", "sk-legacy-123456")
+            manager = APIKeyManager(config_path, encryption_key=self.PASSPHRASE)
+            assert manager.get_api_key("legacy") == "sk-legacy-123456"
+            manager.set_api_key("sealed", "sk-sealed-123456")
+            del os.environ["SEALED_API_KEY"]
+            with pytest.raises(ValueError):
+                APIKeyManager(config_path, encryption_key="wrong-passphrase").get_api_key("sealed")
+
+    def test_encrypt_keys_false_disables_writes(self, tmp_path):
+        """测试security.encrypt_keys为false时不加密写入"""
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({"api_keys": {}, "security": {"encrypt_keys": False}}))
+        with patch.dict(os.environ):
+            manager = APIKeyManager(str(config_path), encryption_key=self.PASSPHRASE)
+            manager.set_api_key("plain", "sk-plain-123456")
+        assert json.loads(config_path.read_text())["api_keys"]["plain"] == "sk-plain-123456"
+
+    def test_secret_cache_eviction_and_expiry(self):
+        """测试解密缓存按容量淘汰、按时间过期、密文变化时失效"""
+        from secret_cache import SecretCache
+        now = [0.0]
+        cache = SecretCache(max_size=2, ttl=10, clock=lambda: now[0])
+        cache.put("a", "token-a", "plain-a")
+        cache.put("b", "token-b", "plain-b")
+        assert cache.get("a", "token-a") == "plain-a"
+        cache.put("c", "token-c", "plain-c")
+        assert cache.get("b", "token-b") is None
+        assert cache.get("a", "token-a") == "plain-a"
+        assert cache.get("a", "token-a2") is None
+
+        cache.put("c", "token-c", "plain-c")
+        now[0] = 11
+        assert cache.get("c", "token-c") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"], stats["expirations"]) == (2, 3, 1, 1)
+
+    def test_manager_reads_hit_cache_and_writes_purge(self, tmp_path):
+        """测试重复读取命中缓存，更换/删除密钥立即清除缓存"""
+        from utils import helpers
+        with patch.dict(os.environ):
+            manager = APIKeyManager(str(tmp_path / "config.json"), encryption_key=self.PASSPHRASE)
+            manager.set_api_key("cached", "sk-cached-1-123456")
+            # 去掉环境变量覆盖，让读取走存储
+            os.environ.pop("CACHED_API_KEY")
+            manager.refresh_env()
+
+            with patch('utils.helpers.decrypt_many', wraps=helpers.decrypt_many) as decrypt:
+                for _ in range(10):
+                    assert manager.get_api_key("cached") == "sk-cached-1-123456"
+                assert decrypt.call_count == 1
+            assert manager.secret_cache_stats()["hits"] == 9
+
+            manager.set_api_key("cached", "sk-cached-2-123456")
+            assert len(manager._secret_cache) == 0
+            os.environ.pop("CACHED_API_KEY")
+            manager.refresh_env()
+            assert manager.get_api_key("cached") == "sk-cached-2-123456"
+            manager.remove_api_key("cached")
+            assert manager.get_api_key("cached") is None
+        assert APIKeyManager(str(tmp_path / "config.json")).secret_cache_stats() is None
+
+    def test_rekey_with_process_pool(self, tmp_path):
+        """测试用进程池更换主密钥，旧密文全部替换，历史仍可用新旧密钥读取"""
+        from utils.helpers import decrypt_many, generate_key
+        config_path = str(tmp_path / "config.json")
+        new_key = generate_key()
+        keys = {f"rekey{i}": f"sk-rekey-{i}-123456" for i in range(40)}
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, history=True, encryption_key=self.PASSPHRASE)
+            manager.set_api_keys(keys)
+            manager.set_key_pool("rekey_pool", ["sk-rekey-pool-1", "sk-rekey-pool-2"])
+            assert manager.rekey(new_key, workers=2, chunk_size=8) == 42
+            assert not os.path.exists(config_path + ".rekey")
+            manager.close()
+
+            with open(config_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            assert decrypt_many(stored["api_keys"].values(), new_key) == list(keys.values())
+            assert decrypt_many(stored["key_pools"]["rekey_pool"]["keys"], new_key) == \
+                ["sk-rekey-pool-1", "sk-rekey-pool-2"]
+            with pytest.raises(Exception):
+                decrypt_many(stored["api_keys"].values(), self.PASSPHRASE)
+
+            reopened = APIKeyManager(config_path, history=True,
+                                     encryption_key=[new_key, self.PASSPHRASE])
+            for var in [f"REKEY{i}_API_KEY" for i in range(40)]:
+                os.environ.pop(var, None)
+            reopened.refresh_env()
+            assert reopened.get_api_key("rekey7") == "sk-rekey-7-123456"
+            assert reopened.get_api_key("rekey7", as_of=time.time()) == "sk-rekey-7-123456"
+            reopened.close()
+
+    def test_rekey_resumes_from_checkpoint(self, tmp_path):
+        """测试写入失败后重新执行从检查点继续，期间变化的记录重新加密"""
+        import rekey
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, encryption_key=self.PASSPHRASE)
+            manager.set_api_keys({f"resume{i}": f"sk-resume-{i}-123456" for i in range(10)})
+            with patch('storage.fileio.atomic_write_json', side_effect=OSError("磁盘已满")):
+                with pytest.raises(OSError):
+                    manager.rekey("new-passphrase", workers=1, chunk_size=3)
+            assert os.path.exists(config_path + ".rekey")
+            assert manager.get_api_key("resume0") == "sk-resume-0-123456"
+
+            manager.set_api_key("resume3", "sk-resume-3-changed")
+            with patch('rekey._rotate_chunk', wraps=rekey._rotate_chunk) as rotate:
+                assert manager.rekey("new-passphrase", workers=1, chunk_size=3) == 10
+            assert [item for chunk in rotate.call_args_list for item, _ in chunk.args[0]] == \
+                [("api_keys", "resume3")]
+            os.environ.pop("RESUME3_API_KEY")
+            manager.refresh_env()
+            assert manager.get_api_key("resume3") == "sk-resume-3-changed"
+        reopened = APIKeyManager(config_path, encryption_key="new-passphrase")
+        assert reopened.get_record("resume5").key == "sk-resume-5-123456"
+
+    def test_rekey_checkpoint_bound_to_new_key(self, tmp_path):
+        """测试检查点首行只有随机标识，换一个新密钥时检查点作废"""
+        import rekey
+        from utils.helpers import hash_key
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, encryption_key=self.PASSPHRASE)
+            manager.set_api_keys({f"bound{i}": f"sk-bound-{i}-123456" for i in range(4)})
+            with patch('storage.fileio.atomic_write_json', side_effect=OSError("磁盘已满")):
+                with pytest.raises(OSError):
+                    manager.rekey("new-passphrase", workers=1, chunk_size=2)
+            with open(config_path + ".rekey", 'r', encoding='utf-8') as f:
+                content = f.read()
+            assert set(json.loads(content.splitlines()[0])) == {"id", "check"}
+            assert hash_key("new-passphrase")[:16] not in content
+
+            with patch('rekey._rotate_chunk', wraps=rekey._rotate_chunk) as rotate:
+                assert manager.rekey("other-passphrase", workers=1, chunk_size=2) == 4
+            assert sum(len(chunk.args[0]) for chunk in rotate.call_args_list) == 4
+
+    def test_rekey_writes_config_before_store(self, tmp_path):
+        """测试外部存储写入失败时配置已切换到新密钥，重新执行即可补完"""
+        from storage.base import create_key_store
+        config_path = str(tmp_path / "config.json")
+        key_store = create_key_store("sqlite", str(tmp_path / "keys.db"))
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, key_store=key_store, encryption_key=self.PASSPHRASE)
+            manager.set_api_keys({f"store{i}": f"sk-store-{i}-123456" for i in range(3)})
+            manager.set_key_pool("store_pool", ["sk-store-pool-1"])
+            with patch.object(key_store, 'set_many', side_effect=OSError("存储不可用")):
+                with pytest.raises(OSError):
+                    manager.rekey("new-passphrase", workers=1)
+            with open(config_path, 'r', encoding='utf-8') as f:
+                assert "key_check" in json.load(f)["security"]
+            assert os.path.exists(config_path + ".rekey")
+            assert manager.get_api_key("store_pool") == "sk-store-pool-1"
+            os.environ.pop("STORE1_API_KEY", None)
+            manager.refresh_env()
+            assert manager.get_api_key("store1") == "sk-store-1-123456"
+
+            assert manager.rekey("new-passphrase", workers=1) == 4
+            assert not os.path.exists(config_path + ".rekey")
+            reopened = APIKeyManager(config_path, key_store=key_store,
+                                     encryption_key="new-passphrase")
+            assert reopened.get_record("store2").key == "sk-store-2-123456"
+
+    def test_other_workers_adopt_new_key(self, tmp_path):
+        """测试其它进程更换主密钥后：有新密钥的进程改用它加密，没有的拒绝写入"""
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            first = APIKeyManager(config_path, multiprocess=True, encryption_key=self.PASSPHRASE)
+            stale = APIKeyManager(config_path, multiprocess=True, encryption_key=self.PASSPHRASE)
+            ready = APIKeyManager(config_path, multiprocess=True,
+                                  encryption_key=[self.PASSPHRASE, "new-passphrase"])
+            first.set_api_key("adopt_a", "sk-adopt-a-123456")
+            assert ready.get_api_key("adopt_a") == "sk-adopt-a-123456"
+            first.rekey("new-passphrase", workers=1)
+
+            with pytest.raises(ValueError):
+                stale.set_api_key("adopt_b", "sk-adopt-b-123456")
+            ready.set_api_key("adopt_c", "sk-adopt-c-123456")
+            assert ready._encryption_key[0] == "new-passphrase"
+            for manager in (first, stale, ready):
+                manager.close()
+
+        reopened = APIKeyManager(config_path, encryption_key="new-passphrase")
+        assert reopened.get_record("adopt_c").key == "sk-adopt-c-123456"
+        assert reopened.get_record("adopt_b") is None
+
+class TestOwnerIndex:
+    """测试密钥反查索引"""
+
+    def test_index_maintained_on_every_mutation(self, tmp_path):
+        """测试设置、批量、事务、密钥池和删除都增量更新索引"""
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            manager = APIKeyManager(config_path, owner_index=True,
+                                    encryption_key="owner-index-passphrase")
+            manager.set_api_key("owner_a", "sk-owner-a-123456")
+            manager.set_api_keys({"owner_b": "sk-owner-b-123456", "owner_c": "sk-shared-123456"})
+            with manager.transaction() as txn:
+                txn.set("owner_d", "sk-owner-d-123456")
+            manager.set_key_pool("owner_pool", ["sk-pool-x-123456", "sk-shared-123456"])
+
+            assert manager.find_owner("sk-owner-a-123456") == [{"service": "owner_a", "record": "api_keys"}]
+            assert manager.find_owner("sk-owner-d-123456")[0]["service"] == "owner_d"
+            assert manager.find_owner("sk-shared-123456") == [
+                {"service": "owner_c", "record": "api_keys"},
+                {"service": "owner_pool", "record": "key_pools"},
+            ]
+
+            manager.set_api_key("owner_a", "sk-owner-a-rotated")
+            manager.remove_api_keys(["owner_b"])
+            manager.remove_key_pool("owner_pool")
+            assert manager.find_owner("sk-owner-a-123456") == []
+            assert manager.find_owner("sk-owner-a-rotated")[0]["service"] == "owner_a"
+            assert manager.find_owner("sk-owner-b-123456") == []
+            assert manager.find_owner("sk-shared-123456") == [{"service": "owner_c", "record": "api_keys"}]
+            manager.close()
+
+        with open(config_path + ".owners", 'r', encoding='utf-8') as f:
+            assert "sk-" not in f.read()
+        # 重启后从索引文件恢复，无需解密
+        reopened = APIKeyManager(config_path, owner_index=True)
+        assert reopened.find_owner("sk-owner-a-rotated")[0]["service"] == "owner_a"
+        assert reopened.find_owner("sk-owner-b-123456") == []
+        reopened.close()
+
+    def test_existing_keys_indexed_and_compaction(self, tmp_path):
+        """测试首次启用时为现有密钥建立索引，日志过长时压缩"""
+        from storage.owner_index import OwnerIndex
+        config_path = str(tmp_path / "config.json")
+        with patch.dict(os.environ):
+            APIKeyManager(config_path).set_api_key("owner_old", "sk-owner-old-123456")
+            manager = APIKeyManager(config_path, owner_index=True)
+            assert manager.find_owner("sk-owner-old-123456")[0]["service"] == "owner_old"
+
+        index = OwnerIndex(str(tmp_path / "owners"), compact_min=10)
+        for i in range(30):
+            index.update({("api_keys", "svc"): [f"sk-compact-{i}"]})
+        with open(index.path, 'rb') as f:
+            assert len(f.read().splitlines()) < 12
+        index.close()
+        assert OwnerIndex(index.path).find("sk-compact-29") == [("api_keys", "svc")]
+        assert OwnerIndex(index.path).find("sk-compact-28") == []
+
+    def test_owner_route(self, tmp_path):
+        """测试反查路由"""
+        from fastapi.testclient import TestClient
+        import web_interface
+
+        original = web_interface.manager
+        web_interface.manager = AsyncAPIKeyManager(str(tmp_path / "config.json"), owner_index=True)
+        try:
+            with patch.dict(os.environ):
+                web_interface.manager.set_api_key("owner_route", "sk-owner-route-123456")
+                client = TestClient(web_interface.app)
+                response = client.post('/api/keys/owner', json={"key": "sk-owner-route-123456"})
+                assert response.status_code == 200
+                assert response.json()["owners"] == [{"service": "owner_route", "record": "api_keys"}]
+                assert client.post('/api/keys/owner', json={"key": "sk-unknown-000000"}).status_code == 404
+        finally:
+            web_interface.manager.close()
+            web_interface.manager = original
+
+    def test_blocking_routes_run_in_threadpool(self):
+        """测试调用同步管理器方法的路由是普通函数（由FastAPI放到线程池执行，不阻塞事件循环）"""
+        import web_interface
+        for handler in (web_interface.find_key_owner, web_interface.get_expiring_keys,
+                        web_interface.get_key_usage):
+            assert not asyncio.iscoroutinefunction(handler)
+
+class TestConcurrency:
+    """测试并发读写"""
+    
+    def test_readers_never_see_partial_state(self, tmp_path):
+        """测试读线程在并发写入时不报错且看到完整快照"""
+        manager = APIKeyManager(str(tmp_path / "config.json"), backend="journal")
+        errors = []
+        stop = threading.Event()
+        
+        def reader():
+            while not stop.is_set():
+                try:
+                    snapshot = manager.snapshot()
+                    keys = snapshot.get("api_keys", {})
+                    for service, key in keys.items():
+                        assert key == f"key-{service}"
+                    manager.list_all_keys()
+                except Exception as e:
+                    errors.append(e)
+                    return
+        
+        def writer(offset):
+            for i in range(offset, offset + 200):
+                service = f"concurrency{i}"
+                manager.set_api_key(service, f"key-{service}")
+                if i % 3 == 0:
+                    manager.remove_api_key(service)
+        
+        with patch.dict(os.environ):
+            readers = [threading.Thread(target=reader) for _ in range(4)]
+            writers = [threading.Thread(target=writer, args=(n * 200,)) for n in range(4)]
+            for t in readers + writers:
+                t.start()
+            for t in writers:
+                t.join()
+            stop.set()
+            for t in readers:
+                t.join()
+        
+        assert errors == []
+        assert len(manager.config["api_keys"]) == 800 - len(range(0, 800, 3))
+        manager.close()
+    
+    def test_snapshot_is_not_mutated_by_writes(self, tmp_path):
+        """测试写操作不修改已发布的快照"""
+        manager = APIKeyManager(str(tmp_path / "config.json"))
+        before = manager.snapshot()
+        
+        with patch.dict(os.environ):
+            manager.set_api_key("snapshot_service", "snapshot-key-123")
+        
+        assert "snapshot_service" not in before["api_keys"]
+        assert manager.snapshot()["api_keys"]["snapshot_service"] == "snapshot-key-123"
+
+class TestAsyncAPIKeyManager:
+    """测试异步管理器"""
+    
+    def test_async_roundtrip(self, tmp_path):
+        """测试异步读写"""
+        async def scenario(manager):
+            await manager.aset("async_service", "async-key-12345")
+            assert await manager.aget("async_service") == "async-key-12345"
+            assert "async_service" in await manager.alist()
+            await manager.aremove("async_service")
+            assert await manager.aget("async_service") is None
+        
+        manager = AsyncAPIKeyManager(str(tmp_path / "config.json"))
+        with patch.dict(os.environ):
+            asyncio.run(scenario(manager))
+        manager.close()
+    
+    def test_writes_do_not_block_event_loop(self, tmp_path):
+        """测试并发写入期间事件循环仍能调度其它任务"""
+        async def scenario(manager):
+            ticks = 0
+            
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+            
+            task = asyncio.create_task(ticker())
+            await asyncio.gather(*(
+                manager.aset(f"async_service{i}", f"async-key-{i}") for i in range(20)
+            ))
+            task.cancel()
+            return ticks
+        
+        manager = AsyncAPIKeyManager(str(tmp_path / "config.json"), group_commit_window=0.01)
+        with patch.dict(os.environ):
+            ticks = asyncio.run(scenario(manager))
+        
+        assert ticks > 0
+        assert len(APIKeyManager(str(tmp_path / "config.json")).config["api_keys"]) == 20
+        manager.close()
+
+class TestAsyncRoutes:
+    """测试FastAPI路由使用异步管理器"""
+    
+    def setup_method(self):
+        """测试前设置"""
+        from fastapi.testclient import TestClient
+        import web_interface
+        
+        self.temp_dir = tempfile.mkdtemp()
+        self.web_interface = web_interface
+        self.original_manager = web_interface.manager
+        web_interface.manager = AsyncAPIKeyManager(os.path.join(self.temp_dir, 'config.json'))
+        self.client = TestClient(web_interface.app)
+    
+    def teardown_method(self):
+        """测试后清理"""
+        self.web_interface.manager.close()
+        self.web_interface.manager = self.original_manager
+        import shutil
+        shutil.rmtree(self.temp_dir)
+    
+    def test_key_lifecycle(self):
+        """测试通过路由设置、读取和删除密钥"""
+        with patch.dict(os.environ):
+            response = self.client.post('/api/keys', json={"service": "route_service", "key": "route-key-123456"})
+            assert response.status_code == 200
+            assert response.json()["status"] == "success"
+            
+            response = self.client.get('/api/keys/route_service')
+            assert response.status_code == 200
+            assert response.json()["key"] == "route-key-..."
+            
+            response = self.client.delete('/api/keys/route_service')
+            assert response.status_code == 200
+            assert self.client.get('/api/keys/route_service').status_code == 404
+    
+    def test_batch_routes(self):
+        """测试批量设置和删除路由"""
+        keys = {f"route_batch{i}": f"route-batch-key-{i}" for i in range(5)}
+        with patch.dict(os.environ):
+            response = self.client.post('/api/keys:batch', json={"keys": keys})
+            assert response.status_code == 200
+            assert response.json()["services"] == list(keys)
+            assert self.client.get('/api/keys/route_batch3').status_code == 200
+            
+            response = self.client.post('/api/keys:batch', json={"keys": {"route_batch9": ""}})
+            assert response.status_code == 400
+            
+            response = self.client.request('DELETE', '/api/keys:batch', json={"services": list(keys)})
+            assert response.status_code == 200
+            assert self.client.get('/api/keys/route_batch3').status_code == 404
+
 class TestHelpers:
     """测试工具函数"""
     
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+健康检查引擎测试
+用本地的模拟服务商服务器（HTTP/1.1 keep-alive）代替真实上游
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from api_key_manager import APIKeyManager, AsyncAPIKeyManager
+from health_check import ERROR, INVALID, VALID, HealthChecker
+from usage_recorder import key_id
+
+GOOD_KEY = "sk-good-key-123456"
+
+
+class _MockProvider(BaseHTTPRequestHandler):
+    """Bearer为GOOD_KEY时返回200，否则401；/slow 路径延迟响应"""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path.startswith("/slow"):
+            time.sleep(0.5)
+        if self.path.startswith("/chunked"):
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write(b"2\r\nok\r\n0\r\n\r\n")
+            return
+        ok = self.headers.get("Authorization") == f"Bearer {GOOD_KEY}"
+        body = json.dumps({"ok": ok}).encode()
+        self.send_response(200 if ok else 401)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def provider():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockProvider)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def checker():
+    checker = HealthChecker(ttl=60, timeout=2.0, timeouts={"slow": 0.1},
+                            probes={"slow": {"path": "/slow"}, "chunked": {"path": "/chunked"}})
+    yield checker
+    checker.close()
+
+
+class TestHealthChecker:
+    """测试探测、缓存、超时和连接复用"""
+
+    def test_valid_and_invalid_keys(self, provider, checker):
+        """测试有效密钥和401密钥"""
+        assert checker.check_sync("mock", GOOD_KEY, provider.url)["status"] == VALID
+        result = checker.check_sync("mock", "sk-bad-key-000000", provider.url)
+        assert result["status"] == INVALID
+        assert result["http_status"] == 401
+        assert "sk-bad" not in json.dumps(result)
+
+    def test_results_cached_with_ttl(self, provider, checker):
+        """测试TTL内重复检查命中缓存"""
+        checker.check_sync("mock", GOOD_KEY, provider.url)
+        result = checker.check_sync("mock", GOOD_KEY, provider.url)
+        assert result["cached"] is True
+        assert provider.requests == 1
+        assert checker.check_sync("mock", GOOD_KEY, provider.url, use_cache=False)["cached"] is False
+        assert provider.requests == 2
+
+    def test_keep_alive_connections_reused(self, provider, checker):
+        """测试连续探测复用同一条连接"""
+        for i in range(5):
+            checker.check_sync(f"mock{i}", GOOD_KEY, provider.url)
+        assert provider.requests == 5
+        assert checker.connections_opened == 1
+        assert provider.connections == 1
+
+    def test_chunked_response(self, provider, checker):
+        """测试分块编码的响应"""
+        assert checker.check_sync("chunked", GOOD_KEY, provider.url)["status"] == VALID
+
+    def test_per_service_timeout(self, provider, checker):
+        """测试单个服务的超时设置"""
+        result = checker.check_sync("slow", GOOD_KEY, provider.url)
+        assert result["status"] == ERROR
+        assert result["error"] == "timeout"
+
+    def test_unreachable_endpoint(self, checker):
+        """测试连接失败"""
+        result = checker.check_sync("mock", GOOD_KEY, "http://127.0.0.1:1")
+        assert result["status"] == ERROR
+
+    def test_error_results_use_short_ttl(self, checker):
+        """测试失败结果只缓存error_ttl秒，error_ttl为0时不缓存"""
+        checker.error_ttl = 0
+        checker.check_sync("mock", GOOD_KEY, "http://127.0.0.1:1")
+        assert checker.cached("mock", GOOD_KEY) is None
+        checker.error_ttl = 30
+        checker.check_sync("mock", GOOD_KEY, "http://127.0.0.1:1")
+        expires = checker._cache[("mock", key_id(GOOD_KEY))][0]
+        assert expires - time.monotonic() <= 30
+
+    def test_malformed_status_line(self, provider, checker):
+        """测试状态行无法解析的上游只影响自己的结果，不中断批量检查"""
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+
+        def serve():
+            conn, _ = server.accept()
+            conn.recv(4096)
+            conn.sendall(b"garbage\r\n\r\n")
+            conn.close()
+        threading.Thread(target=serve, daemon=True).start()
+        targets = [("broken", GOOD_KEY, f"http://127.0.0.1:{server.getsockname()[1]}"),
+                   ("mock", GOOD_KEY, provider.url)]
+
+        async def collect():
+            return {result["service"]: result async for result in checker.check_many(targets)}
+
+        results = asyncio.run(collect())
+        server.close()
+        assert results["broken"]["status"] == ERROR
+        assert results["mock"]["status"] == VALID
+
+    def test_check_many_concurrent(self, provider, checker):
+        """测试并发检查按完成顺序产出"""
+        targets = [("slow_ok", GOOD_KEY, provider.url + "/slow") for _ in range(1)]
+        targets += [(f"fast{i}", GOOD_KEY, provider.url) for i in range(4)]
+
+        async def collect():
+            return [result async for result in checker.check_many(targets)]
+
+        started = time.monotonic()
+        results = asyncio.run(collect())
+        assert len(results) == 5
+        assert results[-1]["service"] == "slow_ok"
+        assert time.monotonic() - started < 1.5
+
+
+class TestManagerHealthCheck:
+    """测试管理器和路由接入健康检查"""
+
+    def _config(self, tmp_path, provider):
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({
+            "api_keys": {"mock_good": GOOD_KEY, "mock_bad": "sk-bad-key-000000", "no_endpoint": "sk-x-123456789"},
+            "endpoints": {"mock_good": provider.url, "mock_bad": provider.url},
+        }))
+        return str(config_path)
+
+    def test_test_api_key_probes_endpoint(self, tmp_path, provider):
+        """测试test_api_key实际请求endpoint"""
+        manager = APIKeyManager(self._config(tmp_path, provider))
+        assert manager.test_api_key("mock_good") is True
+        assert manager.test_api_key("mock_bad") is False
+        assert manager.test_api_key("no_endpoint") is True
+        manager.close()
+
+    def test_test_all_route_streams(self, tmp_path, provider):
+        """测试test-all路由逐行推送结果"""
+        from fastapi.testclient import TestClient
+        import web_interface
+
+        original = web_interface.manager
+        web_interface.manager = AsyncAPIKeyManager(self._config(tmp_path, provider))
+        try:
+            with TestClient(web_interface.app) as client:
+                response = client.post('/api/keys/test-all')
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            results = {}
+            for line in response.text.splitlines():
+                result = json.loads(line)
+                results[result["service"]] = result["status"]
+            assert results["mock_good"] == VALID
+            assert results["mock_bad"] == INVALID
+            assert results["no_endpoint"] == "no_endpoint"
+        finally:
+            web_interface.manager.close()
+            web_interface.manager = original
+
+
+class TestCircuitBreaker:
+    """测试熔断器状态转换、跨进程共享和密钥选择"""
+
+    def setup_method(self):
+        self.now = 1000.0
+
+    def _breaker(self, **kwargs):
+        from circuit_breaker import CircuitBreaker
+        return CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=lambda: self.now, **kwargs)
+
+    def test_state_transitions(self):
+        """测试closed -> open -> half_open -> closed/open"""
+        from circuit_breaker import CLOSED, HALF_OPEN, OPEN
+        breaker = self._breaker()
+        for _ in range(2):
+            breaker.record_failure("openai", "sk-1")
+        assert breaker.state("openai", "sk-1") == CLOSED
+        breaker.record_failure("openai", "sk-1")
+        assert breaker.state("openai", "sk-1") == OPEN
+        assert not breaker.allow("openai", "sk-1")
+        assert breaker.allow("openai", "sk-2")
+
+        self.now += 31
+        assert breaker.state("openai", "sk-1") == HALF_OPEN
+        assert breaker.allow("openai", "sk-1")
+        # 试探请求返回前不再放行
+        assert not breaker.allow("openai", "sk-1")
+        breaker.record_failure("openai", "sk-1")
+        assert breaker.state("openai", "sk-1") == OPEN
+
+        self.now += 31
+        assert breaker.allow("openai", "sk-1")
+        breaker.record_success("openai", "sk-1")
+        assert breaker.state("openai", "sk-1") == CLOSED
+
+    def test_service_level_breaker(self):
+        """测试服务级熔断器打开时该服务的所有密钥都不可用"""
+        breaker = self._breaker()
+        breaker.record_failure("openai", trip=True)
+        assert not breaker.allow("openai", "sk-1")
+        assert breaker.allow("anthropic", "sk-1")
+
+    def test_allow_checks_both_levels_before_trial(self):
+        """测试密钥级仍在冷却时不占用服务级的试探机会"""
+        from circuit_breaker import HALF_OPEN, OPEN
+        breaker = self._breaker()
+        breaker.record_failure("openai", trip=True)
+        self.now += 20
+        breaker.record_failure("openai", "sk-1", trip=True)
+        self.now += 11
+        assert not breaker.allow("openai", "sk-1")
+        assert breaker.state("openai") == HALF_OPEN
+        assert breaker.allow("openai", "sk-2")
+        assert not breaker.allow("openai", "sk-3")
+        assert breaker.state("openai", "sk-1") == OPEN
+
+    def test_slots_reclaimed(self):
+        """测试探测链占满后复用已关闭的槽位和长期无人试探的open槽位"""
+        from circuit_breaker import OPEN
+        breaker = self._breaker(slots=4, reclaim_after=100)
+        for i in range(4):
+            breaker.record_failure("svc", f"sk-old-{i}")
+            breaker.record_success("svc", f"sk-old-{i}")
+        breaker.record_failure("svc", "sk-new", trip=True)
+        assert breaker.state("svc", "sk-new") == OPEN
+
+        for i in range(3):
+            breaker.record_failure("svc", f"sk-revoked-{i}", trip=True)
+        breaker.record_failure("svc", "sk-late", trip=True)
+        assert breaker.untracked == 1
+        self.now += 30 + 100
+        breaker.record_failure("svc", "sk-late", trip=True)
+        assert breaker.state("svc", "sk-late") == OPEN
+        assert breaker.untracked == 1
+
+    def test_read_waits_for_consistent_slot(self):
+        """测试槽位正在写入（seq为奇数）时读取不使用写了一半的数据"""
+        from circuit_breaker import OPEN, _SEQ, _hash
+        breaker = self._breaker()
+        breaker.record_failure("openai", "sk-1", trip=True)
+        offset = breaker._find(_hash("openai", key_id("sk-1")))
+        breaker._buf[offset + _SEQ] += 1
+        assert breaker.state("openai", "sk-1") == OPEN
+
+    def test_state_shared_through_file(self, tmp_path):
+        """测试多个实例（各worker）映射同一状态文件"""
+        from circuit_breaker import OPEN
+        path = str(tmp_path / "breakers")
+        writer = self._breaker(path=path)
+        reader = self._breaker(path=path)
+        writer.record_failure("openai", "sk-1", trip=True)
+        assert reader.state("openai", "sk-1") == OPEN
+        writer.close()
+        reader.close()
+
+    def test_pool_selection_skips_open_keys(self, tmp_path):
+        """测试密钥池选择自动跳过熔断中的密钥"""
+        manager = APIKeyManager(str(tmp_path / "config.json"))
+        manager.set_key_pool("pooled", ["sk-pool-1", "sk-pool-2", "sk-pool-3"])
+        manager.report_failure("pooled", "sk-pool-2", trip=True)
+        assert manager.get_breaker_state("pooled", "sk-pool-2") == "open"
+        assert {manager.get_api_key("pooled") for _ in range(9)} == {"sk-pool-1", "sk-pool-3"}
+
+    def test_health_checks_feed_breaker(self, tmp_path, provider):
+        """测试健康检查发现密钥失效后熔断该密钥"""
+        config_path = tmp_path / "config.json"
+        config_path.write_text(json.dumps({
+            "api_keys": {}, "endpoints": {"pooled": provider.url},
+            "key_pools": {"pooled": {"keys": [GOOD_KEY, "sk-revoked-000000"]}}
+        }))
+        manager = AsyncAPIKeyManager(str(config_path))
+
+        async def run():
+            return [result async for result in manager.atest_all()]
+        results = asyncio.run(run())
+        assert sorted(result["status"] for result in results if result["service"] == "pooled") == [INVALID, VALID]
+        assert manager.get_breaker_state("pooled", "sk-revoked-000000") == "open"
+        assert {manager.get_api_key("pooled") for _ in range(6)} == {GOOD_KEY}
+        manager.close()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+分布式限流测试
+用本地的RESP协议替身服务器代替Redis：替身按脚本SHA识别令牌桶脚本，并用Python执行等价逻辑
+"""
+
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from redis_limiter import (RESPClient, RedisError, RedisRateLimiter,
+                           TOKEN_BUCKET_SCRIPT, TOKEN_BUCKET_SHA)
+
+
+class _StandInRedis(socketserver.ThreadingTCPServer):
+    """支持PING / SCRIPT缓存 / EVAL / EVALSHA（仅令牌桶脚本）的替身服务器"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.scripts = set()
+        self.commands = []
+        self.clock = time.time
+        # 设置后EVAL/EVALSHA返回该错误回复（模拟OOM、READONLY等）
+        self.error = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def token_bucket(self, bucket, rcap, tcap, tokens):
+        """与TOKEN_BUCKET_SCRIPT等价的原子操作"""
+        with self.lock:
+            now = self.clock()
+            state = self.hashes.get(bucket, {})
+            r = state.get("r", rcap)
+            tk = state.get("t", tcap)
+            elapsed = now - state.get("u", now)
+            if elapsed > 0:
+                if rcap > 0:
+                    r = min(rcap, r + elapsed * rcap / 60)
+                if tcap > 0:
+                    tk = min(tcap, tk + elapsed * tcap / 60)
+            wait = 0.0
+            if rcap > 0 and r < 1:
+                wait = (1 - r) * 60 / rcap
+            if tcap > 0 and tk < tokens:
+                wait = max(wait, (tokens - tk) * 60 / tcap)
+            if wait == 0:
+                if rcap > 0:
+                    r -= 1
+                if tcap > 0:
+                    tk -= tokens
+            self.hashes[bucket] = {"r": r, "t": tk, "u": now}
+            return repr(wait)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith(b"*")
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+        return args
+
+    def _bulk(self, value: str) -> bytes:
+        data = value.encode('utf-8')
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            server.commands.append(command)
+            if command == "PING":
+                reply = b"+PONG\r\n"
+            elif command in ("EVAL", "EVALSHA"):
+                if command == "EVAL":
+                    assert args[1] == TOKEN_BUCKET_SCRIPT
+                    server.scripts.add(TOKEN_BUCKET_SHA)
+                    sha = TOKEN_BUCKET_SHA
+                else:
+                    sha = args[1]
+                if server.error is not None:
+                    reply = b"-%s\r\n" % server.error.encode('utf-8')
+                elif sha not in server.scripts:
+                    reply = b"-NOSCRIPT No matching script. Please use EVAL.\r\n"
+                else:
+                    bucket, rcap, tcap, tokens = args[3], float(args[4]), float(args[5]), float(args[6])
+                    reply = self._bulk(server.token_bucket(bucket, rcap, tcap, tokens))
+            else:
+                reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+            self.wfile.flush()
+
+
+@pytest.fixture
+def redis_server():
+    server = _StandInRedis()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestRESPClient:
+    """测试最小RESP客户端"""
+
+    def test_ping_and_error_reply(self, redis_server):
+        """测试简单字符串和错误回复，错误后连接仍可复用"""
+        client = RESPClient(redis_server.url)
+        assert client.execute("PING") == "PONG"
+        with pytest.raises(RedisError):
+            client.execute("FLUSHALL")
+        assert client.execute("PING") == "PONG"
+        assert len(client._idle) == 1
+        client.close()
+
+
+class TestRedisRateLimiter:
+    """测试分布式令牌桶"""
+
+    RATES = {"openai": {"rpm": 5, "tpm": 1000}}
+
+    def test_limit_shared_across_replicas(self, redis_server):
+        """测试多个副本共享同一个桶，总量不超过rpm"""
+        replicas = [RedisRateLimiter(redis_server.url, self.RATES) for _ in range(3)]
+        granted = sum(limiter.try_acquire("openai") for _ in range(4) for limiter in replicas)
+        assert granted == 5
+        for limiter in replicas:
+            limiter.close()
+
+    def test_one_round_trip_per_acquire(self, redis_server):
+        """测试脚本缓存后每次获取只有一条EVALSHA命令"""
+        limiter = RedisRateLimiter(redis_server.url, self.RATES)
+        limiter.try_acquire("openai")
+        assert redis_server.commands == ["EVALSHA", "EVAL"]
+        redis_server.commands.clear()
+        limiter.try_acquire("openai", tokens=10)
+        limiter.try_acquire("openai", tokens=10, key="sk-other")
+        assert redis_server.commands == ["EVALSHA", "EVALSHA"]
+        assert not any("sk-other" in bucket for bucket in redis_server.hashes)
+        limiter.close()
+
+    def test_token_limit_and_blocking_acquire(self, redis_server):
+        """测试token限额和阻塞等待补充"""
+        limiter = RedisRateLimiter(redis_server.url, {"fast": {"rpm": 600, "tpm": 600}})
+        assert limiter.try_acquire("fast", tokens=600)
+        assert not limiter.try_acquire("fast", tokens=10)
+        assert limiter.acquire("fast", tokens=5, timeout=2.0)
+        assert not limiter.acquire("fast", tokens=300, timeout=0.01)
+        with pytest.raises(ValueError):
+            limiter.try_acquire("fast", tokens=1000)
+        limiter.close()
+
+    def test_unlimited_service_skips_redis(self, redis_server):
+        """测试未配置速率的服务不访问Redis"""
+        limiter = RedisRateLimiter(redis_server.url, self.RATES)
+        assert limiter.try_acquire("news_api")
+        assert redis_server.commands == []
+        limiter.close()
+
+    def test_fallback_when_unreachable(self):
+        """测试Redis不可用时退回进程内限流"""
+        limiter = RedisRateLimiter(f"redis://127.0.0.1:{_free_port()}/0", self.RATES,
+                                   retry_interval=60)
+        assert sum(limiter.try_acquire("openai") for _ in range(10)) == 5
+        assert not limiter.available
+        limiter.close()
+
+    def test_fallback_on_server_error(self, redis_server):
+        """测试服务端错误回复（如OOM）时退回进程内限流而不是抛出"""
+        redis_server.error = "OOM command not allowed when used memory > 'maxmemory'."
+        limiter = RedisRateLimiter(redis_server.url, self.RATES, retry_interval=60)
+        assert sum(limiter.try_acquire("openai") for _ in range(10)) == 5
+        assert not limiter.available
+        limiter.close()
+
+    def test_fallback_when_auth_fails(self, redis_server):
+        """测试认证失败时退回进程内限流，失败的连接不进入连接池"""
+        url = redis_server.url.replace("redis://", "redis://:wrong-password@")
+        limiter = RedisRateLimiter(url, self.RATES, retry_interval=60)
+        assert limiter.acquire("openai", timeout=0)
+        assert not limiter.available
+        assert limiter.client._idle == []
+        limiter.close()
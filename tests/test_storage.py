@@ -0,0 +1,485 @@
+"""
+存储引擎测试
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+import pytest
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from api_key_manager import APIKeyManager
+from storage import KeyStore, MmapKeyStore, SharedKeyCache, ShardedKeyStore, create_key_store
+from storage.journal import JournalStore
+
+
+@pytest.fixture(autouse=True)
+def isolated_env():
+    """隔离set_api_key写入的环境变量"""
+    with patch.dict(os.environ):
+        yield
+
+
+@pytest.fixture(params=["memory", "json", "sqlite", "mmap", "sharded"])
+def backend(request):
+    """存储后端名称"""
+    return request.param
+
+
+@pytest.fixture
+def key_store(backend, tmp_path):
+    """各存储后端"""
+    store = create_key_store(backend, str(tmp_path / f"keys.{backend}"))
+    yield store
+    store.close()
+
+
+class TestKeyStoreConformance:
+    """所有存储后端必须满足的行为"""
+
+    def test_implements_protocol(self, key_store):
+        """测试实现KeyStore接口"""
+        assert isinstance(key_store, KeyStore)
+
+    def test_set_get_delete(self, key_store):
+        """测试基本读写"""
+        assert key_store.get("openai") is None
+        key_store.set("openai", "sk-1")
+        key_store.set("openai", "sk-2")
+        assert key_store.get("openai") == "sk-2"
+        assert key_store.delete("openai") is True
+        assert key_store.delete("openai") is False
+        assert key_store.get("openai") is None
+
+    def test_set_many_and_items(self, key_store):
+        """测试批量写入和列举"""
+        keys = {f"service{i}": f"key-{i}" for i in range(50)}
+        key_store.set_many(keys)
+        items = key_store.items()
+        assert items == keys
+        items["service0"] = "mutated"
+        assert key_store.get("service0") == "key-0"
+
+    def test_delete_many(self, key_store):
+        """测试批量删除"""
+        key_store.set_many({f"service{i}": f"key-{i}" for i in range(20)})
+        assert key_store.delete_many([f"service{i}" for i in range(10)] + ["missing"]) == 10
+        assert key_store.delete_many([]) == 0
+        assert set(key_store.items()) == {f"service{i}" for i in range(10, 20)}
+
+    def test_persistence(self, backend, key_store):
+        """测试持久化后端重新打开后数据仍在"""
+        if backend == "memory":
+            pytest.skip("内存后端不持久化")
+        key_store.set("openai", "sk-1")
+        key_store.close()
+        reopened = create_key_store(backend, key_store.path)
+        assert reopened.get("openai") == "sk-1"
+        reopened.close()
+
+    def test_default_path_per_backend(self, backend, tmp_path):
+        """测试未指定路径时各后端在目录下使用自己的默认文件"""
+        store = create_key_store(backend, None, directory=str(tmp_path))
+        store.set("openai", "sk-1")
+        store.close()
+        reopened = create_key_store(backend, None, directory=str(tmp_path))
+        if backend != "memory":
+            assert reopened.get("openai") == "sk-1"
+        reopened.close()
+
+    def test_throughput(self, key_store):
+        """测试吞吐量并输出每秒操作数，便于按部署选择后端"""
+        count = 200
+        start = time.perf_counter()
+        for i in range(count):
+            key_store.set(f"service{i}", f"key-{i}")
+        write_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(count):
+            assert key_store.get(f"service{i}") == f"key-{i}"
+        read_elapsed = time.perf_counter() - start
+
+        print(f"\n{type(key_store).__name__}: "
+              f"写入 {count / write_elapsed:,.0f} ops/s, 读取 {count / read_elapsed:,.0f} ops/s")
+
+    def test_manager_uses_key_store(self, key_store, tmp_path):
+        """测试APIKeyManager通过存储后端读写密钥"""
+        key_store.set("conformance_a", "key-a-1")
+        manager = APIKeyManager(str(tmp_path / "config.json"), key_store=key_store)
+        assert manager.get_api_key("conformance_a") == "key-a-1"
+
+        manager.set_api_key("conformance_b", "key-b-1")
+        manager.remove_api_key("conformance_a")
+        assert key_store.items() == {"conformance_b": "key-b-1"}
+
+
+class TestMmapKeyStore:
+    """测试内存映射存储"""
+
+    def test_lookup_many_keys(self, tmp_path):
+        """测试大量密钥的哈希查找"""
+        path = str(tmp_path / "keys.bin")
+        keys = {f"service{i}": f"key-{i}-密钥" for i in range(5000)}
+        MmapKeyStore.write(path, keys)
+
+        store = MmapKeyStore(path)
+        assert len(store) == 5000
+        assert store.get("service4999") == "key-4999-密钥"
+        assert store.get("missing") is None
+        assert store.items() == keys
+        store.close()
+
+    def test_refresh_after_external_rewrite(self, tmp_path):
+        """测试其它进程重建文件后，读取时发现旧文件已被标记替换并重新映射"""
+        path = str(tmp_path / "keys.bin")
+        reader = MmapKeyStore(path)
+        MmapKeyStore.write(path, {"openai": "sk-new"})
+
+        assert reader.get("openai") == "sk-new"
+        assert reader.refresh() is False
+        reader.close()
+
+    def test_writers_merge_latest_version(self, tmp_path):
+        """测试两个实例交替写入同一文件时互不覆盖"""
+        path = str(tmp_path / "keys.bin")
+        first, second = MmapKeyStore(path), MmapKeyStore(path)
+        first.set("x", "key-x")
+        second.set("y", "key-y")
+        first.set_many({"z": "key-z"})
+        assert second.delete("x") is True
+        assert first.items() == {"y": "key-y", "z": "key-z"}
+        assert MmapKeyStore(path).items() == {"y": "key-y", "z": "key-z"}
+        first.close()
+        second.close()
+
+    def test_from_config(self, tmp_path, temp_config_file):
+        """测试从JSON配置生成二进制存储"""
+        store = MmapKeyStore.from_config(temp_config_file, str(tmp_path / "keys.bin"))
+        assert store.get("openai") == "sk-test-openai-key"
+        store.close()
+
+    def test_rejects_foreign_file(self, tmp_path):
+        """测试拒绝非存储格式文件"""
+        path = tmp_path / "keys.bin"
+        path.write_bytes(b"not a key store at all")
+        with pytest.raises(ValueError):
+            MmapKeyStore(str(path))
+
+
+class TestShardedKeyStore:
+    """测试分片存储"""
+
+    def test_lazy_loading_and_lru(self, tmp_path):
+        """测试分片按需加载且常驻数量受限"""
+        directory = str(tmp_path / "shards")
+        writer = ShardedKeyStore(directory, shard_count=16)
+        writer.set_many({f"service{i}": f"key-{i}" for i in range(1000)})
+        writer.close()
+
+        store = ShardedKeyStore(directory, max_resident=2)
+        assert store.resident_shards == 0
+        assert store.get("service1") == "key-1"
+        assert store.loads == 1
+        assert store.get("service1") == "key-1"
+        assert store.loads == 1
+
+        for i in range(1000):
+            store.get(f"service{i}")
+        assert store.resident_shards == 2
+        assert len(store.items()) == 1000
+
+    def test_write_touches_single_shard(self, tmp_path):
+        """测试写入只重写目标分片"""
+        directory = str(tmp_path / "shards")
+        store = ShardedKeyStore(directory, shard_count=8)
+        store.set("openai", "sk-1")
+
+        shard_files = [name for name in os.listdir(directory) if name.startswith("shard-")]
+        assert shard_files == [f"shard-{store.shard_of('openai'):04d}.json"]
+
+    def test_instances_see_each_others_writes(self, tmp_path):
+        """测试两个实例写同一分片时互不覆盖，常驻分片在文件改写后重新加载"""
+        directory = str(tmp_path / "shards")
+        first = ShardedKeyStore(directory, shard_count=1)
+        second = ShardedKeyStore(directory, shard_count=1)
+        first.set("x", "key-x")
+        assert second.get("x") == "key-x"
+        second.set("y", "key-y")
+        assert first.get("y") == "key-y"
+        first.set("z", "key-z")
+        assert second.delete("x") is True
+        assert first.items() == second.items() == {"y": "key-y", "z": "key-z"}
+
+    def test_reopen_keeps_shard_count(self, tmp_path):
+        """测试重新打开时沿用已有的分片数"""
+        directory = str(tmp_path / "shards")
+        ShardedKeyStore(directory, shard_count=8).set("openai", "sk-1")
+
+        store = ShardedKeyStore(directory, shard_count=32)
+        assert store.shard_count == 8
+        assert store.get("openai") == "sk-1"
+
+
+@pytest.fixture
+def cache_name():
+    """每个测试独立的共享内存段名称，结束后删除"""
+    name = f"akm_{uuid.uuid4().hex[:8]}"
+    yield name
+    cache = SharedKeyCache(name)
+    cache.unlink()
+    cache.close()
+
+
+class TestSharedKeyCache:
+    """测试共享内存缓存"""
+
+    def test_publish_and_read(self, cache_name):
+        """测试发布后其它实例零拷贝读取"""
+        writer = SharedKeyCache(cache_name)
+        reader = SharedKeyCache(cache_name)
+        assert reader.published() is False
+        assert reader.get("openai") is None
+
+        assert writer.publish({"openai": "sk-1", "中文服务": "密钥"}) == 1
+        assert reader.get("openai") == "sk-1"
+        assert reader.items() == {"openai": "sk-1", "中文服务": "密钥"}
+
+        assert writer.publish({"openai": "sk-2"}) == 2
+        assert reader.get("openai") == "sk-2"
+        assert reader.get("中文服务") is None
+        writer.close()
+        reader.close()
+
+    def test_manager_reads_through_cache(self, tmp_path, cache_name):
+        """测试多个管理器通过共享内存看到彼此的写入"""
+        first = APIKeyManager(str(tmp_path / "a.json"), shared_cache=cache_name)
+        second = APIKeyManager(str(tmp_path / "b.json"), shared_cache=cache_name)
+
+        first.set_api_key("cached_service", "cached-key-123")
+        os.environ.pop("CACHED_SERVICE_API_KEY")
+        assert second.get_api_key("cached_service") == "cached-key-123"
+        assert "cached_service" in second.list_all_keys()
+        first.close()
+        second.close()
+
+    def test_restart_republishes_from_config(self, tmp_path, cache_name):
+        """测试重启时从配置文件重新发布，不沿用上次运行留下的共享段"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, shared_cache=cache_name)
+        manager.set_api_key("restart_service", "restart-key-old")
+        manager.close()
+
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config["api_keys"]["restart_service"] = "restart-key-new"
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+
+        os.environ.pop("RESTART_SERVICE_API_KEY")
+        restarted = APIKeyManager(config_path, shared_cache=cache_name)
+        assert restarted.get_api_key("restart_service") == "restart-key-new"
+        restarted.close()
+
+
+class TestJournalStore:
+    """测试追加日志存储"""
+
+    def test_replay_snapshot_and_journal(self, tmp_path):
+        """测试重启后快照与日志都能恢复"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, backend="journal")
+        manager.set_api_key("openai", "sk-openai-123")
+        manager.set_api_key("anthropic", "sk-ant-456")
+        manager.remove_api_key("openai")
+        manager.close()
+
+        reloaded = APIKeyManager(config_path, backend="journal")
+        assert reloaded.config["api_keys"] == {"anthropic": "sk-ant-456"}
+        assert "endpoints" in reloaded.config
+        reloaded.close()
+
+    def test_write_does_not_rewrite_snapshot(self, tmp_path):
+        """测试单次写入只追加日志"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, backend="journal")
+        snapshot_mtime = os.stat(config_path).st_mtime_ns
+
+        manager.set_api_key("openai", "sk-openai-123")
+        manager.close()
+
+        assert os.stat(config_path).st_mtime_ns == snapshot_mtime
+        with open(f"{config_path}.journal", encoding='utf-8') as f:
+            assert len(f.readlines()) == 1
+
+    def test_compaction(self, tmp_path):
+        """测试达到阈值后压缩为快照"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, backend="journal", compact_threshold=5)
+        for i in range(12):
+            manager.set_api_key(f"service{i}", f"key-{i}")
+        manager.close()
+
+        with open(config_path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        assert len(snapshot["api_keys"]) >= 5
+        assert not os.path.exists(f"{config_path}.journal.old")
+
+        reloaded = APIKeyManager(config_path, backend="journal")
+        assert len(reloaded.config["api_keys"]) == 12
+        reloaded.close()
+
+    def test_torn_tail_is_discarded(self, tmp_path):
+        """测试崩溃留下的半条记录被丢弃"""
+        snapshot_path = str(tmp_path / "config.json")
+        store = JournalStore(snapshot_path)
+        store.append("set", "api_keys", "openai", "sk-1")
+        store.close()
+        with open(store.journal_path, 'a', encoding='utf-8') as f:
+            f.write('{"op":"set","section":"api_keys","na')
+
+        store = JournalStore(snapshot_path)
+        assert store.load() == {"api_keys": {"openai": "sk-1"}}
+        store.append("set", "api_keys", "anthropic", "sk-2")
+        store.close()
+
+        assert JournalStore(snapshot_path).load() == {
+            "api_keys": {"openai": "sk-1", "anthropic": "sk-2"}
+        }
+
+    def test_unfinished_compaction_is_recovered(self, tmp_path):
+        """测试压缩中途退出留下的旧日志会被合并"""
+        snapshot_path = str(tmp_path / "config.json")
+        store = JournalStore(snapshot_path)
+        store.append("set", "api_keys", "openai", "sk-1")
+        store.close()
+        os.replace(store.journal_path, store.rotated_path)
+
+        store = JournalStore(snapshot_path)
+        assert store.load() == {"api_keys": {"openai": "sk-1"}}
+        assert not os.path.exists(store.rotated_path)
+        assert os.path.exists(snapshot_path)
+
+
+class TestGroupCommit:
+    """测试组提交写入"""
+
+    def test_concurrent_saves_are_coalesced(self, tmp_path):
+        """测试并发保存被合并为少量原子写入"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, group_commit_window=0.02)
+        futures = []
+
+        def writer(start):
+            for i in range(start, start + 25):
+                futures.append(manager.set_api_key(f"service{i}", f"key-{i}"))
+
+        threads = [threading.Thread(target=writer, args=(n * 25,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for future in futures:
+            future.result(timeout=5)
+
+        with open(config_path, encoding='utf-8') as f:
+            assert len(json.load(f)["api_keys"]) == 100
+        assert manager._writer.commits < 100
+        manager.close()
+
+    def test_close_flushes_pending_writes(self, tmp_path):
+        """测试关闭时写完剩余变更"""
+        config_path = str(tmp_path / "config.json")
+        manager = APIKeyManager(config_path, group_commit_window=10)
+        future = manager.set_api_key("openai", "sk-openai-123")
+        manager.close()
+
+        assert future.done()
+        assert APIKeyManager(config_path).config["api_keys"] == {"openai": "sk-openai-123"}
+
+
+def _multiprocess_writer(config_path, backend, worker, count):
+    """子进程：通过各自的管理器并发写入"""
+    manager = APIKeyManager(config_path, backend=backend, compact_threshold=20,
+                            multiprocess=True)
+    for i in range(count):
+        manager.set_api_key(f"worker{worker}_service{i}", f"key-{worker}-{i}")
+    manager.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="需要fork启动子进程")
+class TestMultiProcess:
+    """测试多进程共享配置文件"""
+
+    @pytest.mark.parametrize("backend", ["json", "journal"])
+    def test_no_lost_updates(self, tmp_path, backend):
+        """测试多个进程并发写入不丢失更新"""
+        config_path = str(tmp_path / "config.json")
+        APIKeyManager(config_path, backend=backend, multiprocess=True).close()
+
+        ctx = multiprocessing.get_context("fork")
+        workers = [
+            ctx.Process(target=_multiprocess_writer, args=(config_path, backend, n, 30))
+            for n in range(4)
+        ]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+            assert p.exitcode == 0
+
+        manager = APIKeyManager(config_path, backend=backend, multiprocess=True)
+        assert len(manager.snapshot()["api_keys"]) == 120
+        manager.close()
+
+    @pytest.mark.parametrize("backend", ["json", "journal"])
+    def test_reader_sees_other_writer(self, tmp_path, backend):
+        """测试读取前检测到其它实例的写入并增量加载"""
+        config_path = str(tmp_path / "config.json")
+        first = APIKeyManager(config_path, backend=backend, multiprocess=True)
+        second = APIKeyManager(config_path, backend=backend, multiprocess=True)
+
+        first.set_api_key("shared_service", "shared-key-1")
+        assert second.snapshot()["api_keys"]["shared_service"] == "shared-key-1"
+
+        second.set_api_key("other_service", "other-key-1")
+        assert first.snapshot()["api_keys"] == {
+            "shared_service": "shared-key-1", "other_service": "other-key-1"
+        }
+
+        first.remove_api_key("shared_service")
+        assert "shared_service" not in second.snapshot()["api_keys"]
+        first.close()
+        second.close()
+
+    @pytest.mark.parametrize("backend", ["json", "mmap", "sharded", "sqlite"])
+    def test_instances_share_key_store(self, tmp_path, backend):
+        """测试两个实例通过同一存储后端写入时互不覆盖"""
+        path = str(tmp_path / "keys")
+        config_path = str(tmp_path / "config.json")
+        first = APIKeyManager(config_path, multiprocess=True,
+                              key_store=create_key_store(backend, path))
+        second = APIKeyManager(config_path, multiprocess=True,
+                               key_store=create_key_store(backend, path))
+        first.set_api_key("first_service", "first-key-1")
+        second.set_api_key("second_service", "second-key-1")
+        assert first.get_api_key("second_service") == "second-key-1"
+        assert create_key_store(backend, path).items() == {
+            "first_service": "first-key-1", "second_service": "second-key-1"
+        }
+        first.close()
+        second.close()
+
+    def test_rejects_process_local_store(self, tmp_path):
+        """测试只在进程内可见的存储不能用于多进程模式"""
+        with pytest.raises(ValueError):
+            APIKeyManager(str(tmp_path / "config.json"), multiprocess=True,
+                          key_store=create_key_store("memory"))